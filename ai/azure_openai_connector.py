@@ -1,55 +1,52 @@
 #!/usr/bin/env python3
 import base64
+import io
 import json
 import os
-import time
 import random
+import threading
+import time
 
-from typing import List, Tuple
-from openai import RateLimitError
+from typing import Callable, List, Tuple, Dict, Optional
+from urllib.parse import urlparse
+from openai import RateLimitError, APIConnectionError, InternalServerError
 from langchain.callbacks import get_openai_callback
 from langchain.chat_models import AzureChatOpenAI
 from langchain.schema import HumanMessage
+from langchain_community.adapters.openai import convert_message_to_dict
+from langchain_community.callbacks.openai_info import (
+    MODEL_COST_PER_1K_TOKENS, get_openai_token_cost_for_model, standardize_model_name
+)
+from PIL import Image
 
 import setup
+from ai.deployment_router import DeploymentRouter
+from ai.json_stream import JsonStreamParser, extract_json
+from ai.rate_limiter import RateLimiter, estimate_request_tokens
+from ai.response_cache import ResponseCache
 from log_handling import log_handler
 from log_handling.log_handler import Logger, Module
+from metrics_handling import metrics_handler
+from metrics_handling.metrics_handler import Metrics
 
 logger: Logger = log_handler.get_instance()
+metrics: Metrics = metrics_handler.get_instance()
 
 
 class AzureOpenAIAdapter:
     """
     Handles the Azure OpenAI connection
     """
-    CONFIG: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.json')
-
-    @staticmethod
-    def __remove_text_before_json(gpt_response: str) -> str:
-        """
-        Removes any text and comments before a json response from gpt.
-        :param gpt_response: gpt's response.
-        :return: the filtered response.
-        """
-        if '{' not in gpt_response or '}' not in gpt_response:
-            return gpt_response
-        idx = gpt_response.index('{')
-        gpt_response = (gpt_response[idx:])[::-1]
-        idx = gpt_response.index('}')
-        gpt_response = (gpt_response[idx:])[::-1]
-        return gpt_response
-
-    @staticmethod
-    def __remove_text_after_json(gpt_response: str) -> str:
-        """
-        Remove trailing comment after json response from GPT.
-        :param gpt_response: response from gpt api.
-        :return: the cleaned response.
-        """
-        index_of_brace = gpt_response.find("`")
-        if index_of_brace != -1:
-            gpt_response = gpt_response[:index_of_brace + 1]
-        return gpt_response
+    # The config can be replaced, e.g. to point the adapter at the mock server of the benchmarks.
+    CONFIG: str = os.getenv('AZURE_OPENAI_CONFIG') or \
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.json')
+    # Errors worth retrying - the request did not reach the model or the deployment is overloaded.
+    RETRIABLE_ERRORS: Tuple = (RateLimitError, APIConnectionError, InternalServerError)
+    # Exponential backoff with full jitter, in seconds.
+    BACKOFF_BASE: float = 1
+    BACKOFF_MAX: float = 60
+    # Completion tokens reserved per request if not configured.
+    DEFAULT_COMPLETION_TOKENS: int = 1000
 
     @staticmethod
     def __load_configs(config_file_path: str):
@@ -61,13 +58,15 @@ class AzureOpenAIAdapter:
         with open(config_file_path) as config_file:
             return json.load(config_file)
 
-    def __llm_init(self) -> AzureChatOpenAI:
+    @staticmethod
+    def __llm_init(configs: Dict[str, any]) -> AzureChatOpenAI:
         """
-        Load the azure chatbot configs and return the LLM objects.
+        Create the LLM object from the azure chatbot configs.
+        :param configs: the azure chatbot configs.
         :return: the azure chatbot instance.
         """
-        configs = self.__load_configs(config_file_path=self.CONFIG)
-        openai_api_key: str = setup.OPENAI_API_KEY
+        # Keys are never part of the config file, a deployment may name its own environment variable.
+        openai_api_key: str = os.getenv(configs['API_KEY_ENV']) if configs.get('API_KEY_ENV') else setup.OPENAI_API_KEY
         openai_api_base: str = configs['OPENAI_API_BASE']
         openai_api_version: str = configs['OPENAI_API_VERSION']
         deployment_name: str = configs['DEPLOYMENT_NAME']
@@ -83,8 +82,50 @@ class AzureOpenAIAdapter:
             deployment_name=deployment_name,
             openai_api_key=openai_api_key,
             openai_api_type=openai_api_type,
+            # Retries are handled by the adapter, so that they go through the rate limiter.
+            max_retries=0,
         )
 
+    @staticmethod
+    def __rate_limiter_init(configs: Dict[str, any]) -> RateLimiter:
+        """
+        Create the rate limiter for the deployment's TPM and RPM quota.
+        :param configs: the azure chatbot configs.
+        :return: the rate limiter.
+        """
+        tokens_per_minute: Optional[int] = configs.get('TOKENS_PER_MINUTE')
+        requests_per_minute: Optional[int] = configs.get('REQUESTS_PER_MINUTE')
+        logger.debug(f'Rate limits: {tokens_per_minute} TPM, {requests_per_minute} RPM.', module=Module.AZR)
+        return RateLimiter(tokens_per_minute=tokens_per_minute, requests_per_minute=requests_per_minute)
+
+    def __deployment_init(self, configs: Dict[str, any], deployment_configs: Dict[str, any]) -> Dict[str, any]:
+        """
+        Create the llm and the rate limiter of a deployment.
+        :param configs: the azure chatbot configs, the defaults of the deployment.
+        :param deployment_configs: the configs of the deployment, an entry of DEPLOYMENTS.
+        :return: the deployment.
+        :raise ValueError: if the weight of the deployment is not a positive number.
+        """
+        configs = {**configs, **deployment_configs}
+        name: str = configs.get('NAME') or \
+            f'{urlparse(configs["OPENAI_API_BASE"]).netloc}/{configs["DEPLOYMENT_NAME"]}'
+        logger.debug(f'Adding deployment {name}.', module=Module.AZR)
+        try:
+            weight: float = float(configs.get('WEIGHT', 1))
+        except (TypeError, ValueError):
+            weight = float('nan')
+        if not weight > 0:
+            logger.error(f'WEIGHT of deployment {name} must be a positive number, got {configs.get("WEIGHT")!r}.',
+                         module=Module.AZR)
+            raise ValueError(f'Invalid WEIGHT of deployment {name}.')
+        return {
+            'name': name,
+            'deployment_name': configs['DEPLOYMENT_NAME'],
+            'weight': weight,
+            'llm': self.__llm_init(configs=configs),
+            'rate_limiter': self.__rate_limiter_init(configs=configs)
+        }
+
     def __init__(self):
         """
         Creates the azure chatbot instance.
@@ -93,7 +134,22 @@ class AzureOpenAIAdapter:
         """
         try:
             logger.debug('Creating azure chatbot instance...', module=Module.AZR)
-            self.llm: AzureChatOpenAI = self.__llm_init()
+            configs: Dict[str, any] = self.__load_configs(config_file_path=self.CONFIG)
+            # Without DEPLOYMENTS, the top level configs are the only deployment.
+            deployments: List[Dict[str, any]] = configs.pop('DEPLOYMENTS', None) or [{}]
+            self.router: DeploymentRouter = DeploymentRouter(
+                deployments=[self.__deployment_init(configs, deployment) for deployment in deployments]
+            )
+            self.completion_tokens: int = configs.get('EXPECTED_COMPLETION_TOKENS', self.DEFAULT_COMPLETION_TOKENS)
+            # All deployments serve the same model, their responses are cached under one name.
+            self.deployment_name: str = configs.get('DEPLOYMENT_NAME') or self.router.deployments[0]['deployment_name']
+            # Stream the completions and parse them while they arrive.
+            self.streaming: bool = bool(configs.get('STREAMING', False))
+            # Constrain the responses to the json schemas of the prompts, needs a model and api version supporting it.
+            self.structured_outputs: bool = bool(configs.get('STRUCTURED_OUTPUTS', False))
+            self.response_cache: Optional[ResponseCache] = None
+            if setup.RESPONSE_CACHE_MAX_BYTES > 0:
+                self.response_cache = ResponseCache()
             logger.debug('Azure chatbot initialised.', module=Module.AZR)
         except Exception as e:
             logger.error('Error creating azure chatbot - Configurations missing. Terminating.', module=Module.AZR)
@@ -101,81 +157,394 @@ class AzureOpenAIAdapter:
             exit(-1)
 
     @staticmethod
-    def __debug_cost(response, cb) -> None:
+    def __record_usage(prompt_tokens: int, completion_tokens: int, cost: float) -> None:
+        """
+        Records the tokens and the cost of a request.
+        :param prompt_tokens: the prompt tokens of the request.
+        :param completion_tokens: the completion tokens of the request.
+        :param cost: the cost of the request in USD.
+        :return:
+        """
+        metrics.inc('llm_requests_total', outcome='ok')
+        metrics.inc('llm_tokens_total', prompt_tokens, direction='prompt')
+        metrics.inc('llm_tokens_total', completion_tokens, direction='completion')
+        metrics.inc('llm_cost_usd_total', cost)
+
+    @staticmethod
+    def __debug_cost(response: str, cost: float) -> None:
         logger.debug(response, module=Module.AZR)
-        logger.debug(f"Total Cost (USD): ${format(cb.total_cost, '.6f')}", module=Module.AZR)
+        logger.debug('Total Cost (USD):', cost, module=Module.AZR)
 
     @staticmethod
-    def __get_image_data(image_uri: str) -> Tuple[str, str]:
+    def __get_cost(model_name: str, prompt_tokens: int, completion_tokens: int) -> float:
         """
-        Get the encoded image data and the image type as a tuple.
+        Computes the cost of a streamed request like the openai callback does for the other requests.
+        :param model_name: the model name of the response.
+        :param prompt_tokens: the prompt tokens of the request.
+        :param completion_tokens: the completion tokens of the request.
+        :return: the cost in USD, 0 for unknown models.
+        """
+        model_name = standardize_model_name(model_name)
+        if model_name not in MODEL_COST_PER_1K_TOKENS:
+            return 0
+        return get_openai_token_cost_for_model(model_name, prompt_tokens) + \
+            get_openai_token_cost_for_model(model_name, completion_tokens, is_completion=True)
+
+    @staticmethod
+    def __get_image_data(image_uri: str) -> Tuple[bytes, str]:
+        """
+        Get the raw image data and the image type as a tuple.
         :param image_uri: uri to the image on the file system.
-        :return: the encoded image data and the image type.
+        :return: the image data and the image type.
         """
-        image_data = base64.b64encode(open(image_uri, 'rb').read()).decode('ascii')
+        with open(image_uri, 'rb') as image_file:
+            image_data: bytes = image_file.read()
         image_type = 'jpg'
         if '.png' in image_uri:
             image_type = 'png'
         elif '.jpeg' in image_uri:
             image_type = 'jpeg'
+        elif '.webp' in image_uri:
+            image_type = 'webp'
         return image_data, image_type
 
-    def __build_llm_template(self, template: str, image_uri: str) -> List:
+    @staticmethod
+    def __build_llm_template(template: str, images: List[Tuple[bytes, str]]) -> List:
         """
         Set the llm response type and data format.
+        :param template: the text template of the request.
+        :param images: the raw data and the type of each image of the request, in order.
         :return: the llm properties as a list.
         """
         content = [{"type": "text", "text": template}]
-        if len(image_uri) and image_uri.strip() != '':
-            image_data, image_type = self.__get_image_data(image_uri=image_uri)
+        for image_data, image_type in images:
+            with metrics.time('llm_step_seconds', step='base64'):
+                encoded_image: str = base64.b64encode(image_data).decode('ascii')
             content.append({
                 "type": "image_url",
-                "image_url": {"url": f"data:image/{image_type};base64,{image_data}"},
+                "image_url": {"url": f"data:image/{image_type};base64,{encoded_image}"},
             })
-        return [
-            HumanMessage(
-                content=content,
-                response_format={
-                    "type": "json_object"
-                },
-            )
-        ]
+        return [HumanMessage(content=content)]
+
+    def __get_response_format(self, response_schema: Optional[Dict[str, any]]) -> Dict[str, any]:
+        """
+        Get the response format of a request, the json schema of the prompt if structured outputs are enabled.
+        :param response_schema: the json schema of the response, if any.
+        :return: the response format.
+        """
+        if self.structured_outputs and response_schema is not None:
+            return {"type": "json_schema", "json_schema": response_schema}
+        return {"type": "json_object"}
+
+    def __estimate_tokens(self, template: str, images: List[Tuple[bytes, str]]) -> int:
+        """
+        Estimates the tokens of a request for the rate limiter.
+        :param template: the text template of the request.
+        :param images: the raw data and the type of each image of the request.
+        :return: the estimated number of tokens.
+        """
+        image_sizes: List[Tuple[int, int]] = []
+        for image_data, _ in images:
+            # Only reads the image header.
+            with Image.open(io.BytesIO(image_data)) as image:
+                image_sizes.append(image.size)
+        return estimate_request_tokens(
+            prompt=template,
+            image_sizes=image_sizes,
+            completion_tokens=self.completion_tokens
+        )
+
+    def __prepare_request(
+            self,
+            template: str,
+            image_uri: str,
+            image_data: bytes,
+            image_type: str,
+            response_format: Dict[str, any],
+            images: Optional[List[Tuple[bytes, str]]] = None
+    ) -> Tuple[List, int, str]:
+        """
+        Reads the image once and prepares everything needed to send the request.
+        :param template: the text template of the request.
+        :param image_uri: file system uri to the image of the request, if any.
+        :param image_data: the encoded image of the request, used instead of the image uri.
+        :param image_type: the type of the encoded image.
+        :param response_format: the response format of the request, part of the cache key.
+        :param images: the encoded images of a request with several images, used instead of the single image.
+        :return: the llm messages, the estimated tokens and the cache key of the request.
+        """
+        if images is None:
+            if not len(image_data) and len(image_uri) and image_uri.strip() != '':
+                image_data, image_type = self.__get_image_data(image_uri=image_uri)
+            images = [(image_data, image_type)] if len(image_data) else []
+        messages: List = self.__build_llm_template(template=template, images=images)
+        tokens: int = self.__estimate_tokens(template=template, images=images)
+        cache_key: str = ResponseCache.build_key(
+            self.deployment_name,
+            json.dumps(response_format, sort_keys=True),
+            template,
+            *(data for data, _ in images)
+        )
+        return messages, tokens, cache_key
+
+    def __get_cached_response(self, cache_key: str) -> Optional[str]:
+        """
+        Looks up the response of a request in the response cache.
+        :param cache_key: the cache key of the request.
+        :return: the cached response, or None.
+        """
+        if self.response_cache is None:
+            return None
+        response: Optional[str] = self.response_cache.get(cache_key)
+        if response is not None:
+            logger.debug('Serving response from cache:', cache_key, module=Module.AZR)
+        return response
+
+    def __cache_response(self, cache_key: str, response: str) -> None:
+        """
+        Stores a response in the response cache, if it is valid json.
+        :param cache_key: the cache key of the request.
+        :param response: the llm's response.
+        :return:
+        """
+        if self.response_cache is None:
+            return
+        try:
+            json.loads(response)
+        except ValueError:
+            # Never serve a broken response again, the next run should ask the model.
+            return
+        self.response_cache.put(cache_key, response)
+
+    @staticmethod
+    def __get_retry_after(error: Exception) -> Optional[float]:
+        """
+        Reads the Retry-After time from the error response, if available.
+        :param error: the error raised by the openai client.
+        :return: the number of seconds to wait, or None.
+        """
+        response = getattr(error, 'response', None)
+        if response is None:
+            return None
+        for header, factor in (('retry-after-ms', 0.001), ('retry-after', 1)):
+            try:
+                return float(response.headers.get(header)) * factor
+            except (TypeError, ValueError):
+                continue
+        return None
+
+    def __schedule_retry(self, deployment: Dict[str, any], retries: int, max_retries: int, error: Exception) -> None:
+        """
+        Pauses all requests to the deployment, the next attempt goes to another deployment if one is available.
+        Honors the Retry-After header, otherwise uses exponential backoff with full jitter.
+        :param deployment: the deployment the request failed on.
+        :param retries: the number of retries so far.
+        :param max_retries: the maximum number of retries.
+        :param error: the error raised by the openai client.
+        :return:
+        :raise Exception: the error, if the maximum number of retries is exceeded.
+        """
+        if retries >= max_retries:
+            logger.error(f"Max retries exceeded after {type(error).__name__} on {deployment['name']}. Terminating.",
+                         module=Module.AZR)
+            logger.debug(str(error), module=Module.AZR)
+            raise error
+        retry_after: Optional[float] = self.__get_retry_after(error=error)
+        if retry_after is not None:
+            wait_time: float = retry_after + random.uniform(0, 1)
+        else:
+            # Azure recommends waiting at least 1 second before retrying
+            wait_time = max(1.0, random.uniform(0, min(self.BACKOFF_MAX, self.BACKOFF_BASE * 2 ** retries)))
+        logger.warning(f"{type(error).__name__} encountered on {deployment['name']}. "
+                       f"Pausing it for {wait_time:.2f} seconds...", module=Module.AZR)
+        deployment['rate_limiter'].block(wait_time)
 
     @staticmethod
-    def __wait_for_retry() -> None:
+    def __emit_items(gpt_response: str, on_item: Optional[Callable[[Dict[str, any]], None]]) -> None:
         """
-        Waits 2-3 seconds on azure rate limit error.
+        Emits the transactions of a complete response, which was not streamed.
+        :param gpt_response: the llm's response.
+        :param on_item: called with each transaction, if any.
         :return:
         """
-        # Azure recommends waiting at least 1 second before retrying
-        wait_time: float = 2 + random.uniform(0, 1)
-        logger.warning(f"Rate limit error encountered. Retrying in {wait_time} second...", module=Module.AZR)
-        time.sleep(wait_time)
+        if on_item is None:
+            return
+        for item in JsonStreamParser().feed(gpt_response):
+            on_item(item)
 
-    def ask_openai(self, template: str, image_uri: str = '', max_retries: int = 10):
+    @staticmethod
+    def __get_stream_params(
+            deployment: Dict[str, any],
+            messages: List,
+            response_format: Dict[str, any]
+    ) -> Dict[str, any]:
+        """
+        Get the parameters of a streamed chat completion.
+        The completion is streamed with the openai client of the llm, langchain drops the usage of streamed requests.
+        :param deployment: the deployment the request is sent to.
+        :param messages: the llm messages.
+        :param response_format: the response format.
+        :return: the parameters of the openai client.
+        """
+        return {
+            'model': deployment['deployment_name'],
+            'messages': [convert_message_to_dict(message) for message in messages],
+            'temperature': deployment['llm'].temperature,
+            'response_format': response_format,
+            'stream': True,
+            'stream_options': {'include_usage': True}
+        }
+
+    @staticmethod
+    def __read_chunk(
+            chunk,
+            parser: JsonStreamParser,
+            stream: Dict[str, any],
+            on_item: Optional[Callable[[Dict[str, any]], None]]
+    ) -> None:
+        """
+        Feeds a chunk of a streamed completion to the incremental json parser and emits the completed transactions.
+        :param chunk: the chunk of the completion.
+        :param parser: the json parser of the completion.
+        :param stream: the state of the stream: its start time, model, usage and number of emitted transactions.
+        :param on_item: called with each transaction as soon as it is complete, if any.
+        :return:
+        """
+        if chunk.usage is not None:
+            stream['usage'] = chunk.usage
+        stream['model'] = chunk.model or stream['model']
+        for choice in chunk.choices:
+            if choice.delta is None or not choice.delta.content:
+                continue
+            for item in parser.feed(choice.delta.content):
+                if not stream['items']:
+                    metrics.observe('llm_first_item_seconds', time.perf_counter() - stream['start'])
+                stream['items'] += 1
+                if on_item is not None:
+                    on_item(item)
+
+    def __finish_stream(self, parser: JsonStreamParser, stream: Dict[str, any]) -> str:
+        """
+        Records the usage of a streamed completion.
+        :param parser: the json parser of the completion.
+        :param stream: the state of the stream.
+        :return: the llm's response as json.
+        """
+        prompt_tokens: int = stream['usage'].prompt_tokens if stream['usage'] is not None else 0
+        completion_tokens: int = stream['usage'].completion_tokens if stream['usage'] is not None else 0
+        cost: float = self.__get_cost(stream['model'], prompt_tokens, completion_tokens)
+        self.__record_usage(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, cost=cost)
+        gpt_response: str = parser.get_json()
+        self.__debug_cost(response=gpt_response, cost=cost)
+        return gpt_response
+
+    def __request(
+            self,
+            deployment: Dict[str, any],
+            messages: List,
+            response_format: Dict[str, any],
+            on_item: Optional[Callable[[Dict[str, any]], None]]
+    ) -> str:
+        """
+        Sends a request to the llm, streamed if configured.
+        :param deployment: the deployment the request is sent to.
+        :param messages: the llm messages.
+        :param response_format: the response format.
+        :param on_item: called with each transaction, if any.
+        :return: the llm's response as json, without the text around it.
+        """
+        if not self.streaming:
+            with get_openai_callback() as cb:
+                with metrics.time('llm_request_seconds', in_flight='llm_requests_in_flight'):
+                    response = deployment['llm'].invoke(messages, response_format=response_format)
+                self.__record_usage(
+                    prompt_tokens=cb.prompt_tokens, completion_tokens=cb.completion_tokens, cost=cb.total_cost
+                )
+            gpt_response: str = extract_json(response.content)
+            self.__debug_cost(response=gpt_response, cost=cb.total_cost)
+            self.__emit_items(gpt_response=gpt_response, on_item=on_item)
+            return gpt_response
+        parser: JsonStreamParser = JsonStreamParser()
+        stream: Dict[str, any] = {'start': time.perf_counter(), 'model': '', 'usage': None, 'items': 0}
+        with metrics.time('llm_request_seconds', in_flight='llm_requests_in_flight'):
+            params: Dict[str, any] = self.__get_stream_params(deployment, messages, response_format)
+            for chunk in deployment['llm'].client.create(**params):
+                self.__read_chunk(chunk=chunk, parser=parser, stream=stream, on_item=on_item)
+        return self.__finish_stream(parser=parser, stream=stream)
+
+    def ask_openai(
+            self,
+            template: str,
+            image_uri: str = '',
+            max_retries: int = 10,
+            image_data: bytes = b'',
+            image_type: str = 'png',
+            images: Optional[List[Tuple[bytes, str]]] = None,
+            response_schema: Optional[Dict[str, any]] = None,
+            on_item: Optional[Callable[[Dict[str, any]], None]] = None
+    ):
         """
         Send a prompt to the llm model.
         :param template: the text template to use.
         :param image_uri: file system uri to an image to include in the AI request.
         :param max_retries: the maximum number of retries in case of rate limit error.
+        :param image_data: an encoded image to include in the AI request, instead of the image uri.
+        :param image_type: the type of the encoded image (png/jpeg/...).
+        :param images: the encoded images and their types, for a request with several images, e.g. packed pages.
+        :param response_schema: the json schema of the response, enforced if structured outputs are enabled.
+        :param on_item: called with each transaction of the response, as soon as it is received if streaming.
         :return: the llm's response as json.
         """
+        response_format: Dict[str, any] = self.__get_response_format(response_schema=response_schema)
+        with metrics.time('llm_step_seconds', step='prepare'):
+            messages, tokens, cache_key = self.__prepare_request(
+                template=template,
+                image_uri=image_uri,
+                image_data=image_data,
+                image_type=image_type,
+                response_format=response_format,
+                images=images
+            )
+        cached_response: Optional[str] = self.__get_cached_response(cache_key=cache_key)
+        if cached_response is not None:
+            metrics.inc('llm_requests_total', outcome='cache_hit')
+            self.__emit_items(gpt_response=cached_response, on_item=on_item)
+            return cached_response
         retries = 0
-        while retries <= max_retries:
-            try:
-                with get_openai_callback() as cb:
-                    response = self.llm(self.__build_llm_template(template=template, image_uri=image_uri))
-                    response = self.__remove_text_before_json(gpt_response=response.content)
-                    response = self.__remove_text_after_json(gpt_response=response)
-                    self.__debug_cost(response=response, cb=cb)
-                    return response
-            except RateLimitError as e:
-                if retries >= max_retries:
-                    logger.error("Max retries exceeded for rate limit error. Terminating.", module=Module.AZR)
-                    logger.debug(str(e), module=Module.AZR)
-                    raise
-            self.__wait_for_retry()
+        while True:
+            with self.router.route(tokens) as deployment:
+                with metrics.time('rate_limiter_wait_seconds'):
+                    deployment['rate_limiter'].acquire(tokens)
+                try:
+                    gpt_response: str = self.__request(
+                        deployment=deployment,
+                        messages=messages,
+                        response_format=response_format,
+                        on_item=on_item
+                    )
+                    self.router.report_success(deployment)
+                    self.__cache_response(cache_key=cache_key, response=gpt_response)
+                    return gpt_response
+                except self.RETRIABLE_ERRORS as e:
+                    metrics.inc('llm_requests_total', outcome=type(e).__name__)
+                    self.router.report_failure(deployment, throttled=isinstance(e, RateLimitError))
+                    self.__schedule_retry(deployment=deployment, retries=retries, max_retries=max_retries, error=e)
             retries += 1
 
 
-azure_open_ai_adapter: AzureOpenAIAdapter = AzureOpenAIAdapter()
+# Adapter singleton, created on first use.
+_instance: Optional[AzureOpenAIAdapter] = None
+_instance_lock: threading.Lock = threading.Lock()
+
+
+def get_instance() -> AzureOpenAIAdapter:
+    """
+    Azure OpenAI adapter singleton, the config is read and the llm client created on the first call.
+    :return: the AzureOpenAIAdapter singleton instance.
+    """
+    global _instance
+    if _instance is None:
+        with _instance_lock:
+            if _instance is None:
+                _instance = AzureOpenAIAdapter()
+    return _instance
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Tuple
+
+from log_handling import log_handler
+from log_handling.log_handler import Logger, Module
+from metrics_handling import metrics_handler
+from metrics_handling.metrics_handler import Metrics
+
+logger: Logger = log_handler.get_instance()
+metrics: Metrics = metrics_handler.get_instance()
+
+
+class DeploymentRouter:
+    """
+    Routes the llm requests across several deployments of the same model, e.g. in different regions.
+    Each request goes to the least loaded healthy deployment: the one whose rate limiter lets it through first,
+    then the one with the fewest requests in flight relative to its weight.
+    A deployment answering with 429 is paused by its rate limiter, so the next attempt fails over to the others.
+    A deployment failing several times in a row (5xx, connection errors) is ejected for a while,
+    with the ejection doubling on each repeated ejection until a request succeeds again.
+    Each deployment is a dict with its name, weight, llm and rate limiter.
+    """
+    # Consecutive failures after which a deployment is ejected.
+    EJECT_AFTER_FAILURES: int = 3
+    # Duration of the first ejection in seconds, doubled on each repeated ejection.
+    EJECT_SECONDS: float = 30
+    EJECT_MAX_SECONDS: float = 300
+
+    def __init__(self, deployments: List[Dict[str, any]]):
+        """
+        Default constructor.
+        :param deployments: the deployments, each with name, weight, llm and rate_limiter.
+        :raise ValueError: if no deployment is configured or a weight is not positive.
+        """
+        if not deployments:
+            raise ValueError('No deployments configured.')
+        for deployment in deployments:
+            # The requests in flight are divided by the weight, not greater also rejects nan.
+            if not deployment['weight'] > 0:
+                raise ValueError(f'The weight of deployment {deployment["name"]} must be positive, '
+                                 f'got {deployment["weight"]}.')
+        self.deployments: List[Dict[str, any]] = deployments
+        for deployment in self.deployments:
+            deployment.update(in_flight=0, failures=0, ejections=0, ejected_until=0.0)
+        self.lock: threading.Lock = threading.Lock()
+
+    @staticmethod
+    def __get_load(deployment: Dict[str, any], tokens: int) -> Tuple[float, float]:
+        """
+        Get the load of a deployment, lower is better. The caller holds the lock.
+        :param deployment: the deployment.
+        :param tokens: the estimated tokens of the request.
+        :return: the wait for the deployment's quota and its requests in flight per weight.
+        """
+        return deployment['rate_limiter'].get_wait(tokens), deployment['in_flight'] / deployment['weight']
+
+    @contextmanager
+    def route(self, tokens: int) -> Iterator[Dict[str, any]]:
+        """
+        Picks the deployment of a request and counts the request as in flight until the context is left.
+        If all deployments are ejected, the one whose ejection ends first is tried.
+        :param tokens: the estimated tokens of the request.
+        :return: the deployment.
+        """
+        with self.lock:
+            now: float = time.monotonic()
+            healthy: List[Dict[str, any]] = [d for d in self.deployments if d['ejected_until'] <= now]
+            if healthy:
+                deployment: Dict[str, any] = min(healthy, key=lambda d: self.__get_load(d, tokens))
+            else:
+                deployment = min(self.deployments, key=lambda d: d['ejected_until'])
+            deployment['in_flight'] += 1
+        try:
+            yield deployment
+        finally:
+            with self.lock:
+                deployment['in_flight'] -= 1
+
+    def report_success(self, deployment: Dict[str, any]) -> None:
+        """
+        Marks a deployment as healthy after a successful request.
+        :param deployment: the deployment.
+        :return:
+        """
+        metrics.inc('llm_deployment_requests_total', deployment=deployment['name'], outcome='ok')
+        with self.lock:
+            deployment['failures'] = 0
+            deployment['ejections'] = 0
+
+    def report_failure(self, deployment: Dict[str, any], throttled: bool) -> None:
+        """
+        Counts a failed request of a deployment and ejects the deployment if it keeps failing.
+        :param deployment: the deployment.
+        :param throttled: whether the request was rejected by the rate limit (429), which does not eject the
+            deployment, its rate limiter pauses it for the Retry-After time.
+        :return:
+        """
+        metrics.inc('llm_deployment_requests_total', deployment=deployment['name'],
+                    outcome='throttled' if throttled else 'failed')
+        if throttled or len(self.deployments) == 1:
+            return
+        with self.lock:
+            deployment['failures'] += 1
+            if deployment['failures'] < self.EJECT_AFTER_FAILURES:
+                return
+            seconds: float = min(self.EJECT_MAX_SECONDS, self.EJECT_SECONDS * 2 ** deployment['ejections'])
+            deployment['ejected_until'] = time.monotonic() + seconds
+            deployment['ejections'] += 1
+            deployment['failures'] = 0
+        metrics.inc('llm_deployment_ejections_total', deployment=deployment['name'])
+        logger.warning(f'Deployment {deployment["name"]} failed {self.EJECT_AFTER_FAILURES} times in a row, '
+                       f'ejecting it for {seconds:.0f} seconds.', module=Module.AZR)
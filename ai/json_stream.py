@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+import json
+from typing import Dict, List, Optional, Tuple
+
+
+class JsonStreamParser:
+    """
+    Incremental parser of a json object in a streamed llm response.
+    Finds the first balanced json object in the text, skipping any text or markdown around it,
+    and emits the objects of the watched arrays (e.g. the transactions) as soon as each of them is closed.
+    Braces, brackets and backticks inside json strings are part of the strings, they do not end the object.
+    """
+
+    def __init__(self, array_keys: Tuple[str, ...] = ('transactions',)):
+        """
+        Default constructor.
+        :param array_keys: the keys of the top level arrays whose objects are emitted.
+        """
+        self.array_keys: Tuple[str, ...] = array_keys
+        self.buffer: str = ''
+        # Index of the next character to scan.
+        self.position: int = 0
+        # Index of the opening brace of the json object, None until it is found.
+        self.start: Optional[int] = None
+        # Index of the closing brace of the json object, None until it is found.
+        self.end: Optional[int] = None
+        # Open objects and arrays, '{' or '['.
+        self.stack: List[str] = []
+        self.in_string: bool = False
+        self.escaped: bool = False
+        self.string_start: int = 0
+        # The last string closed, the key of a following array.
+        self.last_string: Optional[str] = None
+        # Depth of the watched array we are in, and the start of its current object.
+        self.array_depth: Optional[int] = None
+        self.item_start: Optional[int] = None
+
+    def feed(self, text: str) -> List[Dict[str, any]]:
+        """
+        Adds the next part of the response.
+        :param text: the next part of the response.
+        :return: the objects of the watched arrays completed by this part.
+        """
+        self.buffer += text
+        items: List[Dict[str, any]] = []
+        while self.position < len(self.buffer) and self.end is None:
+            item: Optional[Dict[str, any]] = self.__scan(self.position, self.buffer[self.position])
+            if item is not None:
+                items.append(item)
+            self.position += 1
+        return items
+
+    def __scan(self, index: int, char: str) -> Optional[Dict[str, any]]:
+        """
+        Scans a character of the response.
+        :param index: the index of the character in the buffer.
+        :param char: the character.
+        :return: the object of a watched array closed by this character, if any.
+        """
+        if self.start is None:
+            if char == '{':
+                self.start = index
+                self.stack.append(char)
+            return None
+        if self.in_string:
+            if self.escaped:
+                self.escaped = False
+            elif char == '\\':
+                self.escaped = True
+            elif char == '"':
+                self.in_string = False
+                try:
+                    self.last_string = json.loads(self.buffer[self.string_start:index + 1])
+                except ValueError:
+                    self.last_string = None
+            return None
+        if char == '"':
+            self.in_string = True
+            self.string_start = index
+        elif char in '{[':
+            if char == '[' and len(self.stack) == 1 and self.last_string in self.array_keys:
+                self.array_depth = len(self.stack) + 1
+            elif char == '{' and len(self.stack) == self.array_depth:
+                self.item_start = index
+            self.stack.append(char)
+        elif char in '}]' and self.stack:
+            self.stack.pop()
+            if not self.stack:
+                self.end = index
+            elif char == ']' and len(self.stack) + 1 == self.array_depth:
+                self.array_depth = None
+            elif char == '}' and self.item_start is not None and len(self.stack) == self.array_depth:
+                item_start: int = self.item_start
+                self.item_start = None
+                try:
+                    item: any = json.loads(self.buffer[item_start:index + 1])
+                except ValueError:
+                    return None
+                return item if isinstance(item, dict) else None
+        return None
+
+    def get_json(self) -> str:
+        """
+        Get the json object received so far, without the text around it.
+        :return: the json object, incomplete if the response ended early, or the whole response if it has none.
+        """
+        if self.start is None:
+            return self.buffer
+        return self.buffer[self.start:] if self.end is None else self.buffer[self.start:self.end + 1]
+
+
+def extract_json(text: str) -> str:
+    """
+    Extracts the first json object from a complete llm response, e.g. from a markdown code block
+    or followed by a comment.
+    :param text: the llm's response.
+    :return: the json object, or the response itself if it has none.
+    """
+    parser: JsonStreamParser = JsonStreamParser(array_keys=())
+    parser.feed(text)
+    return parser.get_json()
@@ -1,3 +1,6 @@
+from typing import Dict, List
+
+
 def get_basic_account_info_prompt() -> str:
     """
     Prompt for fetching basic account info from the pdf file.
@@ -65,3 +68,237 @@ def get_transactions_prompt() -> str:
     # The JSON should be parseable using a single json.loads in python. RETURN NO FURTHER TEXT, JUST THE JSON.
     ```
     """
+
+
+def get_basic_account_info_text_prompt(page_text: str) -> str:
+    """
+    Prompt for fetching basic account info from the text layer of the pdf's cover page.
+    :param page_text: the text of the cover page, layout preserved.
+    :return: the prompt.
+    """
+    return """
+    You are an AI assistant assisting the german bankers in digitizing bank statements.
+    You are provided with the following text of a bank statement page, which may contain information about the
+    customer's account data. The layout of the page is preserved with whitespace.
+    Return the account data in the following format:
+
+    ```json
+    {
+        account_data: {
+            'name': 'Customer Name **Required**',
+            'IBAN': 'IBAN number **Required**',
+            'document_date': 'Date the document was issues **Required**',
+            'previous_account_balance': 'Previous account balance, **Required**','
+            'new_account_balance': 'Account balance, **Required**'
+        }
+    }
+    ```
+
+    IF NOT ACCOUNT DATA IS AVAILABLE ON THE PAGE, RETURN AN EMPTY DICTIONARY:
+    ```json
+    {
+        'account_data': {}
+    }
+    ```
+
+    # How to respond to this prompt: - response_format: JSON
+    # The JSON should be parseable using a single json.loads in python. RETURN NO FURTHER TEXT, JUST THE JSON.
+
+    # Page text:
+    """ + page_text
+
+
+def get_transactions_text_prompt(page_text: str) -> str:
+    """
+    Prompt for fetching bank transactions from the text layer of a pdf page.
+    :param page_text: the text of the page, layout preserved.
+    :return: the prompt.
+    """
+    return """
+    You are an AI assistant assisting the german bankers in digitizing bank statements.
+    You are provided with the following text of a bank statement page, which may contain multiple bank transactions.
+    The layout of the page is preserved with whitespace.
+    Return a json response in the following format:
+
+    ```json
+    {
+        'transactions': [
+            {
+                'date': 'Transaction date, **always required**.',
+                'amount': 'Transaction amount, **always required**.',
+                'transaction_text': 'Transaction text, if available.'
+            }
+        ]
+    }
+    ```
+
+    IF NOT TRANSACTIONS ARE AVAILABLE, RETURN THE ARRAY:
+
+    ```json
+    {
+        'transactions': []
+    }
+    ```
+
+    # How to respond to this prompt: - response_format: JSON
+    # The JSON should be parseable using a single json.loads in python. RETURN NO FURTHER TEXT, JUST THE JSON.
+
+    # Page text:
+    """ + page_text
+
+
+def get_packed_prompt(page_count: int, images: List[str], page_texts: Dict[int, str], account_data: bool) -> str:
+    """
+    Prompt for fetching the bank transactions of several consecutive pages in one request,
+    and the account data of the cover page if it is among them.
+    :param page_count: the number of pages.
+    :param images: what each attached image shows, in order, e.g. 'page_index 0'.
+    :param page_texts: the text layer of the pages sent as text, by page index, layout preserved.
+    :param account_data: whether the account data of the cover page (page_index 0) is requested as well.
+    :return: the prompt.
+    """
+    prompt: str = f"""
+    You are an AI assistant assisting the german bankers in digitizing scans and faxes of bank transactions.
+    You are provided with {page_count} consecutive pages of a bank statement, which may contain multiple bank
+    transactions. The pages are numbered by their page_index, starting at 0.
+    """
+    if images:
+        prompt += f"""
+    The attached images show, in this order: {', '.join(images)}.
+    """
+    if page_texts:
+        prompt += """
+    The text of the other pages is given below, the layout of the pages is preserved with whitespace.
+    """
+    prompt += """
+    Return the transactions of all pages in page order, each tagged with the page_index of its page,
+    in the following format:
+
+    ```json
+    {
+        'transactions': [
+            {
+                'page_index': 'page_index of the page showing the transaction, **always required**.',
+                'date': 'Transaction date, **always required**.',
+                'amount': 'Transaction amount, **always required**.',
+                'transaction_text': 'Transaction text, if available.'
+            }
+        ]
+    }
+    ```
+
+    IF NOT TRANSACTIONS ARE AVAILABLE, RETURN THE ARRAY: 'transactions': []
+    """
+    if account_data:
+        prompt += """
+    Page 0 may also contain information about the customer's account data.
+    Return the account data in the same json object, next to the transactions:
+
+    ```json
+    {
+        'account_data': {
+            'name': 'Customer Name **Required**',
+            'IBAN': 'IBAN number **Required**',
+            'document_date': 'Date the document was issues **Required**',
+            'previous_account_balance': 'Previous account balance, **Required**','
+            'new_account_balance': 'Account balance, **Required**'
+        }
+    }
+    ```
+
+    IF NOT ACCOUNT DATA IS AVAILABLE ON THE PAGE, RETURN AN EMPTY DICTIONARY: 'account_data': {}
+    """
+    prompt += """
+    # How to respond to this prompt: - response_format: JSON
+    # The JSON should be parseable using a single json.loads in python. RETURN NO FURTHER TEXT, JUST THE JSON.
+    """
+    for page_index, page_text in sorted(page_texts.items()):
+        prompt += f"""
+    # Page text of page_index {page_index}:
+    """ + page_text
+    return prompt
+
+
+def _get_transactions_property(page_index: bool = False) -> Dict[str, any]:
+    """
+    JSON schema of the transactions array.
+    :param page_index: whether each transaction is tagged with the page_index of its page.
+    :return: the schema.
+    """
+    properties: Dict[str, any] = {
+        'date': {'type': 'string'},
+        'amount': {'type': 'string'},
+        'transaction_text': {'type': ['string', 'null']}
+    }
+    if page_index:
+        properties = {'page_index': {'type': 'integer'}, **properties}
+    return {
+        'type': 'array',
+        'items': {
+            'type': 'object',
+            'properties': properties,
+            'required': list(properties),
+            'additionalProperties': False
+        }
+    }
+
+
+def _get_account_data_property() -> Dict[str, any]:
+    """
+    JSON schema of the account data. Strict schemas can not leave out fields, missing values are null.
+    :return: the schema.
+    """
+    fields: List[str] = ['name', 'IBAN', 'document_date', 'previous_account_balance', 'new_account_balance']
+    return {
+        'type': 'object',
+        'properties': {field: {'type': ['string', 'null']} for field in fields},
+        'required': fields,
+        'additionalProperties': False
+    }
+
+
+def _build_schema(name: str, properties: Dict[str, any]) -> Dict[str, any]:
+    """
+    Builds a strict JSON schema response format for structured outputs.
+    :param name: the name of the schema.
+    :param properties: the properties of the response object.
+    :return: the json_schema of the response format.
+    """
+    return {
+        'name': name,
+        'strict': True,
+        'schema': {
+            'type': 'object',
+            'properties': properties,
+            'required': list(properties),
+            'additionalProperties': False
+        }
+    }
+
+
+def get_transactions_schema() -> Dict[str, any]:
+    """
+    JSON schema of the responses to the transactions prompts, for structured outputs.
+    :return: the json_schema of the response format.
+    """
+    return _build_schema('transactions', {'transactions': _get_transactions_property()})
+
+
+def get_basic_account_info_schema() -> Dict[str, any]:
+    """
+    JSON schema of the responses to the account info prompts, for structured outputs.
+    :return: the json_schema of the response format.
+    """
+    return _build_schema('account_info', {'account_data': _get_account_data_property()})
+
+
+def get_packed_schema(account_data: bool) -> Dict[str, any]:
+    """
+    JSON schema of the responses to the packed prompt, for structured outputs.
+    :param account_data: whether the account data of the cover page is requested as well.
+    :return: the json_schema of the response format.
+    """
+    properties: Dict[str, any] = {'transactions': _get_transactions_property(page_index=True)}
+    if account_data:
+        properties['account_data'] = _get_account_data_property()
+    return _build_schema('packed_transactions', properties)
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+import math
+import threading
+import time
+from typing import Optional, List, Tuple
+
+from log_handling import log_handler
+from log_handling.log_handler import Logger, Module
+
+logger: Logger = log_handler.get_instance()
+
+# GPT-4o vision token accounting (high detail): the image is scaled to fit into 2048x2048,
+# then its shortest side is scaled to 768px and it is billed per 512px tile.
+IMAGE_MAX_SIDE: int = 2048
+IMAGE_SHORT_SIDE: int = 768
+IMAGE_TILE_SIZE: int = 512
+IMAGE_TILE_TOKENS: int = 170
+IMAGE_BASE_TOKENS: int = 85
+# Rough average for english/german text with the o200k tokenizer.
+CHARS_PER_TOKEN: int = 4
+
+
+def estimate_image_tokens(width: int, height: int) -> int:
+    """
+    Estimates the prompt tokens billed for an image of the given size.
+    :param width: image width in pixels.
+    :param height: image height in pixels.
+    :return: the estimated number of tokens.
+    """
+    if width <= 0 or height <= 0:
+        return 0
+    scale: float = min(1.0, IMAGE_MAX_SIDE / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, IMAGE_SHORT_SIDE / min(width, height))
+    width, height = width * scale, height * scale
+    tiles: int = math.ceil(width / IMAGE_TILE_SIZE) * math.ceil(height / IMAGE_TILE_SIZE)
+    return IMAGE_BASE_TOKENS + tiles * IMAGE_TILE_TOKENS
+
+
+def estimate_request_tokens(prompt: str, image_sizes: List[Tuple[int, int]], completion_tokens: int = 0) -> int:
+    """
+    Estimates the tokens a request counts against the deployment's TPM quota.
+    :param prompt: the text prompt.
+    :param image_sizes: (width, height) of each image in the request.
+    :param completion_tokens: the expected number of completion tokens.
+    :return: the estimated number of tokens.
+    """
+    text_tokens: int = math.ceil(len(prompt) / CHARS_PER_TOKEN)
+    image_tokens: int = sum(estimate_image_tokens(width, height) for width, height in image_sizes)
+    return text_tokens + image_tokens + completion_tokens
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at a per-minute rate.
+    The bucket only holds the quota of a few seconds - Azure enforces the per-minute quota
+    over short windows, so a full minute's burst would be rejected anyway.
+    Reservations are taken immediately and may overdraw the bucket, the caller then waits until
+    the debt is refilled. This keeps the order of the callers.
+    """
+
+    def __init__(self, per_minute: float, burst_seconds: float = 10):
+        """
+        Default constructor.
+        :param per_minute: refill rate per minute.
+        :param burst_seconds: the bucket capacity, in seconds of refill.
+        """
+        self.rate: float = float(per_minute) / 60
+        self.capacity: float = max(1.0, self.rate * burst_seconds)
+        self.tokens: float = self.capacity
+        self.updated: float = time.monotonic()
+
+    def get_wait(self, amount: float, now: float) -> float:
+        """
+        Get the time a reservation would wait, without taking it. Not thread safe, the caller holds the lock.
+        :param amount: the amount to take.
+        :param now: the current monotonic time.
+        :return: the number of seconds a reservation of the amount would wait.
+        """
+        tokens: float = min(self.capacity, self.tokens + (now - self.updated) * self.rate) - min(amount, self.capacity)
+        return 0 if tokens >= 0 else -tokens / self.rate
+
+    def reserve(self, amount: float, now: float) -> float:
+        """
+        Takes the given amount from the bucket. Not thread safe, the caller holds the lock.
+        :param amount: the amount to take. Amounts above the capacity wait for the capacity only.
+        :param now: the current monotonic time.
+        :return: the number of seconds to wait until the reservation is covered.
+        """
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= min(amount, self.capacity)
+        if self.tokens >= 0:
+            return 0
+        return -self.tokens / self.rate
+
+
+class RateLimiter:
+    """
+    Process wide limiter for the tokens-per-minute and requests-per-minute quota of a deployment.
+    Requests wait before they are sent instead of running into rate limit errors,
+    and a rate limit error pauses all requests to the deployment at once.
+    """
+
+    def __init__(self, tokens_per_minute: Optional[int] = None, requests_per_minute: Optional[int] = None):
+        """
+        Default constructor. Quotas that are not set are not limited.
+        :param tokens_per_minute: the deployment's TPM quota.
+        :param requests_per_minute: the deployment's RPM quota.
+        """
+        self.tokens: Optional[TokenBucket] = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.requests: Optional[TokenBucket] = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.blocked_until: float = 0
+        self.lock: threading.Lock = threading.Lock()
+
+    def __reserve(self, tokens: int) -> float:
+        """
+        Reserves quota for one request.
+        :param tokens: the estimated tokens of the request.
+        :return: the number of seconds to wait before sending the request.
+        """
+        with self.lock:
+            now: float = time.monotonic()
+            wait: float = max(0.0, self.blocked_until - now)
+            if self.tokens is not None:
+                wait = max(wait, self.tokens.reserve(tokens, now))
+            if self.requests is not None:
+                wait = max(wait, self.requests.reserve(1, now))
+        if wait > 1:
+            logger.debug('Rate limiter delays request by', round(wait, 2), 'seconds, tokens:', tokens, module=Module.AZR)
+        return wait
+
+    def get_wait(self, tokens: int) -> float:
+        """
+        Get the time a request would wait for its quota, without reserving it, e.g. to compare deployments.
+        :param tokens: the estimated tokens of the request.
+        :return: the number of seconds the request would wait.
+        """
+        with self.lock:
+            now: float = time.monotonic()
+            wait: float = max(0.0, self.blocked_until - now)
+            if self.tokens is not None:
+                wait = max(wait, self.tokens.get_wait(tokens, now))
+            if self.requests is not None:
+                wait = max(wait, self.requests.get_wait(1, now))
+            return wait
+
+    def acquire(self, tokens: int) -> None:
+        """
+        Blocks until the quota for a request is available.
+        :param tokens: the estimated tokens of the request.
+        :return:
+        """
+        wait: float = self.__reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    def block(self, seconds: float) -> None:
+        """
+        Pauses all requests, e.g. for the Retry-After time of a rate limit error.
+        :param seconds: the number of seconds to pause.
+        :return:
+        """
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from sqlite3 import Connection
+from typing import Optional, Dict
+
+import setup
+from log_handling import log_handler
+from log_handling.log_handler import Logger, Module
+
+logger: Logger = log_handler.get_instance()
+
+
+class ResponseCache:
+    """
+    Persistent, content addressed cache for llm responses.
+    Responses are keyed by the hash of the deployment, the response format, the prompt and the image bytes
+    of the request,
+    the least recently used responses are evicted once the cache exceeds its maximum size.
+    The cache database may be shared by several processes, e.g. the workers, its size is read from the database.
+    """
+    CACHE_PATH: str = os.path.join(setup.EXPORT_DIR, 'cache.db')
+    BUSY_TIMEOUT_MS: int = 30000
+    # Number of least recently used responses deleted at once by the eviction.
+    EVICTION_BATCH_SIZE: int = 100
+    CREATE_TABLE_QUERY: str = '''
+        CREATE TABLE IF NOT EXISTS RESPONSES (
+            KEY TEXT PRIMARY KEY,
+            RESPONSE TEXT NOT NULL,
+            SIZE INTEGER NOT NULL,
+            LAST_ACCESS REAL NOT NULL
+        )
+    '''
+    CREATE_INDEX_QUERY: str = 'CREATE INDEX IF NOT EXISTS RESPONSES_LAST_ACCESS ON RESPONSES (LAST_ACCESS)'
+    SELECT_QUERY: str = 'SELECT RESPONSE FROM RESPONSES WHERE KEY = ?'
+    TOUCH_QUERY: str = 'UPDATE RESPONSES SET LAST_ACCESS = ? WHERE KEY = ?'
+    INSERT_QUERY: str = 'INSERT OR REPLACE INTO RESPONSES VALUES (?, ?, ?, ?)'
+    OLDEST_QUERY: str = 'SELECT KEY, SIZE FROM RESPONSES ORDER BY LAST_ACCESS LIMIT ?'
+    DELETE_QUERY: str = 'DELETE FROM RESPONSES WHERE KEY = ?'
+
+    @staticmethod
+    def build_key(deployment_name: str, response_format: str, template: str, *images: bytes) -> str:
+        """
+        Builds the cache key of a request.
+        :param deployment_name: the deployment the request is sent to.
+        :param response_format: the response format of the request as json, e.g. the json schema of the response.
+        :param template: the text template of the request.
+        :param images: the raw bytes of each image of the request, if any.
+        :return: the hex digest of the request.
+        """
+        digest = hashlib.sha256()
+        # A request without image is keyed like one with an empty image, as before multi-image requests.
+        for part in (deployment_name.encode('utf-8'), response_format.encode('utf-8'), template.encode('utf-8'),
+                     *(images or (b'',))):
+            # Length prefix, so that the boundaries between the parts are unambiguous.
+            digest.update(len(part).to_bytes(8, 'big'))
+            digest.update(part)
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Looks up a cached response and marks it as recently used.
+        :param key: the cache key of the request.
+        :return: the cached response, or None.
+        """
+        with self.lock:
+            row = self.conn.execute(self.SELECT_QUERY, [key]).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.conn.execute(self.TOUCH_QUERY, [time.time(), key])
+            self.conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, response: str) -> None:
+        """
+        Stores a response and evicts the least recently used responses if the cache is full.
+        :param key: the cache key of the request.
+        :param response: the llm's response.
+        :return:
+        """
+        size: int = len(response.encode('utf-8'))
+        with self.lock:
+            self.conn.execute(self.INSERT_QUERY, [key, response, size, time.time()])
+            self.__evict()
+            self.conn.commit()
+
+    def __get_size(self) -> int:
+        """
+        Get the size of the cache database without its free pages, including the writes of the open transaction.
+        :return: the size in bytes.
+        """
+        page_count: int = self.conn.execute('PRAGMA page_count').fetchone()[0]
+        free_pages: int = self.conn.execute('PRAGMA freelist_count').fetchone()[0]
+        return (page_count - free_pages) * self.conn.execute('PRAGMA page_size').fetchone()[0]
+
+    def __evict(self) -> None:
+        """
+        Deletes the least recently used responses until the cache fits its maximum size.
+        The caller holds the lock and commits.
+        :return:
+        """
+        excess: int = self.__get_size() - self.max_bytes
+        while excess > 0:
+            rows = self.conn.execute(self.OLDEST_QUERY, [self.EVICTION_BATCH_SIZE]).fetchall()
+            if not rows:
+                return
+            # The responses are deleted until their sizes cover the excess, then the database size is read again.
+            for key, size in rows:
+                self.conn.execute(self.DELETE_QUERY, [key])
+                self.evictions += 1
+                excess -= size
+                if excess <= 0:
+                    break
+            excess = self.__get_size() - self.max_bytes
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Get the cache counters.
+        :return: hits, misses, evictions and the current size in bytes.
+        """
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': self.__get_size()
+            }
+
+    def __init__(self, db_path: str = CACHE_PATH, max_bytes: int = setup.RESPONSE_CACHE_MAX_BYTES):
+        """
+        Default constructor.
+        :param db_path: path to the cache database, default: export/cache.db.
+        :param max_bytes: the maximum size of the cache database in bytes.
+        """
+        self.max_bytes: int = max_bytes
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+        self.lock: threading.Lock = threading.Lock()
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        # Shared by the ocr threads, access is serialized by the lock.
+        self.conn: Connection = sqlite3.connect(db_path, check_same_thread=False)
+        # Readers of other processes do not block the writes, concurrent writers wait for each other.
+        self.conn.execute('PRAGMA journal_mode = WAL')
+        self.conn.execute('PRAGMA synchronous = NORMAL')
+        self.conn.execute(f'PRAGMA busy_timeout = {self.BUSY_TIMEOUT_MS}')
+        self.conn.execute(self.CREATE_TABLE_QUERY)
+        self.conn.execute(self.CREATE_INDEX_QUERY)
+        self.conn.commit()
+        logger.debug(f'Response cache "{db_path}" opened, {self.__get_size()} bytes cached.', module=Module.AZR)
@@ -1,19 +1,30 @@
 #!/usr/bin/env python3
+import argparse
 import glob
 import os
-from typing import List, Dict
+import shutil
+import signal
+import socket
+import threading
+import uuid
+from typing import List, Dict, Iterator, Optional
 
 import setup
 import pdf_processor
 import persistence.db_handler
+import persistence.job_queue
 from csv_handling import csv_handler
 from csv_handling.csv_handler import CSVHandler
 from log_handling import log_handler
 from log_handling.log_handler import Logger, Module
+from metrics_handling import metrics_handler
+from metrics_handling.metrics_handler import Metrics
 from persistence.db_handler import Database
+from persistence.job_queue import JobQueue
+from watch_handling.watch_handler import WatchHandler
 
 logger: Logger = log_handler.get_instance()
-database: Database = persistence.db_handler.database
+metrics: Metrics = metrics_handler.get_instance()
 csv_handler: CSVHandler = csv_handler.csv_handler
 
 
@@ -39,23 +50,33 @@ def _get_csv_headers() -> List[str]:
     ]
 
 
-def _get_transaction_list(page: Dict[str, any]) -> List[List[str]]:
+def _iter_transactions(page: Dict[str, any]) -> Iterator[List[str]]:
     """
     Gets the transaction data from the document page and format it for csv export.
     :param page: the pdf document page.
-    :return: a list of csv data rows.
+    :return: an iterator over the csv data rows.
     """
-    transactions: List[List[str]] = []
     for transaction in (page['transactions']).get('transactions', []):
         transaction_date: str = transaction.get('date', '')
         transaction_amount: str = transaction.get('amount', '')
         transaction_text: str = transaction.get('transaction_text', '')
         if not transaction_amount or not transaction_date:
-            logger.error(f'Error reading transaction data on page {page["text"]}, '
+            logger.error(f'Error reading transaction data on page {page.get("page_number", page.get("page_path"))}, '
                          'date or amount was missing.', module=Module.MAIN)
             continue
-        transactions.append([transaction_date, transaction_amount, transaction_text])
-    return transactions
+        yield [transaction_date, transaction_amount, transaction_text]
+
+
+def _iter_document_transactions(document_data: Dict[str, any]) -> Iterator[List[str]]:
+    """
+    Gets the transaction data of all pages of the document.
+    :param document_data: the extracted data.
+    :return: an iterator over the csv data rows.
+    """
+    for page in document_data['page_content']:
+        if 'transactions' not in page:
+            continue
+        yield from _iter_transactions(page=page)
 
 
 def _export_document(
@@ -68,26 +89,32 @@ def _export_document(
     :param document_data: the extracted data.
     :return:
     """
-    transactions: List[List[str]] = []
-    for page in document_data['page_content']:
-        if 'transactions' not in page:
-            continue
-        transactions.extend(_get_transaction_list(page=page))
     headers: List[str] = _get_csv_headers()
     csv_handler.export(
         headers=headers,
-        rows=transactions,
+        rows=_iter_document_transactions(document_data=document_data),
         filepath=filepath
     )
 
 
+def _log_export_error(error: Optional[Exception]) -> None:
+    """
+    Logs a failed update of an export watermark, the document will be exported again on the next run.
+    :param error: the error, None if the watermark was saved.
+    :return:
+    """
+    if error is not None:
+        logger.error('Error saving the export watermark. Trace:', error, module=Module.MAIN)
+
+
 def export_transactions() -> None:
     """
-    Exports the transactions as a csv file.
+    Exports the transactions as a csv file, for each document imported or changed since the last export.
     :return:
     """
-    documents: List[Dict[str, any]] = database.export_data()
-    for document in documents:
+    exported: int = 0
+    database: Database = persistence.db_handler.get_instance()
+    for document in database.iter_unexported_documents():
         document_name: str = document['document_name']
         csv_document_name: str = document_name.lower().replace('.pdf', '.csv')
         document_data: Dict[str, any] = document['document_data']
@@ -95,9 +122,36 @@ def export_transactions() -> None:
         try:
             filepath: str = os.path.join(setup.EXPORT_DIR, csv_document_name)
             _export_document(filepath, document_data)
+            database.mark_document_exported(
+                document_id=document['document_id'],
+                updated_at=document['updated_at'],
+                on_commit=_log_export_error
+            )
+            exported += 1
             logger.info('CSV file exported to ', csv_document_name, module=Module.MAIN)
         except Exception as e:
             logger.error(f'Error exporting transactions for file {document_name}. Trace:', e, module=Module.MAIN)
+    database.flush()
+    if exported:
+        logger.info(f'Exported {exported} documents.', module=Module.MAIN)
+
+
+def retry_failed() -> List[str]:
+    """
+    Moves the pdf files that failed to process back into the import directory.
+    Pages extracted before the failure are checkpointed and not requested again.
+    :return: the re-queued pdf files.
+    """
+    files: List[str] = []
+    for failed_file in glob.glob(f'{setup.FAILED_DIR}/*.pdf'):
+        filepath: str = os.path.join(setup.SOURCE_DIR, os.path.basename(failed_file))
+        if os.path.exists(filepath):
+            logger.error(f'Not re-queuing "{failed_file}", "{filepath}" already exists.', module=Module.MAIN)
+            continue
+        shutil.move(failed_file, filepath)
+        files.append(filepath)
+    logger.info(f'Re-queued {len(files)} failed pdf files.', module=Module.MAIN)
+    return files
 
 
 def _exec():
@@ -110,7 +164,269 @@ def _exec():
     export_transactions()
 
 
+def _export_periodically(stop_event: threading.Event) -> None:
+    """
+    Exports the new documents in regular intervals until the stop event is set.
+    :param stop_event: ends the export loop.
+    :return:
+    """
+    while not stop_event.wait(setup.WATCH_EXPORT_INTERVAL):
+        try:
+            export_transactions()
+        except Exception as e:
+            logger.error('Error exporting transactions. Trace:', e, module=Module.MAIN)
+
+
+def watch() -> None:
+    """
+    Daemon mode - processes the pdf files as they arrive in the import directory and exports them incrementally.
+    On SIGTERM or SIGINT, no new files are accepted, the files in progress are finished and exported.
+    :return:
+    """
+    stop_event: threading.Event = threading.Event()
+
+    def _stop(signum: int, _) -> None:
+        logger.info(f'Received signal {signum}, finishing the files in progress...', module=Module.MAIN)
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+    exporter: threading.Thread = threading.Thread(
+        target=_export_periodically,
+        args=(stop_event,),
+        name='exporter',
+        daemon=True
+    )
+    exporter.start()
+    watch_handler: WatchHandler = WatchHandler(directory=setup.SOURCE_DIR, stop_event=stop_event)
+    pdf_processor.process_files(files=watch_handler.watch())
+    exporter.join()
+    export_transactions()
+    logger.info('Stopped.', module=Module.MAIN)
+
+
+def _enqueue_arrivals(job_queue: JobQueue, stop_event: threading.Event) -> None:
+    """
+    Queues the pdf files arriving in the import directory, beginning with the files already present,
+    until the stop event is set. Every worker watches the directory, a file is only queued once.
+    :param job_queue: the shared job queue.
+    :param stop_event: ends the watch.
+    :return:
+    """
+    watch_handler: WatchHandler = WatchHandler(directory=setup.SOURCE_DIR, stop_event=stop_event)
+    for filepath in watch_handler.watch():
+        try:
+            if job_queue.enqueue(name=os.path.basename(filepath)):
+                logger.info(f'Queued "{filepath}".', module=Module.MAIN)
+        except Exception as e:
+            logger.error(f'Error queuing "{filepath}". Trace:', e, module=Module.MAIN)
+
+
+def _send_heartbeats(
+        job_queue: JobQueue,
+        worker_id: str,
+        claimed: Dict[str, Dict[str, any]],
+        finished: threading.Event
+) -> None:
+    """
+    Renews the leases of the jobs in the pipeline in regular intervals, until the pipeline is finished.
+    :param job_queue: the shared job queue.
+    :param worker_id: the id of this worker.
+    :param claimed: the jobs in the pipeline by the path of their pdf file.
+    :param finished: ends the heartbeats.
+    :return:
+    """
+    while not finished.wait(setup.JOB_HEARTBEAT_INTERVAL):
+        try:
+            job_ids: List[int] = [job['id'] for job in list(claimed.values())]
+            job_queue.heartbeat(job_ids=job_ids, worker=worker_id, lease_seconds=setup.JOB_LEASE_SECONDS)
+            for state, count in job_queue.count_jobs().items():
+                metrics.set('jobs', count, state=state)
+        except Exception as e:
+            logger.error('Error sending the heartbeat. Trace:', e, module=Module.MAIN)
+
+
+def _dead_letter(job_queue: JobQueue, worker_id: str, job: Dict[str, any], error: str) -> None:
+    """
+    Dead-letters a job and moves its pdf file into the failed directory, if it is still in the import directory.
+    :param job_queue: the shared job queue.
+    :param worker_id: the id of this worker, holding the lease of the job.
+    :param job: the claimed job.
+    :param error: the reason, kept with the job.
+    :return:
+    """
+    filepath: str = os.path.join(setup.SOURCE_DIR, job['name'])
+    if os.path.exists(filepath):
+        shutil.move(filepath, os.path.join(setup.FAILED_DIR, job['name']))
+    job_queue.fail(job_id=job['id'], worker=worker_id, error=error, retry=False)
+    metrics.inc('jobs_total', outcome='dead')
+    logger.error(f'Job for "{job["name"]}" dead-lettered after {job["attempts"]} attempts:', error,
+                 module=Module.MAIN)
+
+
+def _claim_files(
+        job_queue: JobQueue,
+        worker_id: str,
+        claimed: Dict[str, Dict[str, any]],
+        stop_event: threading.Event
+) -> Iterator[str]:
+    """
+    Claims jobs from the shared job queue as the pipeline takes them, until the stop event is set.
+    Jobs of crashed workers are claimed again once their lease expired, as are jobs this worker failed to hand
+    to the pipeline: only the leases of the jobs in the pipeline are renewed.
+    :param job_queue: the shared job queue.
+    :param worker_id: the id of this worker.
+    :param claimed: receives the claimed jobs by the path of their pdf file.
+    :param stop_event: ends the claims.
+    :return: an iterator over the pdf files of the claimed jobs.
+    """
+    while not stop_event.is_set():
+        try:
+            job: Optional[Dict[str, any]] = job_queue.claim(worker=worker_id, lease_seconds=setup.JOB_LEASE_SECONDS)
+            if job is None:
+                stop_event.wait(setup.JOB_POLL_INTERVAL)
+                continue
+            filepath: str = os.path.join(setup.SOURCE_DIR, job['name'])
+            if job['attempts'] > setup.JOB_MAX_ATTEMPTS:
+                # The last attempt did not finish, its worker stopped sending heartbeats.
+                pdf_processor.remove_stale_workdir(filepath=filepath)
+                _dead_letter(job_queue, worker_id, job, 'lease expired')
+                continue
+            if not os.path.exists(filepath):
+                if os.path.exists(os.path.join(setup.TARGET_DIR, job['name'])):
+                    # Imported by a worker that stopped before acknowledging the job.
+                    job_queue.complete(job_id=job['id'], worker=worker_id)
+                else:
+                    _dead_letter(job_queue, worker_id, job, 'file not found')
+                continue
+        except Exception as e:
+            logger.error('Error claiming a job. Trace:', e, module=Module.MAIN)
+            stop_event.wait(setup.JOB_POLL_INTERVAL)
+            continue
+        logger.info(f'Claimed "{filepath}", attempt {job["attempts"]} of {setup.JOB_MAX_ATTEMPTS}.',
+                    module=Module.MAIN)
+        claimed[filepath] = job
+        yield filepath
+
+
+def work() -> None:
+    """
+    Worker mode - like watch mode, but several workers (processes, containers or nodes) share the import directory
+    through the job queue, each pdf file is processed by one worker at a time.
+    Failed files are retried up to JOB_MAX_ATTEMPTS times, then they are dead-lettered into the failed directory.
+    On SIGTERM or SIGINT, no new jobs are claimed, the claimed jobs are finished and exported.
+    :return:
+    """
+    stop_event: threading.Event = threading.Event()
+    finished: threading.Event = threading.Event()
+
+    def _stop(signum: int, _) -> None:
+        logger.info(f'Received signal {signum}, finishing the claimed files...', module=Module.MAIN)
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+    job_queue: JobQueue = persistence.job_queue.get_instance()
+    # A restarted container may get the hostname and pid of its predecessor, but not its leases.
+    worker_id: str = f'{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}'
+    claimed: Dict[str, Dict[str, any]] = {}
+
+    def _on_finished(filepath: str, error: Optional[Exception]) -> None:
+        job: Dict[str, any] = claimed.pop(filepath)
+        if error is None:
+            metrics.inc('jobs_total', outcome='done')
+            if not job_queue.complete(job_id=job['id'], worker=worker_id):
+                logger.warning(f'The lease of "{filepath}" expired before it was acknowledged.', module=Module.MAIN)
+            return
+        if job['attempts'] >= setup.JOB_MAX_ATTEMPTS:
+            _dead_letter(job_queue, worker_id, job, str(error))
+            return
+        failed_file: str = os.path.join(setup.FAILED_DIR, job['name'])
+        if os.path.exists(failed_file):
+            # Back into the import directory before the job is queued again, the pages extracted are checkpointed.
+            shutil.move(failed_file, filepath)
+        job_queue.fail(job_id=job['id'], worker=worker_id, error=str(error), retry=True)
+        metrics.inc('jobs_total', outcome='retried')
+        logger.info(f'Job for "{filepath}" queued again after attempt {job["attempts"]}.', module=Module.MAIN)
+
+    logger.info(f'Starting worker {worker_id}.', module=Module.MAIN)
+    threading.Thread(
+        target=_enqueue_arrivals,
+        args=(job_queue, stop_event),
+        name='enqueuer',
+        daemon=True
+    ).start()
+    heartbeat: threading.Thread = threading.Thread(
+        target=_send_heartbeats,
+        args=(job_queue, worker_id, claimed, finished),
+        name='heartbeat',
+        daemon=True
+    )
+    heartbeat.start()
+    exporter: threading.Thread = threading.Thread(
+        target=_export_periodically,
+        args=(stop_event,),
+        name='exporter',
+        daemon=True
+    )
+    exporter.start()
+    try:
+        pdf_processor.process_files(
+            files=_claim_files(job_queue, worker_id, claimed, stop_event),
+            on_finished=_on_finished
+        )
+    finally:
+        finished.set()
+    heartbeat.join()
+    exporter.join()
+    export_transactions()
+    logger.info('Stopped.', module=Module.MAIN)
+
+
+def _start_metrics() -> None:
+    """
+    Starts the prometheus metrics endpoint and the json metrics snapshots, if configured.
+    :return:
+    """
+    if setup.METRICS_PORT:
+        metrics.start_http_server(port=setup.METRICS_PORT)
+        logger.info(f'Serving metrics on port {setup.METRICS_PORT}.', module=Module.MAIN)
+    if setup.METRICS_SNAPSHOT_PATH:
+        metrics.start_snapshots(path=setup.METRICS_SNAPSHOT_PATH, interval=setup.METRICS_SNAPSHOT_INTERVAL)
+        logger.info(f'Writing metrics snapshots to "{setup.METRICS_SNAPSHOT_PATH}".', module=Module.MAIN)
+
+
+def _parse_args() -> argparse.Namespace:
+    """
+    Parses the command line arguments.
+    :return: the parsed arguments.
+    """
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(description='Extracts transactions from bank statements.')
+    parser.add_argument(
+        'command',
+        nargs='?',
+        default='run',
+        choices=['run', 'retry-failed', 'watch', 'worker'],
+        help='run: process the pdf files in the import directory (default). '
+             'retry-failed: move the failed pdf files back into the import directory and process them. '
+             'watch: keep running and process new pdf files as they arrive in the import directory. '
+             'worker: like watch, sharing the import directory with other workers through the job queue.'
+    )
+    return parser.parse_args()
+
+
 if __name__ == '__main__':
+    args: argparse.Namespace = _parse_args()
     logger.info('Starting application...', module=Module.MAIN)
     setup.create_dirs()
-    _exec()
+    _start_metrics()
+    if args.command == 'watch':
+        watch()
+    elif args.command == 'worker':
+        work()
+    else:
+        if args.command == 'retry-failed':
+            retry_failed()
+        _exec()
+    if setup.METRICS_SNAPSHOT_PATH:
+        metrics.write_snapshot(setup.METRICS_SNAPSHOT_PATH)
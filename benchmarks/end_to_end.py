@@ -0,0 +1,454 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark of the extraction pipeline against the mock Azure OpenAI server, without spending quota.
+For each page count, a synthetic scanned pdf is generated and processed by the application in a fresh
+working directory and child process, so that the database, the caches and the peak memory are measured per run.
+Reports pages/sec, the p50/p95/p99 latency of the llm requests (including rate limiter waits and retries),
+the retries caused by the injected 429/500 responses, the pages requested again after a malformed answer,
+the mean time to the first transaction of streamed requests (--streaming) and the peak RSS.
+The time from the start of the run to the first transaction the pipeline emits is written to the --json results.
+With --deployments, the requests are routed across several mock servers, each with the quota of ai/config.json;
+--failing-deployments makes the first of them fail every request, so that they are ejected.
+With --crash-after, each run is killed once it checkpointed that many page results and is then run again on the same
+directories, rendering to the image directory; the rerun is measured, along with the results it took from the
+checkpoints instead of requesting them again.
+
+The rate limits are taken from ai/config.json. Exits with 1 if a document failed or the throughput is below
+--min-pages-per-second, so the benchmark can gate CI. Requires poppler, like the application.
+
+Usage: python3 -m benchmarks.end_to_end [--pages 1 10 100 500] [--latency lognormal:1.5,0.4] [--throttle-rate 0.02]
+                                        [--streaming --chunk-delay 0.01] [--malformed-rate 0.05]
+                                        [--deployments 3 --failing-deployments 1] [--crash-after 20]
+                                        [--json results.json] [--min-pages-per-second 1.5] [--endpoint http://...]
+"""
+import argparse
+import json
+import math
+import os
+import resource
+import shutil
+import signal
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import closing
+from typing import Dict, List, Optional
+
+from PIL import Image, ImageDraw
+
+from benchmarks import mock_azure_openai
+
+ROOT: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Page size of the synthetic scans, A4 at 100 dpi.
+PAGE_SIZE: tuple = (827, 1169)
+# Number of distinct page images, the pdfs cycle through them.
+PAGE_TEMPLATES: int = 10
+
+
+def _render_page(template: int) -> Image.Image:
+    """
+    Renders a synthetic statement page: a header block on the first template, followed by transaction rows.
+    :param template: the number of the page template.
+    :return: the page image.
+    """
+    image: Image.Image = Image.new('L', PAGE_SIZE, 255)
+    draw: ImageDraw.ImageDraw = ImageDraw.Draw(image)
+    top: int = 60
+    if template == 0:
+        for i, line in enumerate(['Musterbank AG', 'Kontoauszug 1/2024', 'Erika Mustermann',
+                                  'IBAN DE02 1203 0000 0000 2020 51', 'Alter Kontostand 1.234,56 EUR']):
+            draw.text((60, top + i * 22), line, fill=0)
+        top += 200
+    for row in range((PAGE_SIZE[1] - top - 60) // 28):
+        y: int = top + row * 28
+        draw.text((60, y), f'{(row + template) % 28 + 1:02d}.01.2024', fill=0)
+        draw.text((180, y), f'Lastschrift Referenz {template:02d}{row:04d} Verwendungszweck', fill=0)
+        draw.text((680, y), f'-{(row * 37 + template * 11) % 999 + 1},{row % 100:02d}', fill=0)
+    return image
+
+
+def create_pdf(filepath: str, pages: int) -> None:
+    """
+    Creates a scanned (image only) pdf.
+    :param filepath: path of the pdf file.
+    :param pages: the number of pages.
+    :return:
+    """
+    templates: List[Image.Image] = [_render_page(i) for i in range(min(pages, PAGE_TEMPLATES))]
+    images: List[Image.Image] = [templates[i % len(templates)] for i in range(pages)]
+    images[0].save(filepath, 'PDF', resolution=100, save_all=True, append_images=images[1:])
+
+
+def percentile(values: List[float], rank: float) -> float:
+    """
+    Nearest rank percentile.
+    :param values: the measurements.
+    :param rank: the percentile, 0-100.
+    :return: the percentile, 0 if there are no measurements.
+    """
+    if not values:
+        return 0
+    ordered: List[float] = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, math.ceil(rank / 100 * len(ordered)) - 1))]
+
+
+def _run_child(pdf_name: str) -> None:
+    """
+    Processes one pdf in the current working directory and prints the measurements as json.
+    Runs in the child process, the environment points the application at the mock server.
+    :param pdf_name: the name of the pdf in the source directory.
+    :return:
+    """
+    sys.path.insert(0, ROOT)
+    import pdf_processor
+    import setup
+    from metrics_handling import metrics_handler
+    from persistence import db_handler
+
+    latencies: List[float] = []
+    ask_openai = pdf_processor._ask_openai
+
+    def _timed_ask_openai(*args, **kwargs) -> str:
+        start: float = time.perf_counter()
+        try:
+            return ask_openai(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - start)
+
+    pdf_processor._ask_openai = _timed_ask_openai
+    ocr_pack = pdf_processor._ocr_pack
+
+    def _timed_ocr_pack(*args, **kwargs) -> str:
+        start: float = time.perf_counter()
+        try:
+            return ocr_pack(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - start)
+
+    pdf_processor._ocr_pack = _timed_ocr_pack
+    first_transaction: List[float] = []
+
+    def _on_transaction(filepath: str, page_number: int, transaction: Dict[str, any]) -> None:
+        if not first_transaction:
+            first_transaction.append(time.perf_counter() - start)
+
+    setup.create_dirs()
+    start: float = time.perf_counter()
+    pdf_processor.process_files([os.path.join(setup.SOURCE_DIR, pdf_name)], on_transaction=_on_transaction)
+    seconds: float = time.perf_counter() - start
+    snapshot: Dict[str, any] = metrics_handler.get_instance().snapshot()
+    counters: Dict[str, List[Dict[str, any]]] = snapshot['counters']
+    outcomes: Dict[str, float] = {
+        sample['labels']['outcome']: sample['value'] for sample in counters.get('llm_requests_total', [])
+    }
+    tokens: Dict[str, float] = {
+        sample['labels']['direction']: sample['value'] for sample in counters.get('llm_tokens_total', [])
+    }
+    first_items: List[Dict[str, any]] = snapshot['histograms'].get('llm_first_item_seconds', [])
+    first_item_count: int = sum(sample['count'] for sample in first_items)
+    # The extracted transactions per page, to compare the accuracy of runs.
+    transactions: List[List[List[str]]] = []
+    for document in db_handler.get_instance().iter_unexported_documents():
+        transactions = [
+            [[transaction.get('date'), transaction.get('amount')]
+             for transaction in (page['transactions'] or {}).get('transactions') or []]
+            for page in document['document_data']['page_content']
+        ]
+    print(json.dumps({
+        'seconds': seconds,
+        'success': os.path.exists(os.path.join(setup.TARGET_DIR, pdf_name)),
+        'latencies': latencies,
+        'requests': sum(value for outcome, value in outcomes.items() if outcome != 'cache_hit'),
+        'retries': sum(value for outcome, value in outcomes.items() if outcome not in ('ok', 'cache_hit')),
+        'prompt_tokens': tokens.get('prompt', 0),
+        'completion_tokens': tokens.get('completion', 0),
+        'json_retries': sum(
+            sample['value'] for sample in counters.get('pdf_step_errors_total', [])
+            if sample['labels'].get('step') == 'json_parse'
+        ),
+        'first_item_seconds': sum(sample['sum'] for sample in first_items) / max(1, first_item_count),
+        'first_transaction_seconds': first_transaction[0] if first_transaction else 0,
+        'checkpointed': sum(
+            sample['value'] for sample in counters.get('page_results_total', [])
+            if sample['labels'].get('source') == 'checkpoint'
+        ),
+        'transactions': transactions,
+        # KiB on linux, the children are the raster and poppler processes.
+        'peak_rss_kib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'peak_rss_children_kib': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    }))
+
+
+def _prepare_run(
+        pdf_path: str,
+        workdir: str,
+        endpoint: Optional[str],
+        env: Optional[Dict[str, str]] = None,
+        config: Optional[Dict[str, any]] = None
+) -> Dict[str, str]:
+    """
+    Creates a fresh working directory with the pdf in its source directory.
+    :param pdf_path: the pdf file.
+    :param workdir: the working directory of the run.
+    :param endpoint: the base url of the mock server, None for the deployment configured in ai/config.json.
+    :param env: additional environment variables of the run, e.g. the application's settings.
+    :param config: entries replacing those of ai/config.json for the mock server, e.g. STREAMING.
+    :return: the environment of the child process.
+    """
+    os.makedirs(os.path.join(workdir, 'source'))
+    os.makedirs(os.path.join(workdir, 'export'))
+    shutil.copy(pdf_path, os.path.join(workdir, 'source', os.path.basename(pdf_path)))
+    run_env: Dict[str, str] = dict(
+        os.environ,
+        PYTHONPATH=ROOT,
+        RESPONSE_CACHE_MAX_BYTES='0',
+        LOGFILE=os.path.join(workdir, 'app.log'),
+        LOG_LEVEL=os.getenv('LOG_LEVEL') or 'silent'
+    )
+    if endpoint is not None:
+        with open(os.path.join(ROOT, 'ai', 'config.json')) as config_file:
+            mock_config: Dict[str, any] = json.load(config_file)
+        mock_config.update(config or {}, OPENAI_API_BASE=endpoint)
+        config_path: str = os.path.join(workdir, 'config.json')
+        with open(config_path, 'w') as config_file:
+            json.dump(mock_config, config_file)
+        run_env.update(AZURE_OPENAI_CONFIG=config_path, OPENAI_API_KEY='mock')
+    run_env.update(env or {})
+    return run_env
+
+
+def _get_failed_result() -> Dict[str, any]:
+    """
+    Get the measurements of a failed run.
+    :return: the measurements, all zero.
+    """
+    return {'success': False, 'seconds': 0, 'latencies': [], 'peak_rss_kib': 0, 'peak_rss_children_kib': 0,
+            'requests': 0, 'retries': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'json_retries': 0,
+            'first_item_seconds': 0, 'first_transaction_seconds': 0, 'checkpointed': 0, 'transactions': []}
+
+
+def _run_child_process(pdf_name: str, workdir: str, run_env: Dict[str, str]) -> Dict[str, any]:
+    """
+    Processes the pdf in a child process.
+    :param pdf_name: the name of the pdf in the source directory.
+    :param workdir: the working directory of the run.
+    :param run_env: the environment of the child process.
+    :return: the measurements of the run.
+    """
+    process: subprocess.CompletedProcess = subprocess.run(
+        [sys.executable, '-m', 'benchmarks.end_to_end', '--child', pdf_name],
+        cwd=workdir, env=run_env, capture_output=True, text=True
+    )
+    if process.returncode != 0 or not process.stdout.strip():
+        print(process.stderr, file=sys.stderr)
+        return _get_failed_result()
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def run(
+        pdf_path: str,
+        workdir: str,
+        endpoint: Optional[str],
+        env: Optional[Dict[str, str]] = None,
+        config: Optional[Dict[str, any]] = None
+) -> Dict[str, any]:
+    """
+    Runs the application on one pdf in a fresh working directory and child process.
+    :param pdf_path: the pdf file.
+    :param workdir: the working directory of the run.
+    :param endpoint: the base url of the mock server, None for the deployment configured in ai/config.json.
+    :param env: additional environment variables of the run, e.g. the application's settings.
+    :param config: entries replacing those of ai/config.json for the mock server, e.g. STREAMING.
+    :return: the measurements of the run.
+    """
+    run_env: Dict[str, str] = _prepare_run(pdf_path, workdir, endpoint, env=env, config=config)
+    return _run_child_process(os.path.basename(pdf_path), workdir, run_env)
+
+
+def _count_checkpoints(db_path: str) -> int:
+    """
+    Get the number of checkpointed extraction results in the database of a run.
+    :param db_path: path to the database.
+    :return: the number of checkpoints, 0 while the database is not created yet.
+    """
+    try:
+        with closing(sqlite3.connect(f'file:{db_path}?mode=ro', uri=True, timeout=1)) as conn:
+            return conn.execute('SELECT COUNT(*) FROM PAGES').fetchone()[0]
+    except sqlite3.Error:
+        return 0
+
+
+def run_crashed(
+        pdf_path: str,
+        workdir: str,
+        endpoint: Optional[str],
+        crash_after: int,
+        config: Optional[Dict[str, any]] = None,
+        timeout: float = 600
+) -> Dict[str, any]:
+    """
+    Kills the application once it checkpointed some pages of the pdf, then runs it again on the same directories,
+    like a container restarted after a crash. The pages are rendered to the image directory (RASTERIZE_IN_MEMORY
+    off), so the rerun has to replace the working directory the killed run left behind.
+    :param pdf_path: the pdf file.
+    :param workdir: the working directory of the runs.
+    :param endpoint: the base url of the mock server, None for the deployment configured in ai/config.json.
+    :param crash_after: the number of checkpointed extraction results after which the first run is killed.
+    :param config: entries replacing those of ai/config.json for the mock server, e.g. STREAMING.
+    :param timeout: seconds after which the first run is killed without enough checkpoints.
+    :return: the measurements of the rerun, with the checkpoints and stale working directory of the killed run.
+    """
+    pdf_name: str = os.path.basename(pdf_path)
+    run_env: Dict[str, str] = _prepare_run(pdf_path, workdir, endpoint, env={'RASTERIZE_IN_MEMORY': '0'},
+                                           config=config)
+    db_path: str = os.path.join(workdir, 'export', 'database.db')
+    # In its own process group, so that the raster processes are killed with it.
+    process: subprocess.Popen = subprocess.Popen(
+        [sys.executable, '-m', 'benchmarks.end_to_end', '--child', pdf_name],
+        cwd=workdir, env=run_env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True
+    )
+    deadline: float = time.monotonic() + timeout
+    checkpoints: int = 0
+    while process.poll() is None and time.monotonic() < deadline:
+        checkpoints = _count_checkpoints(db_path)
+        if checkpoints >= crash_after:
+            break
+        time.sleep(0.05)
+    crashed: bool = process.poll() is None
+    if crashed:
+        os.killpg(process.pid, signal.SIGKILL)
+    process.wait()
+    checkpoints = _count_checkpoints(db_path)
+    stale_workdir: bool = os.path.isdir(os.path.join(workdir, 'image', pdf_name.lower().replace('.pdf', '')))
+    if not crashed:
+        print(f'{pdf_name} was processed before {crash_after} pages were checkpointed, nothing to resume.',
+              file=sys.stderr)
+        return dict(_get_failed_result(), crash_checkpoints=checkpoints, stale_workdir=stale_workdir)
+    result: Dict[str, any] = _run_child_process(pdf_name, workdir, run_env)
+    result.update(crash_checkpoints=checkpoints, stale_workdir=stale_workdir)
+    return result
+
+
+def _print_result(pages: int, result: Dict[str, any]) -> None:
+    """
+    Prints the measurements of a run as a table row.
+    :param pages: the page count of the pdf.
+    :param result: the measurements of the run.
+    :return:
+    """
+    latencies: List[float] = result['latencies']
+    print(f'{pages:>6}'
+          f'{"ok" if result["success"] else "FAILED":>8}'
+          f'{result["seconds"]:>10.1f}'
+          f'{result["pages_per_second"]:>10.2f}'
+          f'{percentile(latencies, 50) * 1000:>10.0f}'
+          f'{percentile(latencies, 95) * 1000:>10.0f}'
+          f'{percentile(latencies, 99) * 1000:>10.0f}'
+          f'{result["requests"]:>10}'
+          f'{result["retries"]:>9}'
+          f'{result["json_retries"]:>9.0f}'
+          f'{result["first_item_seconds"] * 1000:>10.0f}'
+          f'{result["peak_rss_kib"] / 1024:>10.0f}'
+          f'{result["peak_rss_children_kib"] / 1024:>11.0f}')
+
+
+def main(args: argparse.Namespace) -> int:
+    """
+    Runs the benchmark for each page count and prints the results.
+    :param args: the parsed command line.
+    :return: the exit code.
+    """
+    endpoint: Optional[str] = args.endpoint
+    servers: List[mock_azure_openai.MockAzureOpenAI] = []
+    config: Dict[str, any] = {'STREAMING': args.streaming}
+    if endpoint is None:
+        for index in range(max(1, args.deployments)):
+            server_kwargs: Dict[str, any] = mock_azure_openai.server_kwargs(args)
+            if index < args.failing_deployments:
+                server_kwargs['error_rate'] = 1
+            servers.append(mock_azure_openai.start_server(**server_kwargs))
+        endpoints: List[str] = [f'http://{server.server_address[0]}:{server.server_address[1]}/' for server in servers]
+        endpoint = endpoints[0]
+        if len(endpoints) > 1:
+            config['DEPLOYMENTS'] = [{'OPENAI_API_BASE': deployment_endpoint} for deployment_endpoint in endpoints]
+    tmp: str = tempfile.mkdtemp(prefix='e2e-benchmark-')
+    results: Dict[int, Dict[str, any]] = {}
+    exit_code: int = 0
+    try:
+        print(f'Endpoint: {endpoint}, latency: {args.latency}, throttle rate: {args.throttle_rate}, '
+              f'error rate: {args.error_rate}, malformed rate: {args.malformed_rate}, streaming: {args.streaming}, '
+              f'working directory: {tmp}')
+        print(f'{"pages":>6}{"status":>8}{"seconds":>10}{"pages/s":>10}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}'
+              f'{"requests":>10}{"retries":>9}{"json ret":>9}{"1st tx ms":>10}{"RSS MiB":>10}{"child MiB":>11}')
+        for pages in args.pages:
+            pdf_path: str = os.path.join(tmp, f'statement_{pages}.pdf')
+            create_pdf(pdf_path, pages)
+            if args.crash_after:
+                result: Dict[str, any] = run_crashed(
+                    pdf_path, os.path.join(tmp, f'run_{pages}'), endpoint, crash_after=args.crash_after, config=config
+                )
+            else:
+                result = run(pdf_path, os.path.join(tmp, f'run_{pages}'), endpoint, config=config)
+            result['pages_per_second'] = pages / result['seconds'] if result['success'] and result['seconds'] else 0
+            results[pages] = result
+            _print_result(pages, result)
+            if args.crash_after:
+                print(f'{"":>6}killed after {result["crash_checkpoints"]} checkpoints, '
+                      f'stale image directory: {"yes" if result["stale_workdir"] else "no"}, '
+                      f'rerun served {result["checkpointed"]:.0f} results from the checkpoints')
+            if not result['success'] or result['pages_per_second'] < args.min_pages_per_second:
+                exit_code = 1
+        if len(servers) > 1:
+            print('Requests per deployment:', ', '.join(
+                f'{server.stats["requests"]}{" (failing)" if index < args.failing_deployments else ""}'
+                for index, server in enumerate(servers)
+            ))
+        if args.json:
+            with open(args.json, 'w') as json_file:
+                json.dump({
+                    str(pages): {
+                        'success': result['success'],
+                        'seconds': result['seconds'],
+                        'pages_per_second': result['pages_per_second'],
+                        'p50': percentile(result['latencies'], 50),
+                        'p95': percentile(result['latencies'], 95),
+                        'p99': percentile(result['latencies'], 99),
+                        'requests': result['requests'],
+                        'retries': result['retries'],
+                        'json_retries': result['json_retries'],
+                        'first_item_seconds': result['first_item_seconds'],
+                        'first_transaction_seconds': result['first_transaction_seconds'],
+                        'checkpointed': result['checkpointed'],
+                        'peak_rss_kib': result['peak_rss_kib'],
+                        'peak_rss_children_kib': result['peak_rss_children_kib']
+                    } for pages, result in results.items()
+                }, json_file, indent=2)
+    finally:
+        if not args.keep:
+            shutil.rmtree(tmp, ignore_errors=True)
+    return exit_code
+
+
+if __name__ == '__main__':
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(description=__doc__,
+                                                              formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, nargs='+', default=[1, 10, 100, 500], help='page counts of the pdfs')
+    parser.add_argument('--endpoint', help='base url of an already running mock server')
+    parser.add_argument('--json', help='write the results to this json file')
+    parser.add_argument('--min-pages-per-second', type=float, default=0, help='fail below this throughput')
+    parser.add_argument('--keep', action='store_true', help='keep the working directory')
+    parser.add_argument('--streaming', action='store_true', help='stream the completions')
+    parser.add_argument('--deployments', type=int, default=1, help='number of mock deployments to route across')
+    parser.add_argument('--failing-deployments', type=int, default=0,
+                        help='number of mock deployments failing every request with 500')
+    parser.add_argument('--crash-after', type=int, default=0,
+                        help='kill each run after this many checkpointed pages and measure the rerun')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    mock_azure_openai.add_arguments(parser)
+    parsed: argparse.Namespace = parser.parse_args()
+    if parsed.child:
+        _run_child(parsed.child)
+        sys.exit(0)
+    sys.exit(main(parsed))
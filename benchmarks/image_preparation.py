@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Compares the upload size and the estimated image tokens per page before and after the image preparation.
+The preparation is configured with the same environment variables as the application
+(IMAGE_DPI, IMAGE_MAX_EDGE, IMAGE_GRAYSCALE, IMAGE_FORMAT, IMAGE_QUALITY).
+
+Usage: python3 -m benchmarks.image_preparation <pdf file> [<pdf file> ...]
+"""
+import base64
+import io
+import sys
+import time
+from typing import List, Dict
+
+import pdf2image
+from PIL import Image
+
+from ai.rate_limiter import estimate_image_tokens
+from image_handling.image_handler import image_handler
+
+# pdf2image's default resolution, as used before the image preparation.
+BASELINE_DPI: int = 200
+
+
+def _measure(image_data: bytes, seconds: float) -> Dict[str, float]:
+    """
+    Measures one encoded page.
+    :param image_data: the encoded page.
+    :param seconds: the time it took to prepare and encode the page.
+    :return: the page's measurements.
+    """
+    with Image.open(io.BytesIO(image_data)) as image:
+        width, height = image.size
+    return {
+        'bytes': len(image_data),
+        'base64_bytes': len(base64.b64encode(image_data)),
+        'tokens': estimate_image_tokens(width, height),
+        'seconds': seconds
+    }
+
+
+def _benchmark_pdf(filepath: str) -> Dict[str, List[Dict[str, float]]]:
+    """
+    Renders the pdf once with the baseline settings and once with the image preparation.
+    :param filepath: path to the pdf file.
+    :return: the measurements of each page, before and after.
+    """
+    results: Dict[str, List[Dict[str, float]]] = {'before': [], 'after': []}
+    for image in pdf2image.convert_from_path(filepath, dpi=BASELINE_DPI):
+        start: float = time.perf_counter()
+        buffer: io.BytesIO = io.BytesIO()
+        image.save(buffer, format='PNG')
+        results['before'].append(_measure(buffer.getvalue(), time.perf_counter() - start))
+    for image in pdf2image.convert_from_path(filepath, dpi=image_handler.dpi):
+        start = time.perf_counter()
+        image_data, _ = image_handler.prepare_and_encode(image)
+        results['after'].append(_measure(image_data, time.perf_counter() - start))
+    return results
+
+
+def _print_summary(name: str, pages: List[Dict[str, float]]) -> None:
+    """
+    Prints the per page averages.
+    :param name: the name of the measurement.
+    :param pages: the page measurements.
+    :return:
+    """
+    count: int = max(1, len(pages))
+    print(f'{name:<8}'
+          f'{len(pages):>8}'
+          f'{sum(p["bytes"] for p in pages) / count / 1024:>14.1f}'
+          f'{sum(p["base64_bytes"] for p in pages) / count / 1024:>14.1f}'
+          f'{sum(p["tokens"] for p in pages) / count:>10.0f}'
+          f'{sum(p["seconds"] for p in pages) / count * 1000:>12.1f}')
+
+
+def main(files: List[str]) -> None:
+    """
+    Runs the benchmark for the given pdf files and prints the averages per page.
+    :param files: the pdf files.
+    :return:
+    """
+    before: List[Dict[str, float]] = []
+    after: List[Dict[str, float]] = []
+    for filepath in files:
+        results: Dict[str, List[Dict[str, float]]] = _benchmark_pdf(filepath)
+        before.extend(results['before'])
+        after.extend(results['after'])
+    print(f'Settings: dpi={image_handler.dpi}, max_edge={image_handler.max_edge}, '
+          f'grayscale={image_handler.grayscale}, format={image_handler.image_format}, '
+          f'quality={image_handler.quality}')
+    print(f'{"":<8}{"pages":>8}{"KiB/page":>14}{"b64 KiB/page":>14}{"tokens":>10}{"encode ms":>12}')
+    _print_summary('before', before)
+    _print_summary('after', after)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    main(sys.argv[1:])
@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Azure OpenAI chat completions API, for benchmarks without quota.
+Requests to /openai/deployments/<deployment>/chat/completions are answered with canned json matching the
+prompts in ai/prompts.py, after a latency drawn from the configured distribution. The canned transactions of a page
+depend only on its image or text, so requests packing several pages get the same answers as single page requests.
+Some transaction texts contain backticks, like real statements may.
+Streamed requests are answered with server-sent events in chunks of CHUNK_CHARS characters, the usage included
+if requested. Both kinds of requests take the latency plus the chunk delay for every chunk of the answer.
+A share of the requests can be rejected with 429 and a Retry-After header, or with 500,
+and a share of the answers can be cut off like completions that ran out of tokens.
+GET /stats returns the request counters.
+
+Latency distributions: fixed:<seconds>, uniform:<min>,<max>, normal:<mean>,<stddev>, lognormal:<median>,<sigma>
+
+Usage: python3 -m benchmarks.mock_azure_openai [--port 8089] [--latency lognormal:1.5,0.4] [--throttle-rate 0.05]
+"""
+import argparse
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Characters of the answer per streamed chunk, roughly a few tokens.
+CHUNK_CHARS: int = 16
+# Image tokens billed by the mock for every image of a request, a full page at the default image settings.
+IMAGE_TOKENS: int = 765
+PATH: re.Pattern = re.compile(r'^/openai/deployments/([^/]+)/chat/completions')
+# Page count of the prompts packing several pages into one request.
+PACKED_PAGES: re.Pattern = re.compile(r'provided with (\d+) consecutive pages')
+# Order of the attached images of a packed request.
+PACKED_IMAGES: re.Pattern = re.compile(r'The attached images show, in this order: (.*)\.')
+# Page texts of the text prompts, with the page index in packed prompts.
+PAGE_TEXT: re.Pattern = re.compile(r'# Page text(?: of page_index (\d+))?:\n {4}(.*?)(?=\n {4}# Page text of|\Z)', re.S)
+# The canned account data.
+ACCOUNT_DATA: Dict[str, str] = {
+    'name': 'Erika Mustermann',
+    'IBAN': 'DE02 1203 0000 0000 2020 51',
+    'document_date': '31.01.2024',
+    'previous_account_balance': '1.234,56',
+    'new_account_balance': '2.345,67'
+}
+
+
+def parse_latency(spec: str) -> Callable[[], float]:
+    """
+    Parses a latency distribution.
+    :param spec: the distribution, e.g. fixed:0.5, uniform:0.2,1, normal:1,0.2 or lognormal:1.5,0.4.
+    :return: a function drawing a latency in seconds.
+    """
+    name, _, args = spec.partition(':')
+    values: List[float] = [float(value) for value in args.split(',') if value]
+    if name == 'fixed' and len(values) == 1:
+        return lambda: values[0]
+    if name == 'uniform' and len(values) == 2:
+        return lambda: random.uniform(values[0], values[1])
+    if name == 'normal' and len(values) == 2:
+        return lambda: max(0.0, random.gauss(values[0], values[1]))
+    if name == 'lognormal' and len(values) == 2:
+        return lambda: random.lognormvariate(math.log(values[0]), values[1])
+    raise ValueError(f'Invalid latency distribution "{spec}".')
+
+
+def _get_prompt(body: Dict[str, any]) -> Tuple[str, List[str]]:
+    """
+    Get the text and the images of a chat completions request.
+    :param body: the request body.
+    :return: the text of all messages and the image urls, in order.
+    """
+    texts: List[str] = []
+    images: List[str] = []
+    for message in body.get('messages', []):
+        content: any = message.get('content', '')
+        if isinstance(content, str):
+            texts.append(content)
+            continue
+        for part in content:
+            if part.get('type') == 'text':
+                texts.append(part.get('text', ''))
+            elif part.get('type') == 'image_url':
+                images.append(part.get('image_url', {}).get('url', ''))
+    return '\n'.join(texts), images
+
+
+class MockAzureOpenAI(ThreadingHTTPServer):
+    """
+    The mock server, each request is handled in its own thread.
+    """
+    daemon_threads: bool = True
+
+    def __init__(
+            self,
+            address: Tuple[str, int],
+            latency: Callable[[], float],
+            throttle_rate: float = 0,
+            retry_after: float = 1,
+            error_rate: float = 0,
+            transactions_per_page: int = 20,
+            malformed_rate: float = 0,
+            chunk_delay: float = 0
+    ):
+        """
+        Default constructor.
+        :param address: host and port to listen on.
+        :param latency: draws the latency of a successful request in seconds.
+        :param throttle_rate: share of the requests rejected with 429.
+        :param retry_after: the Retry-After of the rejected requests in seconds.
+        :param error_rate: share of the requests failing with 500.
+        :param transactions_per_page: number of transactions in the canned responses.
+        :param malformed_rate: share of the answers cut off in the middle of the json.
+        :param chunk_delay: seconds to generate a chunk of CHUNK_CHARS characters of the answer.
+        """
+        super().__init__(address, _RequestHandler)
+        self.latency: Callable[[], float] = latency
+        self.throttle_rate: float = throttle_rate
+        self.retry_after: float = retry_after
+        self.error_rate: float = error_rate
+        self.transactions_per_page: int = transactions_per_page
+        self.malformed_rate: float = malformed_rate
+        self.chunk_delay: float = chunk_delay
+        self.lock: threading.Lock = threading.Lock()
+        self.stats: Dict[str, int] = {
+            'requests': 0, 'completed': 0, 'throttled': 0, 'errors': 0, 'malformed': 0, 'streamed': 0, 'tokens': 0
+        }
+
+    def count(self, name: str, value: int = 1) -> None:
+        """
+        Increments a request counter.
+        :param name: the name of the counter.
+        :param value: the increment.
+        :return:
+        """
+        with self.lock:
+            self.stats[name] += value
+
+    def build_transactions(self, page: str) -> List[Dict[str, str]]:
+        """
+        Builds the canned transactions of a page.
+        :param page: the image url or the text of the page, the transactions are the same for the same page.
+        :return: the transactions.
+        """
+        page_random: random.Random = random.Random(hashlib.sha256(page.encode('utf-8')).digest())
+        return [
+            {
+                'date': f'{day % 28 + 1:02d}.01.2024',
+                'amount': f'{page_random.choice(["", "-"])}{page_random.randint(1, 99999) / 100:.2f}'.replace('.', ','),
+                'transaction_text': f'Lastschrift Referenz {page_random.randint(100000, 999999)}'
+                                    + (' `SEPA`' if day % 5 == 0 else '')
+            }
+            for day in range(self.transactions_per_page)
+        ]
+
+    def build_content(self, prompt: str, images: List[str]) -> str:
+        """
+        Builds the canned json answer for a prompt.
+        :param prompt: the text of the request.
+        :param images: the image urls of the request.
+        :return: the json answer.
+        """
+        texts: Dict[Optional[str], str] = {match.group(1): match.group(2) for match in PAGE_TEXT.finditer(prompt)}
+        packed: Optional[re.Match] = PACKED_PAGES.search(prompt)
+        if packed:
+            names: re.Match = PACKED_IMAGES.search(prompt)
+            pages: Dict[str, str] = dict(zip(names.group(1).split(', ') if names else [], images))
+            content: Dict[str, any] = {
+                'transactions': [
+                    dict(transaction, page_index=page_index)
+                    for page_index in range(int(packed.group(1)))
+                    for transaction in self.build_transactions(
+                        pages.get(f'page_index {page_index}') or texts.get(str(page_index), '')
+                    )
+                ]
+            }
+            if 'account_data' in prompt:
+                content['account_data'] = ACCOUNT_DATA
+            return json.dumps(content)
+        if 'account_data' in prompt:
+            return json.dumps({'account_data': ACCOUNT_DATA})
+        return json.dumps({'transactions': self.build_transactions(images[0] if images else texts.get(None, prompt))})
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    """
+    Handles the requests of the mock server.
+    """
+    protocol_version: str = 'HTTP/1.1'
+    server: MockAzureOpenAI
+
+    def __send_json(self, status: int, body: Dict[str, any], headers: Dict[str, str] = None) -> None:
+        """
+        Sends a json response.
+        :param status: the http status.
+        :param body: the response body.
+        :param headers: additional response headers.
+        :return:
+        """
+        data: bytes = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def __send_stream(self, content: str, finish_reason: str, usage: Optional[Dict[str, int]]) -> None:
+        """
+        Sends an answer as server-sent events of chat completion chunks.
+        :param content: the answer.
+        :param finish_reason: the finish reason of the last chunk.
+        :param usage: the usage of the request, sent in a last chunk without choices if requested.
+        :return:
+        """
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        completion_id: str = f'chatcmpl-mock-{random.getrandbits(64):016x}'
+        created: int = int(time.time())
+
+        def _send_event(choices: List[Dict[str, any]], chunk_usage: Optional[Dict[str, int]] = None) -> None:
+            event: Dict[str, any] = {
+                'id': completion_id,
+                'object': 'chat.completion.chunk',
+                'created': created,
+                'model': 'gpt-4o',
+                'choices': choices,
+                'usage': chunk_usage
+            }
+            self.__write_chunk(f'data: {json.dumps(event)}\n\n'.encode('utf-8'))
+
+        for start in range(0, len(content), CHUNK_CHARS):
+            time.sleep(self.server.chunk_delay)
+            _send_event([{
+                'index': 0,
+                'delta': {'role': 'assistant', 'content': content[start:start + CHUNK_CHARS]},
+                'finish_reason': None
+            }])
+        _send_event([{'index': 0, 'delta': {}, 'finish_reason': finish_reason}])
+        if usage is not None:
+            _send_event([], usage)
+        self.__write_chunk(b'data: [DONE]\n\n')
+        self.__write_chunk(b'')
+
+    def __write_chunk(self, data: bytes) -> None:
+        """
+        Writes a chunk of a response with chunked transfer encoding, an empty chunk ends the response.
+        :param data: the data of the chunk.
+        :return:
+        """
+        self.wfile.write(f'{len(data):x}\r\n'.encode('ascii') + data + b'\r\n')
+        self.wfile.flush()
+
+    def do_GET(self) -> None:
+        """
+        Returns the request counters on /stats.
+        :return:
+        """
+        if self.path != '/stats':
+            self.__send_json(404, {'error': {'code': '404', 'message': 'Not found'}})
+            return
+        with self.server.lock:
+            stats: Dict[str, int] = dict(self.server.stats)
+        self.__send_json(200, stats)
+
+    def do_POST(self) -> None:
+        """
+        Answers a chat completions request.
+        :return:
+        """
+        body: Dict[str, any] = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'{}')
+        match: re.Match = PATH.match(self.path)
+        if match is None:
+            self.__send_json(404, {'error': {'code': '404', 'message': 'Resource not found'}})
+            return
+        self.server.count('requests')
+        chance: float = random.random()
+        if chance < self.server.throttle_rate:
+            self.server.count('throttled')
+            self.__send_json(429, {'error': {'code': '429', 'message': 'Rate limit is exceeded.'}}, {
+                'Retry-After': str(math.ceil(self.server.retry_after)),
+                'retry-after-ms': str(round(self.server.retry_after * 1000))
+            })
+            return
+        if chance < self.server.throttle_rate + self.server.error_rate:
+            self.server.count('errors')
+            self.__send_json(500, {'error': {'code': '500', 'message': 'Internal server error.'}})
+            return
+        prompt, images = _get_prompt(body)
+        time.sleep(self.server.latency())
+        content: str = self.server.build_content(prompt, images)
+        finish_reason: str = 'stop'
+        if random.random() < self.server.malformed_rate:
+            self.server.count('malformed')
+            content = content[:len(content) // 2]
+            finish_reason = 'length'
+        prompt_tokens: int = len(prompt) // 4 + len(images) * IMAGE_TOKENS
+        completion_tokens: int = len(content) // 4
+        usage: Dict[str, int] = {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens
+        }
+        self.server.count('completed')
+        self.server.count('tokens', prompt_tokens + completion_tokens)
+        if body.get('stream'):
+            self.server.count('streamed')
+            include_usage: bool = bool((body.get('stream_options') or {}).get('include_usage'))
+            self.__send_stream(content, finish_reason, usage if include_usage else None)
+            return
+        time.sleep(self.server.chunk_delay * math.ceil(len(content) / CHUNK_CHARS))
+        self.__send_json(200, {
+            'id': f'chatcmpl-mock-{random.getrandbits(64):016x}',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': 'gpt-4o',
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': content},
+                'finish_reason': finish_reason
+            }],
+            'usage': usage
+        })
+
+    def log_message(self, format: str, *args) -> None:
+        """
+        Silences the request log.
+        """
+        return
+
+
+def start_server(host: str = '127.0.0.1', port: int = 0, **kwargs) -> MockAzureOpenAI:
+    """
+    Starts the mock server in a background thread.
+    :param host: the host to listen on.
+    :param port: the port to listen on, 0 picks a free port.
+    :param kwargs: the arguments of the mock server.
+    :return: the running mock server, its address is server.server_address.
+    """
+    server: MockAzureOpenAI = MockAzureOpenAI((host, port), **kwargs)
+    threading.Thread(target=server.serve_forever, name='mock-azure-openai', daemon=True).start()
+    return server
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """
+    Adds the mock server's options to a command line parser.
+    :param parser: the command line parser.
+    :return:
+    """
+    parser.add_argument('--latency', default='lognormal:1.5,0.4', help='latency distribution of the responses')
+    parser.add_argument('--throttle-rate', type=float, default=0, help='share of requests rejected with 429')
+    parser.add_argument('--retry-after', type=float, default=1, help='Retry-After of rejected requests in seconds')
+    parser.add_argument('--error-rate', type=float, default=0, help='share of requests failing with 500')
+    parser.add_argument('--transactions', type=int, default=20, help='transactions per page in the responses')
+    parser.add_argument('--malformed-rate', type=float, default=0, help='share of answers cut off mid-json')
+    parser.add_argument('--chunk-delay', type=float, default=0,
+                        help=f'seconds to generate {CHUNK_CHARS} characters of an answer')
+
+
+def server_kwargs(args: argparse.Namespace) -> Dict[str, any]:
+    """
+    Get the mock server's arguments from the parsed command line.
+    :param args: the parsed command line.
+    :return: the arguments of the mock server.
+    """
+    return {
+        'latency': parse_latency(args.latency),
+        'throttle_rate': args.throttle_rate,
+        'retry_after': args.retry_after,
+        'error_rate': args.error_rate,
+        'transactions_per_page': args.transactions,
+        'malformed_rate': args.malformed_rate,
+        'chunk_delay': args.chunk_delay
+    }
+
+
+if __name__ == '__main__':
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(description=__doc__,
+                                                              formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    add_arguments(parser)
+    args: argparse.Namespace = parser.parse_args()
+    mock: MockAzureOpenAI = MockAzureOpenAI((args.host, args.port), **server_kwargs(args))
+    print(f'Mock Azure OpenAI listening on http://{args.host}:{args.port}/')
+    mock.serve_forever()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Compares packing several pages into one llm request (PAGES_PER_REQUEST) with one page per request.
+Each pdf is processed once per setting, in a fresh working directory and child process like the end-to-end benchmark.
+Reports the requests, the prompt tokens, the duration and the p50/p95 request latency of each setting, and its
+accuracy: the F1 score of the extracted transactions (page, date and amount) against the run with one page per
+request, or against the reference transactions given with --truth.
+
+Against the mock server (default), the canned transactions only depend on the page, so the accuracy checks that the
+packed responses are split into the right pages. The accuracy of the model itself needs a live deployment (--live),
+which uses ai/config.json and OPENAI_API_KEY and spends quota.
+
+Exits with 1 if a run failed or a setting is below --min-accuracy.
+
+Usage: python3 -m benchmarks.page_packing [--pages 10 50] [--pages-per-request 2 4 8] [--latency fixed:1]
+       python3 -m benchmarks.page_packing --live statement.pdf [--truth truth.json] [--pages-per-request 2 4]
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from benchmarks import end_to_end, mock_azure_openai
+from persistence.normalization import normalize_amount, normalize_date
+
+
+def _count_transactions(pages: List[List[List[str]]]) -> Counter:
+    """
+    Counts the normalized transactions of a document.
+    :param pages: the transactions of each page, as [date, amount].
+    :return: the number of occurrences of each (page, date, amount).
+    """
+    return Counter(
+        (page_number, normalize_date(date), normalize_amount(amount))
+        for page_number, transactions in enumerate(pages)
+        for date, amount in transactions
+    )
+
+
+def accuracy(pages: List[List[List[str]]], reference: List[List[List[str]]]) -> float:
+    """
+    F1 score of the extracted transactions against the reference transactions.
+    :param pages: the extracted transactions of each page, as [date, amount].
+    :param reference: the reference transactions of each page, as [date, amount].
+    :return: the F1 score, 1 if both are empty.
+    """
+    extracted: Counter = _count_transactions(pages)
+    expected: Counter = _count_transactions(reference)
+    total: int = sum(extracted.values()) + sum(expected.values())
+    return 2 * sum((extracted & expected).values()) / total if total else 1.0
+
+
+def _print_result(pdf_name: str, pages_per_request: int, result: Dict[str, any]) -> None:
+    """
+    Prints the measurements of a run as a table row.
+    :param pdf_name: the name of the pdf.
+    :param pages_per_request: the setting of the run.
+    :param result: the measurements of the run.
+    :return:
+    """
+    print(f'{pdf_name:<24}'
+          f'{pages_per_request:>8}'
+          f'{"ok" if result["success"] else "FAILED":>8}'
+          f'{len(result["transactions"]):>7}'
+          f'{result["requests"]:>10.0f}'
+          f'{result["prompt_tokens"]:>12.0f}'
+          f'{result["seconds"]:>10.1f}'
+          f'{end_to_end.percentile(result["latencies"], 50) * 1000:>10.0f}'
+          f'{end_to_end.percentile(result["latencies"], 95) * 1000:>10.0f}'
+          f'{result["accuracy"]:>10.3f}')
+
+
+def main(args: argparse.Namespace) -> int:
+    """
+    Runs each pdf with one page per request and with each packing setting, and prints the results.
+    :param args: the parsed command line.
+    :return: the exit code.
+    """
+    endpoint: Optional[str] = None
+    if not args.live:
+        server: mock_azure_openai.MockAzureOpenAI = mock_azure_openai.start_server(
+            **mock_azure_openai.server_kwargs(args)
+        )
+        endpoint = f'http://{server.server_address[0]}:{server.server_address[1]}/'
+    truth: Dict[str, List[List[List[str]]]] = {}
+    if args.truth:
+        with open(args.truth) as truth_file:
+            truth = json.load(truth_file)
+    settings: List[int] = [1] + [pages for pages in args.pages_per_request if pages != 1]
+    tmp: str = tempfile.mkdtemp(prefix='packing-benchmark-')
+    results: Dict[str, Dict[int, Dict[str, any]]] = {}
+    exit_code: int = 0
+    try:
+        pdfs: List[Tuple[str, str]] = [(os.path.basename(pdf), pdf) for pdf in args.pdfs]
+        if not pdfs:
+            for pages in args.pages:
+                pdf_path: str = os.path.join(tmp, f'statement_{pages}.pdf')
+                end_to_end.create_pdf(pdf_path, pages)
+                pdfs.append((os.path.basename(pdf_path), pdf_path))
+        print(f'Endpoint: {endpoint or "ai/config.json"}, working directory: {tmp}')
+        print(f'{"pdf":<24}{"pages/r":>8}{"status":>8}{"pages":>7}{"requests":>10}{"prompt tok":>12}{"seconds":>10}'
+              f'{"p50 ms":>10}{"p95 ms":>10}{"accuracy":>10}')
+        for pdf_name, pdf_path in pdfs:
+            reference: Optional[List[List[List[str]]]] = truth.get(pdf_name)
+            results[pdf_name] = {}
+            for pages_per_request in settings:
+                result: Dict[str, any] = end_to_end.run(
+                    pdf_path,
+                    os.path.join(tmp, f'run_{len(results)}_{pages_per_request}'),
+                    endpoint,
+                    env={'PAGES_PER_REQUEST': str(pages_per_request)}
+                )
+                if reference is None and result['success']:
+                    # Without reference transactions, one page per request is the baseline.
+                    reference = result['transactions']
+                result['accuracy'] = accuracy(result['transactions'], reference) if reference is not None else 0
+                results[pdf_name][pages_per_request] = result
+                _print_result(pdf_name, pages_per_request, result)
+                if not result['success'] or result['accuracy'] < args.min_accuracy:
+                    exit_code = 1
+        if args.json:
+            with open(args.json, 'w') as json_file:
+                json.dump({
+                    pdf_name: {
+                        str(pages_per_request): {
+                            'success': result['success'],
+                            'pages': len(result['transactions']),
+                            'requests': result['requests'],
+                            'retries': result['retries'],
+                            'prompt_tokens': result['prompt_tokens'],
+                            'completion_tokens': result['completion_tokens'],
+                            'seconds': result['seconds'],
+                            'p50': end_to_end.percentile(result['latencies'], 50),
+                            'p95': end_to_end.percentile(result['latencies'], 95),
+                            'accuracy': result['accuracy']
+                        } for pages_per_request, result in runs.items()
+                    } for pdf_name, runs in results.items()
+                }, json_file, indent=2)
+    finally:
+        if not args.keep:
+            shutil.rmtree(tmp, ignore_errors=True)
+    return exit_code
+
+
+if __name__ == '__main__':
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(description=__doc__,
+                                                              formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('pdfs', nargs='*', help='pdf files, synthetic scanned pdfs of --pages pages by default')
+    parser.add_argument('--pages', type=int, nargs='+', default=[10, 50], help='page counts of the synthetic pdfs')
+    parser.add_argument('--pages-per-request', type=int, nargs='+', default=[2, 4, 8],
+                        help='the packing settings compared with one page per request')
+    parser.add_argument('--live', action='store_true', help='use the deployment configured in ai/config.json')
+    parser.add_argument('--truth', help='json file mapping pdf names to their transactions per page as [date, amount]')
+    parser.add_argument('--min-accuracy', type=float, default=0, help='fail below this accuracy')
+    parser.add_argument('--json', help='write the results to this json file')
+    parser.add_argument('--keep', action='store_true', help='keep the working directory')
+    mock_azure_openai.add_arguments(parser)
+    sys.exit(main(parser.parse_args()))
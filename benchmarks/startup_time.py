@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Startup time check of the application modules.
+Each module is imported in a fresh interpreter, in an empty working directory and without OPENAI_API_KEY.
+The import must stay within the time budget, must not load the heavy dependencies (langchain, openai, pdf2image)
+and must not have side effects such as creating the database or the response cache.
+
+Exits with 1 if a module is over budget, loads a heavy dependency, creates files or fails to import,
+so the check can gate CI.
+
+Usage: python3 -m benchmarks.startup_time [--modules app pdf_processor] [--runs 5] [--budget 0.5]
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+from typing import Dict, List
+
+ROOT: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Modules only needed once a pdf is rasterized or sent to the llm.
+HEAVY_MODULES: List[str] = ['langchain', 'langchain_core', 'openai', 'pdf2image']
+# Imports the module, then prints the import time and the loaded heavy modules as json.
+CHILD_SCRIPT: str = '''
+import json, sys, time
+start = time.perf_counter()
+__import__(sys.argv[1])
+seconds = time.perf_counter() - start
+print(json.dumps({"seconds": seconds, "heavy": [m for m in sys.argv[2:] if m in sys.modules]}))
+'''
+
+
+def _import(module: str, workdir: str) -> Dict[str, any]:
+    """
+    Imports a module in a fresh interpreter.
+    :param module: the module to import.
+    :param workdir: the working directory of the interpreter.
+    :return: the import time in seconds, the loaded heavy modules and the files created in the working directory.
+    """
+    env: Dict[str, str] = dict(os.environ, PYTHONPATH=ROOT, LOGFILE=os.path.join(workdir, 'app.log'))
+    env.pop('OPENAI_API_KEY', None)
+    process: subprocess.CompletedProcess = subprocess.run(
+        [sys.executable, '-c', CHILD_SCRIPT, module, *HEAVY_MODULES],
+        cwd=workdir, env=env, capture_output=True, text=True
+    )
+    if process.returncode != 0 or not process.stdout.strip():
+        return {'error': process.stderr.strip() or f'exit code {process.returncode}'}
+    result: Dict[str, any] = json.loads(process.stdout.strip().splitlines()[-1])
+    result['files'] = sorted(
+        os.path.relpath(os.path.join(directory, name), workdir)
+        for directory, _, names in os.walk(workdir) for name in names if name != 'app.log'
+    )
+    return result
+
+
+def main(args: argparse.Namespace) -> int:
+    """
+    Measures the import time of each module and prints the results.
+    :param args: the parsed command line.
+    :return: the exit code.
+    """
+    exit_code: int = 0
+    print(f'{"module":<28}{"median ms":>10}{"max ms":>10}  problems')
+    for module in args.modules:
+        timings: List[float] = []
+        problems: List[str] = []
+        for _ in range(args.runs):
+            workdir: str = tempfile.mkdtemp(prefix='startup-')
+            try:
+                result: Dict[str, any] = _import(module, workdir)
+            finally:
+                shutil.rmtree(workdir, ignore_errors=True)
+            if 'error' in result:
+                problems = [f'import failed: {result["error"].splitlines()[-1]}']
+                break
+            timings.append(result['seconds'])
+            problems += [f'loads {name}' for name in result['heavy'] if f'loads {name}' not in problems]
+            problems += [f'creates {name}' for name in result['files'] if f'creates {name}' not in problems]
+        median: float = statistics.median(timings) if timings else 0
+        if median > args.budget:
+            problems.append(f'over budget of {args.budget * 1000:.0f} ms')
+        if problems:
+            exit_code = 1
+        print(f'{module:<28}{median * 1000:>10.0f}{max(timings, default=0) * 1000:>10.0f}  {", ".join(problems)}')
+    return exit_code
+
+
+if __name__ == '__main__':
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(description=__doc__,
+                                                              formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modules', nargs='+', default=['app', 'pdf_processor', 'persistence.db_handler'],
+                        help='modules to import')
+    parser.add_argument('--runs', type=int, default=5, help='imports per module, the median is reported')
+    parser.add_argument('--budget', type=float, default=0.5, help='maximum median import time in seconds')
+    sys.exit(main(parser.parse_args()))
@@ -1,8 +1,9 @@
 #!/usr/bin/env python3
 import csv
 import os
+import uuid
 
-from typing import Tuple, List, Optional
+from typing import Tuple, List, Optional, Iterable
 from log_handling.log_handler import Logger, Module, get_instance
 
 logger: Logger = get_instance()
@@ -36,36 +37,43 @@ class CSVHandler:
         """
         return [str(item) if item is not None else '' for item in row]
 
-    def __write_content(self, writer: csv, rows: List[List[str]]) -> None:
+    def __write_content(self, writer: csv, rows: Iterable[List[str]]) -> None:
         """
-        Write the csv rows.
-        :param rows: the csv rows as a list of cells.
+        Write the csv rows, one at a time.
+        :param rows: the csv rows as an iterable of cells.
         :return:
         """
         logger.info('Writing CSV rows...', module=Module.CSV)
-        filtered: List[List[str]] = [self.__filter_empty_cells(row) for row in rows]
-        writer.writerows(filtered)
+        writer.writerows(self.__filter_empty_cells(row) for row in rows)
 
-    def export(self, headers: List[str], rows: List[List[str]], filepath: str) -> None:
+    def export(self, headers: List[str], rows: Iterable[List[str]], filepath: str) -> None:
         """
         Exports the given csv rows to a new file.
         :param headers: the csv headers as a list of strings.
-        :param rows: The csv rows as a list, each consisting of a list of cells.
+        :param rows: The csv rows as an iterable, each consisting of a list of cells. May be a generator.
         :param filepath: The name of the file to write to.
         :return:
         """
         logger.info(f'Exporting csv data to file \"{filepath}\".', module=Module.CSV)
-        with open(filepath, 'w+') as f:
-            writer = csv.writer(
-                f,
-                delimiter=self.CSV_DELIMITER,
-                quotechar=self.CSV_ESCAPE_CHARACTER,
-                escapechar='\\',
-                lineterminator='\n'
-            )
-            self.__write_header(writer=writer, headers=headers)
-            self.__write_content(writer=writer, rows=rows)
-            f.flush()
+        # Written to a temporary file first and renamed, so that concurrent exports of workers sharing
+        # the export directory never leave a mixed or truncated file.
+        tmp_path: str = f'{filepath}.{uuid.uuid4().hex}.tmp'
+        try:
+            with open(tmp_path, 'w+') as f:
+                writer = csv.writer(
+                    f,
+                    delimiter=self.CSV_DELIMITER,
+                    quotechar=self.CSV_ESCAPE_CHARACTER,
+                    escapechar='\\',
+                    lineterminator='\n'
+                )
+                self.__write_header(writer=writer, headers=headers)
+                self.__write_content(writer=writer, rows=rows)
+                f.flush()
+            os.replace(tmp_path, filepath)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
         logger.info('CSV data exported successfully.', module=Module.CSV)
 
     def __read_csv_values(self, file_ptr) -> List[List[str]]:
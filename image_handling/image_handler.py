@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+import io
+from typing import Tuple
+
+from PIL import Image
+
+import setup
+
+
+class ImageHandler:
+    """
+    Prepares the rendered pdf pages for the upload to the llm.
+    By default, pages are downscaled to the resolution GPT-4o works on anyway (long edge <= 2048px,
+    short edge <= 768px), which shrinks the upload without changing the billed image tokens.
+    A smaller maximum long edge is aligned to the 512px tiles of the model and saves image tokens.
+    """
+    # GPT-4o scales the short edge of an image down to 768px and bills it per 512px tile.
+    MODEL_SHORT_EDGE: int = 768
+    MODEL_TILE_SIZE: int = 512
+
+    def __get_max_edge(self) -> int:
+        """
+        Get the maximum long edge, aligned down to the model's tile size.
+        :return: the maximum long edge in pixels.
+        """
+        return max(self.MODEL_TILE_SIZE, self.max_edge // self.MODEL_TILE_SIZE * self.MODEL_TILE_SIZE)
+
+    def prepare(self, image: Image.Image) -> Image.Image:
+        """
+        Downscales the page image and converts it to grayscale, if configured.
+        :param image: the rendered page.
+        :return: the prepared page.
+        """
+        width, height = image.size
+        scale: float = min(
+            1.0,
+            self.__get_max_edge() / max(width, height),
+            self.MODEL_SHORT_EDGE / min(width, height)
+        )
+        if scale < 1:
+            image = image.resize((max(1, round(width * scale)), max(1, round(height * scale))), Image.LANCZOS)
+        if self.grayscale:
+            return image.convert('L')
+        # Drop the alpha channel, jpeg can not store it and the model does not need it.
+        return image.convert('RGB') if image.mode not in ('RGB', 'L') else image
+
+    def encode(self, image: Image.Image) -> Tuple[bytes, str]:
+        """
+        Encodes the page image in the configured format.
+        :param image: the prepared page.
+        :return: the encoded image and the image type.
+        """
+        buffer: io.BytesIO = io.BytesIO()
+        if self.image_format in ('jpeg', 'jpg'):
+            image.save(buffer, format='JPEG', quality=self.quality, optimize=True)
+            return buffer.getvalue(), 'jpeg'
+        if self.image_format == 'webp':
+            image.save(buffer, format='WEBP', quality=self.quality)
+            return buffer.getvalue(), 'webp'
+        image.save(buffer, format='PNG')
+        return buffer.getvalue(), 'png'
+
+    def prepare_and_encode(self, image: Image.Image) -> Tuple[bytes, str]:
+        """
+        Prepares and encodes the page image for the upload.
+        :param image: the rendered page.
+        :return: the encoded image and the image type.
+        """
+        return self.encode(self.prepare(image))
+
+    def __init__(
+            self,
+            dpi: int = setup.IMAGE_DPI,
+            max_edge: int = setup.IMAGE_MAX_EDGE,
+            grayscale: bool = setup.IMAGE_GRAYSCALE,
+            image_format: str = setup.IMAGE_FORMAT,
+            quality: int = setup.IMAGE_QUALITY
+    ):
+        """
+        Default constructor.
+        :param dpi: the resolution the pdf pages are rendered with.
+        :param max_edge: the maximum long edge of the uploaded images in pixels.
+        :param grayscale: whether the images are uploaded in grayscale.
+        :param image_format: the format of the uploaded images, png (lossless), jpeg or webp.
+        :param quality: the quality of jpeg and webp images.
+        """
+        self.dpi: int = dpi
+        self.max_edge: int = max_edge
+        self.grayscale: bool = grayscale
+        self.image_format: str = image_format
+        self.quality: int = quality
+
+
+image_handler: ImageHandler = ImageHandler()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image, ImageOps
+
+import setup
+
+
+class LayoutHandler:
+    """
+    Detects the regions of a rendered statement page with whitespace projections, CPU only.
+    Pages are cropped to their content (white margins are removed), the cover page is additionally
+    split into the header block with the account data and the body with the transactions.
+    A page is analysed once with analyze, the layout is shared by the page filter and the crops.
+    """
+    # The analysis runs on a downscaled copy of the page with this height.
+    ANALYSIS_HEIGHT: int = 1000
+    # Pixels darker than this (0-255) count as ink.
+    INK_THRESHOLD: int = 160
+    # Minimum share of ink pixels for a row to count as a text row.
+    ROW_INK_RATIO: float = 0.002
+    # Minimum white gap between the header and the body, relative to the page height.
+    HEADER_GAP_RATIO: float = 0.03
+    # The header must end within this share of the page height.
+    HEADER_MAX_RATIO: float = 0.5
+    # Padding around the crops, relative to the page height.
+    PADDING_RATIO: float = 0.01
+
+    def __get_ink_mask(self, image: Image.Image) -> Tuple[Image.Image, float]:
+        """
+        Creates a downscaled black and white ink mask of the page (ink = 255).
+        :param image: the rendered page.
+        :return: the ink mask and the scale factor from the page to the mask.
+        """
+        scale: float = min(1.0, self.ANALYSIS_HEIGHT / image.height)
+        gray: Image.Image = image.convert('L')
+        if scale < 1:
+            gray = gray.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))), Image.BOX)
+        return ImageOps.invert(gray).point(lambda v: 255 if v > 255 - self.INK_THRESHOLD else 0), scale
+
+    def analyze(self, image: Image.Image) -> Dict[str, any]:
+        """
+        Analyses the ink of a downscaled copy of the page.
+        :param image: the rendered page.
+        :return: the layout of the page: the ink mask, the scale factor from the page to the mask
+            and the row profile, the share of ink pixels for each row, ANALYSIS_HEIGHT rows at most.
+        """
+        mask, scale = self.__get_ink_mask(image)
+        # Box resampling to a width of one pixel averages every row in C, no python loop over pixels.
+        profile: List[float] = [value / 255 for value in mask.resize((1, mask.height), Image.BOX).getdata()]
+        return {'mask': mask, 'scale': scale, 'profile': profile}
+
+    def __find_header_end(self, profile: List[float]) -> Optional[int]:
+        """
+        Finds the end of the header block: the first large white gap in the upper part of the page.
+        :param profile: the share of ink pixels for each row.
+        :return: the row where the gap starts, or None if the page has no header block.
+        """
+        height: int = len(profile)
+        min_gap: int = max(1, round(height * self.HEADER_GAP_RATIO))
+        content_started: bool = False
+        gap_start: Optional[int] = None
+        for row, ink in enumerate(profile):
+            if row > height * self.HEADER_MAX_RATIO:
+                return None
+            if ink >= self.ROW_INK_RATIO:
+                if gap_start is not None and row - gap_start >= min_gap:
+                    return gap_start
+                content_started = True
+                gap_start = None
+            elif content_started and gap_start is None:
+                gap_start = row
+        return None
+
+    def __crop(
+            self,
+            image: Image.Image,
+            layout: Dict[str, any],
+            top_ratio: float = 0,
+            bottom_ratio: float = 1
+    ) -> Image.Image:
+        """
+        Crops the page to its content between the given vertical bounds.
+        :param image: the rendered page.
+        :param layout: the layout of the page, see analyze.
+        :param top_ratio: upper bound, relative to the page height.
+        :param bottom_ratio: lower bound, relative to the page height.
+        :return: the cropped page, or the page itself if it has no content.
+        """
+        mask: Image.Image = layout['mask']
+        scale: float = layout['scale']
+        offset: int = round(top_ratio * mask.height)
+        region: Image.Image = mask.crop((0, offset, mask.width, round(bottom_ratio * mask.height)))
+        box: Optional[Tuple[int, int, int, int]] = region.getbbox()
+        if box is None:
+            return image
+        padding: int = round(image.height * self.PADDING_RATIO)
+        left, top, right, bottom = box
+        return image.crop((
+            max(0, round(left / scale) - padding),
+            max(0, round((top + offset) / scale) - padding),
+            min(image.width, round(right / scale) + padding),
+            min(image.height, round((bottom + offset) / scale) + padding)
+        ))
+
+    def __get_header_ratio(self, layout: Dict[str, any]) -> Optional[float]:
+        """
+        Get the end of the header block relative to the page height.
+        :param layout: the layout of the page, see analyze.
+        :return: the end of the header block, or None if the page has no header block.
+        """
+        profile: List[float] = layout['profile']
+        header_end: Optional[int] = self.__find_header_end(profile)
+        return None if header_end is None else header_end / len(profile)
+
+    def crop_transactions(self, image: Image.Image, layout: Dict[str, any], cover_page: bool = False) -> Image.Image:
+        """
+        Crops the page to the region containing the transactions.
+        :param image: the rendered page.
+        :param layout: the layout of the page, see analyze.
+        :param cover_page: whether the page is the cover page, where the header block is cut off.
+        :return: the cropped page.
+        """
+        header_ratio: Optional[float] = self.__get_header_ratio(layout) if cover_page else None
+        return self.__crop(image, layout, top_ratio=header_ratio or 0)
+
+    def crop_header(self, image: Image.Image, layout: Dict[str, any]) -> Image.Image:
+        """
+        Crops the cover page to the header block containing the account data.
+        :param image: the rendered cover page.
+        :param layout: the layout of the page, see analyze.
+        :return: the cropped page, the whole content if no header block was found.
+        """
+        header_ratio: Optional[float] = self.__get_header_ratio(layout)
+        return self.__crop(image, layout, bottom_ratio=header_ratio or 1)
+
+    def __init__(self, crop_pages: bool = setup.CROP_PAGES):
+        """
+        Default constructor.
+        :param crop_pages: whether the pages are cropped to their content before the upload.
+        """
+        self.crop_pages: bool = crop_pages
+
+
+layout_handler: LayoutHandler = LayoutHandler()
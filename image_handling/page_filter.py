@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+import re
+from typing import Dict, List, Optional
+
+import setup
+
+
+class PageFilter:
+    """
+    Detects pages without transactions before they are sent to the llm, CPU only.
+    Scanned pages are skipped if they are blank, carry only a few lines (e.g. a page number or a stamp)
+    or are mostly covered by a picture, like advertising inserts.
+    Text layer pages are skipped if no line has both a date and an amount, e.g. terms and conditions,
+    unless they carry account data. Dense text on scanned pages is never skipped, the image analysis can not read it.
+    Scanned pages are analysed with the row profile of the layout handler's page layout.
+    """
+    # Pages with a lower share of ink pixels are blank, scan noise included.
+    BLANK_INK_RATIO: float = 0.003
+    # Pages with a higher share of ink pixels are pictures, text pages stay far below.
+    PICTURE_INK_RATIO: float = 0.35
+    # Minimum share of ink pixels for a row to count as part of a text line.
+    LINE_INK_RATIO: float = 0.01
+    # Minimum height of a text line in rows of the downscaled page, thinner runs are rules or noise.
+    LINE_MIN_ROWS: int = 2
+    DATE: re.Pattern = re.compile(r'\b\d{1,2}\.\d{1,2}\.(\d{2,4})?|\b\d{4}-\d{2}-\d{2}\b')
+    # Not followed by a dot or digit, so that dates do not count as amounts.
+    AMOUNT: re.Pattern = re.compile(r'\d[\d.,\']*[.,]\d{2}(?![\d.])')
+    IBAN: re.Pattern = re.compile(r'\b[A-Z]{2}\d{2}(?: ?[A-Z0-9]{4}){3,7}')
+    # Lowercase keywords of pages without transactions, reported as the reason of the skip.
+    TERMS_KEYWORDS: List[str] = [
+        'geschäftsbedingungen', 'allgemeine bedingungen', 'datenschutz', 'terms and conditions', 'privacy'
+    ]
+
+    def __count_lines(self, profile: List[float]) -> int:
+        """
+        Counts the text lines, runs of rows with ink separated by white rows.
+        :param profile: the share of ink pixels for each row.
+        :return: the number of text lines.
+        """
+        lines: int = 0
+        run: int = 0
+        for ink in profile + [0]:
+            if ink >= self.LINE_INK_RATIO:
+                run += 1
+                continue
+            if run >= self.LINE_MIN_ROWS:
+                lines += 1
+            run = 0
+        return lines
+
+    def get_image_skip_reason(self, layout: Dict[str, any]) -> Optional[str]:
+        """
+        Checks whether a scanned page carries no transactions.
+        :param layout: the layout of the rendered page, see LayoutHandler.analyze.
+        :return: the reason to skip the page (blank, picture or sparse), or None if the page must be extracted.
+        """
+        profile: List[float] = layout['profile']
+        ink: float = sum(profile) / len(profile)
+        if ink < self.BLANK_INK_RATIO:
+            return 'blank'
+        if ink > self.PICTURE_INK_RATIO:
+            return 'picture'
+        if self.__count_lines(profile) < self.min_lines:
+            return 'sparse'
+        return None
+
+    def get_text_skip_reason(self, text: str) -> Optional[str]:
+        """
+        Checks whether the text layer of a page carries no transactions.
+        :param text: the text of the page.
+        :return: the reason to skip the page (terms or no_transactions), or None if the page must be extracted.
+        """
+        if self.IBAN.search(text):
+            # Account data, possibly the cover page.
+            return None
+        for line in text.splitlines():
+            if self.DATE.search(line) and self.AMOUNT.search(line):
+                return None
+        lower_text: str = text.lower()
+        return 'terms' if any(keyword in lower_text for keyword in self.TERMS_KEYWORDS) else 'no_transactions'
+
+    def __init__(self, enabled: bool = setup.PAGE_FILTER, min_lines: int = setup.PAGE_FILTER_MIN_LINES):
+        """
+        Default constructor.
+        :param enabled: whether pages without transactions are skipped.
+        :param min_lines: scanned pages with fewer text lines are skipped.
+        """
+        self.enabled: bool = enabled
+        self.min_lines: int = min_lines
+
+
+page_filter: PageFilter = PageFilter()
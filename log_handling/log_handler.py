@@ -1,12 +1,29 @@
 #!/usr/bin/env python3
+import atexit
 import os
+import queue
+import sys
+import threading
+import time
 from enum import Enum
-from typing import TextIO, Optional
-
-from loguru import logger
+from typing import TextIO, Optional, List, Tuple
 
 LOGFILE: str = os.getenv('LOGFILE') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'application.log')
 LOG_LEVEL: str = os.getenv('LOG_LEVEL') or 'DEBUG'
+# The log file is rotated once it exceeds this size, 0 disables the rotation.
+LOG_MAX_BYTES: int = int(os.getenv('LOG_MAX_BYTES') or 10 * 1024 * 1024)
+# Number of rotated log files kept, e.g. application.log.1 to application.log.5.
+LOG_BACKUP_COUNT: int = int(os.getenv('LOG_BACKUP_COUNT') or 5)
+# Write the log messages to stderr as well.
+LOG_CONSOLE: bool = (os.getenv('LOG_CONSOLE') or 'true').lower() in ('1', 'true', 'yes')
+# Set by the process owning the log file for the processes it starts, e.g. the spawned raster processes:
+# its pid and the path of its log file. Only the owner writes and rotates the file.
+_OWNER_PID_VARIABLE: str = 'LOG_OWNER_PID'
+_OWNER_FILE_VARIABLE: str = 'LOG_OWNER_FILE'
+# Maximum number of messages written and flushed at once.
+_BATCH_SIZE: int = 1000
+# Stops the writer thread.
+_STOP = object()
 _instance = None
 
 
@@ -33,6 +50,9 @@ class Module(Enum):
     JSON = 'JSON Parser'
     AZR = 'Azure OpenAI'
     PDF = 'PDF Processor'
+    PIPE = 'Pipeline'
+    WATCH = 'Watcher'
+    QUEUE = 'Job Queue'
 
 
 class LogType(Enum):
@@ -98,19 +118,113 @@ class Logger:
         """
         if not LOGFILE:
             raise Exception('Logfile not specified! Running in console-mode only.')
-        self.__fp: TextIO = open(LOGFILE, 'a+')
+        self.__fp = open(LOGFILE, 'a+')
+        self.__size = self.__fp.tell()
 
-    def __write_log(self, message: str, mtype: LogType) -> None:
+    def __rotate(self) -> None:
         """
-        Write logging message to logfile.
-        :param message: Message to write.
-        :param mtype: The log message type.
+        Rotates the log file: application.log becomes application.log.1, application.log.1 becomes .2 and so on,
+        the oldest file is deleted. Runs in the writer thread.
         """
+        self.__fp.close()
+        for i in range(LOG_BACKUP_COUNT - 1, 0, -1):
+            if os.path.exists(f'{LOGFILE}.{i}'):
+                os.replace(f'{LOGFILE}.{i}', f'{LOGFILE}.{i + 1}')
+        if LOG_BACKUP_COUNT > 0:
+            os.replace(LOGFILE, f'{LOGFILE}.1')
+        else:
+            os.remove(LOGFILE)
+        self.__open_fp()
+
+    @staticmethod
+    def __is_owned_by_parent() -> bool:
+        """
+        Checks whether the log file is owned by the parent process, i.e. this is a process it spawned,
+        which re-imports the modules and would otherwise open and rotate the file on its own.
+        :return: whether the parent process writes the log file.
+        """
+        return os.getenv(_OWNER_PID_VARIABLE) == str(os.getppid()) \
+            and os.getenv(_OWNER_FILE_VARIABLE) == os.path.abspath(LOGFILE)
+
+    def __write_batch(self, lines: List[str]) -> None:
+        """
+        Writes a batch of log lines with a single write and flush per output. Runs in the writer thread.
+        :param lines: the formatted log lines.
+        """
+        text: str = ''.join(lines)
+        if LOG_CONSOLE:
+            sys.stderr.write(text)
+            sys.stderr.flush()
         if self.__fp is None:
             return
-        message = ' '.join([mtype.value, message])
-        self.__fp.write(f'{message}\n')
+        size: int = len(text.encode('utf-8'))
+        # Forked child processes inherit the open file and append to it, only the process that opened it rotates it.
+        if LOG_MAX_BYTES and self.__size and self.__size + size > LOG_MAX_BYTES and os.getpid() == self.__pid:
+            self.__rotate()
+        self.__fp.write(text)
         self.__fp.flush()
+        self.__size += size
+
+    def __write_loop(self) -> None:
+        """
+        Loop of the writer thread, drains the queued messages in batches.
+        """
+        while True:
+            records: List = [self.__queue.get()]
+            while len(records) < _BATCH_SIZE:
+                try:
+                    records.append(self.__queue.get_nowait())
+                except queue.Empty:
+                    break
+            stopped: bool = _STOP in records
+            lines: List[str] = [self.__format(*record) for record in records if record is not _STOP]
+            try:
+                self.__write_batch(lines)
+            except Exception as e:
+                sys.stderr.write(f'Error writing the log: {e}\n')
+            if stopped:
+                return
+
+    @staticmethod
+    def __format(timestamp: float, mtype: 'LogType', message: str) -> str:
+        """
+        Formats a log line.
+        :param timestamp: the time of the message.
+        :param mtype: the log message type.
+        :param message: the message.
+        :return: the log line.
+        """
+        milliseconds: int = int(timestamp * 1000) % 1000
+        return f'{time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp))}.{milliseconds:03d} ' \
+               f'{mtype.value} {message}\n'
+
+    def __log(self, mtype: 'LogType', message: str, args: Tuple, module: Optional[Module]) -> None:
+        """
+        Queues a message for the writer thread. The caller has checked the log level,
+        the arguments are only converted to strings here.
+        :param mtype: the log message type.
+        :param message: the message.
+        :param args: further values appended to the message.
+        :param module: the module that logged the message.
+        """
+        message = str(message) + ' ' + self.__handle_args(*args) if args else str(message)
+        self.__queue.put((time.time(), mtype, self.__build_message(message=message, module=module)))
+
+    def __start_writer(self) -> None:
+        """
+        Starts the writer thread. Also called in forked child processes, which do not inherit the thread.
+        """
+        self.__queue: queue.SimpleQueue = queue.SimpleQueue()
+        self.__writer: threading.Thread = threading.Thread(target=self.__write_loop, name='log-writer', daemon=True)
+        self.__writer.start()
+
+    def close(self) -> None:
+        """
+        Writes the queued messages and stops the writer thread.
+        """
+        if self.__writer.is_alive():
+            self.__queue.put(_STOP)
+            self.__writer.join(timeout=10)
 
     @staticmethod
     def __build_message(message: str, module: Module) -> str:
@@ -128,62 +242,65 @@ class Logger:
         """
         Log an error message.
         :param message: The message to log.
+        :param args: Further values appended to the message, only converted to strings if the message is logged.
         :param module: The module that logged the error.
         :return:
         """
-        message = str(message) + ' ' + self.__handle_args(*args)
-        msg = self.__build_message(message=message, module=module)
-        logger.error(msg)
-        self.__write_log(message=msg, mtype=LogType.ERROR)
+        self.__log(LogType.ERROR, message, args, module)
 
     def info(self, message: str, *args, module: Module = None) -> None:
         """
         Log an info message.
         :param message: The message to log.
+        :param args: Further values appended to the message, only converted to strings if the message is logged.
         :param module: The module that logged the info message.
         :return:
         """
         if self.__log_level < 0:
             return
-        message = str(message) + ' ' + self.__handle_args(*args)
-        msg = self.__build_message(message=message, module=module)
-        logger.info(msg)
-        self.__write_log(message=msg, mtype=LogType.INFO)
+        self.__log(LogType.INFO, message, args, module)
 
     def warning(self, message: str, *args, module: Module = None) -> None:
         """
         Log a warning message.
         :param message: The message to log.
+        :param args: Further values appended to the message, only converted to strings if the message is logged.
         :param module: The module that logged the message.
         :return:
         """
         if self.__log_level < 1:
             return
-        message = str(message) + ' ' + self.__handle_args(*args)
-        msg = self.__build_message(message=message, module=module)
-        logger.warning(msg)
-        self.__write_log(message=msg, mtype=LogType.WARN)
+        self.__log(LogType.WARN, message, args, module)
 
     def debug(self, message: str, *args, module: Module = None) -> None:
         """
         Log a debug message.
         :param message: The message to log.
+        :param args: Further values appended to the message, only converted to strings if the message is logged.
         :param module: The module that logged the message.
         :return:
         """
         if self.__log_level < 2:
             return
-        message = str(message) + ' ' + self.__handle_args(*args)
-        msg = self.__build_message(message=message, module=module)
-        logger.debug(msg)
-        self.__write_log(message=msg, mtype=LogType.DEBUG)
+        self.__log(LogType.DEBUG, message, args, module)
 
     def __init__(self):
         self.__fp: Optional[TextIO] = None
-        logger.info(self.__build_message(message='Initialising logger...', module=Module.LOGGER))
+        self.__size: int = 0
+        self.__pid: int = os.getpid()
         self.__log_level = self.__get_log_level()
+        # All messages go through one queue to one writer thread, which writes the console and the log file.
+        self.__start_writer()
+        os.register_at_fork(after_in_child=self.__start_writer)
+        atexit.register(self.close)
+        if LOGFILE and self.__is_owned_by_parent():
+            # Spawned by the owner of the log file, the messages only go to the console shared with the owner.
+            return
+        self.info('Initialising logger...', module=Module.LOGGER)
         try:
             self.__open_fp()
+            os.environ[_OWNER_PID_VARIABLE] = str(self.__pid)
+            os.environ[_OWNER_FILE_VARIABLE] = os.path.abspath(LOGFILE)
             self.info(message='Logger initialized.', module=Module.LOGGER)
         except Exception as e:
             self.error(message=f'Error occurred! Logger running without caching. Trace: {e}', module=Module.LOGGER)
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from http.server import ThreadingHTTPServer
+
+# Upper bounds of the histogram buckets in seconds, from encoding a page to a slow llm request.
+DEFAULT_BUCKETS: Tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+_instance = None
+
+
+def get_instance():
+    """
+    Metrics singleton.
+    :return the Metrics singleton instance.
+    """
+    global _instance
+    if _instance is None:
+        _instance = Metrics()
+    return _instance
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    """
+    Formats the labels of a sample in the prometheus text format.
+    :param labels: the label names and values.
+    :return: the labels in braces, empty if there are none.
+    """
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}={json.dumps(str(value))}' for name, value in labels) + '}'
+
+
+class Metrics:
+    """
+    In-process registry of counters, gauges and histograms, each with optional labels.
+    The metrics can be scraped as prometheus text over http, or written to a json snapshot file periodically.
+    """
+
+    def __init__(self):
+        self.lock: threading.Lock = threading.Lock()
+        self.counters: Dict[str, Dict[Tuple, float]] = {}
+        self.gauges: Dict[str, Dict[Tuple, float]] = {}
+        # Per label set: the count of each bucket, the sum and the count of the observations.
+        self.histograms: Dict[str, Dict[Tuple, List]] = {}
+        self.buckets: Dict[str, Tuple[float, ...]] = {}
+        self.server: Optional['ThreadingHTTPServer'] = None
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        """
+        Increments a counter.
+        :param name: the name of the counter, by convention ending with _total.
+        :param value: the increment.
+        :param labels: the labels of the sample.
+        :return:
+        """
+        key: Tuple = tuple(sorted(labels.items()))
+        with self.lock:
+            samples: Dict[Tuple, float] = self.counters.setdefault(name, {})
+            samples[key] = samples.get(key, 0) + value
+
+    def add(self, name: str, value: float, **labels) -> None:
+        """
+        Adds to a gauge, e.g. +1 when a request starts and -1 when it ends.
+        :param name: the name of the gauge.
+        :param value: the amount to add, may be negative.
+        :param labels: the labels of the sample.
+        :return:
+        """
+        key: Tuple = tuple(sorted(labels.items()))
+        with self.lock:
+            samples: Dict[Tuple, float] = self.gauges.setdefault(name, {})
+            samples[key] = samples.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels) -> None:
+        """
+        Sets a gauge.
+        :param name: the name of the gauge.
+        :param value: the value.
+        :param labels: the labels of the sample.
+        :return:
+        """
+        key: Tuple = tuple(sorted(labels.items()))
+        with self.lock:
+            self.gauges.setdefault(name, {})[key] = value
+
+    def observe(self, name: str, value: float, buckets: Tuple[float, ...] = DEFAULT_BUCKETS, **labels) -> None:
+        """
+        Records an observation in a histogram.
+        :param name: the name of the histogram, by convention ending with the unit, e.g. _seconds.
+        :param value: the observed value.
+        :param buckets: the upper bounds of the buckets, fixed by the first observation of the histogram.
+        :param labels: the labels of the sample.
+        :return:
+        """
+        key: Tuple = tuple(sorted(labels.items()))
+        with self.lock:
+            bounds: Tuple[float, ...] = self.buckets.setdefault(name, buckets)
+            sample: List = self.histograms.setdefault(name, {}).setdefault(key, [[0] * len(bounds), 0.0, 0])
+            index: int = bisect.bisect_left(bounds, value)
+            if index < len(bounds):
+                sample[0][index] += 1
+            sample[1] += value
+            sample[2] += 1
+
+    @contextmanager
+    def time(self, name: str, in_flight: Optional[str] = None, **labels) -> Iterator[None]:
+        """
+        Times a block into a histogram, failed blocks are counted in <name>_errors_total.
+        :param name: the name of the histogram, ending with _seconds.
+        :param in_flight: the name of a gauge counting the running blocks, if any.
+        :param labels: the labels of the samples.
+        :return:
+        """
+        if in_flight:
+            self.add(in_flight, 1, **labels)
+        start: float = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.inc(f'{name.removesuffix("_seconds")}_errors_total', **labels)
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+            if in_flight:
+                self.add(in_flight, -1, **labels)
+
+    def drain(self) -> Dict[str, Dict]:
+        """
+        Removes the counters and histograms recorded so far, to merge them into the registry of another process.
+        Gauges describe the state of this process and are kept.
+        :return: the counters, the histograms and the histograms' buckets.
+        """
+        with self.lock:
+            samples: Dict[str, Dict] = {
+                'counters': self.counters,
+                'histograms': self.histograms,
+                'buckets': dict(self.buckets)
+            }
+            self.counters = {}
+            self.histograms = {}
+        return samples
+
+    def merge(self, samples: Dict[str, Dict]) -> None:
+        """
+        Adds the counters and histograms drained from the registry of another process, e.g. a worker process.
+        :param samples: the drained samples.
+        :return:
+        """
+        with self.lock:
+            for name, counter in samples['counters'].items():
+                target: Dict[Tuple, float] = self.counters.setdefault(name, {})
+                for key, value in counter.items():
+                    target[key] = target.get(key, 0) + value
+            for name, histogram in samples['histograms'].items():
+                bounds: Tuple[float, ...] = self.buckets.setdefault(name, samples['buckets'][name])
+                target: Dict[Tuple, List] = self.histograms.setdefault(name, {})
+                for key, (counts, total, count) in histogram.items():
+                    sample: List = target.setdefault(key, [[0] * len(bounds), 0.0, 0])
+                    for index, bucket_count in enumerate(counts[:len(bounds)]):
+                        sample[0][index] += bucket_count
+                    sample[1] += total
+                    sample[2] += count
+
+    def render_prometheus(self) -> str:
+        """
+        Renders all metrics in the prometheus text exposition format.
+        :return: the metrics.
+        """
+        lines: List[str] = []
+        with self.lock:
+            for kind, metrics in (('counter', self.counters), ('gauge', self.gauges)):
+                for name in sorted(metrics):
+                    lines.append(f'# TYPE {name} {kind}')
+                    for key, value in sorted(metrics[name].items()):
+                        lines.append(f'{name}{_format_labels(key)} {value:g}')
+            for name in sorted(self.histograms):
+                lines.append(f'# TYPE {name} histogram')
+                bounds: Tuple[float, ...] = self.buckets[name]
+                for key, (counts, total, count) in sorted(self.histograms[name].items()):
+                    cumulative: int = 0
+                    for bound, bucket_count in zip(bounds, counts):
+                        cumulative += bucket_count
+                        lines.append(f'{name}_bucket{_format_labels(key + (("le", f"{bound:g}"),))} {cumulative}')
+                    lines.append(f'{name}_bucket{_format_labels(key + (("le", "+Inf"),))} {count}')
+                    lines.append(f'{name}_sum{_format_labels(key)} {total:g}')
+                    lines.append(f'{name}_count{_format_labels(key)} {count}')
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self) -> Dict[str, any]:
+        """
+        Get all metrics as a json serializable dictionary.
+        :return: the counters, gauges and histograms, each sample with its labels.
+        """
+        with self.lock:
+            return {
+                'timestamp': time.time(),
+                'counters': {
+                    name: [{'labels': dict(key), 'value': value} for key, value in samples.items()]
+                    for name, samples in self.counters.items()
+                },
+                'gauges': {
+                    name: [{'labels': dict(key), 'value': value} for key, value in samples.items()]
+                    for name, samples in self.gauges.items()
+                },
+                'histograms': {
+                    name: [
+                        {
+                            'labels': dict(key),
+                            'buckets': dict(zip([f'{bound:g}' for bound in self.buckets[name]], counts)),
+                            'sum': total,
+                            'count': count
+                        } for key, (counts, total, count) in samples.items()
+                    ]
+                    for name, samples in self.histograms.items()
+                }
+            }
+
+    def write_snapshot(self, path: str) -> None:
+        """
+        Writes the json snapshot atomically, readers never see a partial file.
+        :param path: path of the snapshot file.
+        :return:
+        """
+        tmp_path: str = f'{path}.tmp'
+        with open(tmp_path, 'w') as snapshot_file:
+            json.dump(self.snapshot(), snapshot_file, indent=2)
+        os.replace(tmp_path, path)
+
+    def start_snapshots(self, path: str, interval: float, stop_event: Optional[threading.Event] = None) -> None:
+        """
+        Writes the json snapshot periodically in a background thread.
+        :param path: path of the snapshot file.
+        :param interval: seconds between two snapshots.
+        :param stop_event: ends the snapshots once set, after a final snapshot.
+        :return:
+        """
+        stop_event = stop_event or threading.Event()
+
+        def _write_snapshots() -> None:
+            while not stop_event.wait(interval):
+                self.write_snapshot(path)
+            self.write_snapshot(path)
+
+        threading.Thread(target=_write_snapshots, name='metrics-snapshot', daemon=True).start()
+
+    def start_http_server(self, port: int, host: str = '0.0.0.0') -> None:
+        """
+        Serves the metrics in the prometheus text format on /metrics in a background thread.
+        :param port: the port to listen on.
+        :param host: the host to listen on.
+        :return:
+        """
+        # Imported on first use, the endpoint is disabled by default.
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        metrics: Metrics = self
+
+        class _MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                data: bytes = metrics.render_prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format: str, *args) -> None:
+                return
+
+        self.server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name='metrics-http', daemon=True).start()
@@ -1,26 +1,85 @@
-import glob
+import functools
+import hashlib
+import itertools
 import json
+import multiprocessing
 import os.path
 import shutil
 import subprocess
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future, ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import Dict, List, Iterable, Iterator, Optional, Set, Tuple, Callable, Deque, Generator, TYPE_CHECKING
 
-import persistence.db_handler
-from csv import excel_tab
-from typing import Dict, List
-
-import pdf2image
 from PIL.Image import Image
 
 import ai.prompts
 import setup
-from ai import azure_openai_connector
-from ai.azure_openai_connector import AzureOpenAIAdapter
+from image_handling.image_handler import image_handler
+from image_handling.layout_handler import layout_handler
+from image_handling.page_filter import page_filter
 from log_handling import log_handler
 from log_handling.log_handler import Logger, Module
+from metrics_handling import metrics_handler
+from metrics_handling.metrics_handler import Metrics
+from persistence import db_handler
+from persistence.db_handler import Database
+from pipeline import Pipeline
+
+if TYPE_CHECKING:
+    from ai.azure_openai_connector import AzureOpenAIAdapter
 
 logger: Logger = log_handler.get_instance()
-azure_openai_adapter: AzureOpenAIAdapter = azure_openai_connector.azure_open_ai_adapter
-database: persistence.db_handler.Database = persistence.db_handler.database
+metrics: Metrics = metrics_handler.get_instance()
+# Content hashes of the pdf files currently in the pipeline.
+_in_flight_hashes: Set[str] = set()
+# Jobs of pdf files with the same content as a pdf in the pipeline, by that content hash.
+# They are settled once that pdf has left the pipeline, see _settle_waiting_job.
+_waiting_jobs: Dict[str, List[Dict[str, any]]] = {}
+_in_flight_lock: threading.Lock = threading.Lock()
+# Processes rendering the pdf pages, created on first use and shared by all documents.
+_raster_pool: Optional[ProcessPoolExecutor] = None
+_raster_pool_lock: threading.Lock = threading.Lock()
+# Characters expected in the text layer of a bank statement besides letters and digits.
+_STATEMENT_PUNCTUATION: str = '.,:;-+/*%()€$&\'"'
+# Minimum share of letters, digits and expected punctuation for a readable text layer.
+_TEXT_LAYER_MIN_READABLE: float = 0.9
+
+
+def _hash_file(filepath: str) -> str:
+    """
+    Computes the content hash of a pdf file.
+    :param filepath: path to the pdf file.
+    :return: the sha256 hex digest of the file.
+    """
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _get_workdir(filepath: str) -> str:
+    """
+    Get the working directory of the given pdf file.
+    :param filepath: path to the pdf file.
+    :return: the path of the working directory.
+    """
+    return os.path.join(setup.IMAGE_DIR, os.path.basename(filepath).lower().replace('.pdf', ''))
+
+
+def remove_stale_workdir(filepath: str) -> None:
+    """
+    Removes the working directory a crashed run or worker left behind for the given pdf file.
+    Only safe while no other job processes the file.
+    :param filepath: path to the pdf file.
+    :return:
+    """
+    work_dir: str = _get_workdir(filepath=filepath)
+    if os.path.exists(work_dir):
+        logger.info(f'Removing the stale directory "{work_dir}".', module=Module.PDF)
+        shutil.rmtree(work_dir)
 
 
 def _create_workdir(filepath: str) -> str:
@@ -30,86 +89,653 @@ def _create_workdir(filepath: str) -> str:
     :return: The current working directory.
     :raise Exception: if the working directory already exists.
     """
-    sub_dir: str = os.path.basename(filepath).lower().replace('.pdf', '')
-    work_dir: str = os.path.join(setup.IMAGE_DIR, sub_dir)
+    work_dir: str = _get_workdir(filepath=filepath)
     if os.path.exists(work_dir):
         raise Exception(f'Directory "{work_dir}" already exists - pdf was already processed.')
     os.makedirs(work_dir)
     return work_dir
 
 
-def _save_images(images: List[Image], workdir: str) -> List[str]:
+def _encode_page(image: Image, page_number: int, workdir: str, suffix: str = '') -> Dict[str, any]:
+    """
+    Prepares the image of a page for the upload and saves it to the working directory.
+    In memory mode, the encoded image is kept in the page instead.
+    :param image: the image of the page.
+    :param page_number: the page number, starting at 0.
+    :param workdir: the working directory.
+    :param suffix: suffix for the image file name.
+    :return: the page with the path to its image or the encoded image itself.
+    """
+    with metrics.time('pdf_step_seconds', step='encode'):
+        image_data, image_type = image_handler.prepare_and_encode(image)
+    if setup.RASTERIZE_IN_MEMORY:
+        return {'page_number': page_number, 'page_path': None, 'image_data': image_data, 'image_type': image_type}
+    output_path: str = os.path.join(workdir, f'page_{page_number}{suffix}.{image_type}')
+    with open(output_path, 'wb') as f:
+        f.write(image_data)
+    return {'page_number': page_number, 'page_path': output_path}
+
+
+def _extract_text_layer(filepath: str) -> List[str]:
+    """
+    Extracts the text layer of each page with pdftotext, which is part of poppler like pdftoppm.
+    :param filepath: path to the pdf file.
+    :return: the text of each page with the layout preserved, empty if the text layer could not be read.
+    """
+    try:
+        result: subprocess.CompletedProcess = subprocess.run(
+            ['pdftotext', '-layout', '-enc', 'UTF-8', filepath, '-'],
+            capture_output=True,
+            check=True,
+            timeout=120
+        )
+    except (OSError, subprocess.SubprocessError) as e:
+        logger.warning(f'Could not read the text layer of "{filepath}". Trace:', e, module=Module.PDF)
+        return []
+    # pdftotext terminates every page with a form feed.
+    texts: List[str] = result.stdout.decode('utf-8', errors='replace').split('\f')
+    return texts[:-1] if texts and not texts[-1].strip() else texts
+
+
+def _is_usable_text(text: str) -> bool:
     """
-    Saves the image extracted from pdf2image to the working directory.
-    :param images: the images to save.
+    Checks whether the text layer of a page is complete and readable, i.e. the page is not a scan.
+    Broken font encodings produce replacement characters and symbols instead of letters and digits.
+    :param text: the text of the page.
+    :return: whether the text can be used instead of the page image.
+    """
+    characters: List[str] = [c for c in text if not c.isspace()]
+    if len(characters) < setup.TEXT_LAYER_MIN_CHARS:
+        return False
+    readable: int = sum(1 for c in characters if c.isalnum() or c in _STATEMENT_PUNCTUATION)
+    return readable / len(characters) >= _TEXT_LAYER_MIN_READABLE
+
+
+def _prepare_page(image: Image, page_number: int, workdir: str, text: Optional[str] = None) -> Dict[str, any]:
+    """
+    Prepares the page for the llm requests. Pages with a usable text layer are sent as text.
+    If the page filter is enabled, pages without transactions are marked as skipped and not encoded.
+    If cropping is enabled, the page is cropped to the transactions
+    and the cover page additionally gets a header crop for the account info request.
+    :param image: the image extracted from pdf2image.
+    :param page_number: the page number, starting at 0.
     :param workdir: the working directory.
-    :return: a list of image paths for the saved images.
+    :param text: the usable text layer of the page, if any.
+    :return: the prepared page.
     """
-    for i, img in enumerate(images):
-        base_name: str = f'page_{i}.png'
-        output_path: str = os.path.join(workdir, base_name)
-        img.save(output_path, format='PNG')
-    return glob.glob(os.path.join(workdir, '*.png'))
+    metrics.inc('pages_total', source='image' if text is None else 'text')
+    layout: Optional[Dict[str, any]] = None
+    if text is None and (page_filter.enabled or layout_handler.crop_pages):
+        # The ink of the page is analysed once, for the filter and the crops.
+        with metrics.time('pdf_step_seconds', step='layout'):
+            layout = layout_handler.analyze(image)
+    if page_filter.enabled:
+        with metrics.time('pdf_step_seconds', step='filter'):
+            skip_reason: Optional[str] = page_filter.get_image_skip_reason(layout) if text is None \
+                else page_filter.get_text_skip_reason(text)
+        if skip_reason is not None:
+            metrics.inc('pages_skipped_total', reason=skip_reason)
+            return {'page_number': page_number, 'page_path': None, 'skip_reason': skip_reason}
+    if text is not None:
+        return {'page_number': page_number, 'page_path': None, 'text': text}
+    if not layout_handler.crop_pages:
+        return _encode_page(image, page_number=page_number, workdir=workdir)
+    cover_page: bool = page_number == 0
+    with metrics.time('pdf_step_seconds', step='crop'):
+        transactions_image: Image = layout_handler.crop_transactions(image, layout, cover_page=cover_page)
+    page: Dict[str, any] = _encode_page(transactions_image, page_number=page_number, workdir=workdir)
+    if cover_page:
+        with metrics.time('pdf_step_seconds', step='crop'):
+            header_image: Image = layout_handler.crop_header(image, layout)
+        page['header'] = _encode_page(header_image, page_number=page_number, workdir=workdir, suffix='_header')
+    return page
 
 
-def _split_pages(filepath: str, workdir: str) -> List[str]:
+def _render_chunk(
+        filepath: str,
+        first_page: int,
+        page_count: int,
+        workdir: str
+) -> Tuple[List[Dict[str, any]], Dict[str, Dict]]:
     """
-    Splits the given pdf file into separate pages and a PNG image for each.
+    Renders and prepares a range of pages. Runs in a raster process, only the prepared pages are sent back,
+    so at most one chunk of page bitmaps is held in memory per process.
     :param filepath: path to the pdf file.
-    :param workdir: path to the working directory where the PNG images will be created.
-    :return: A list of paths to the PNG images.
+    :param first_page: the number of the first page of the range, starting at 0.
+    :param page_count: the number of pages of the range.
+    :param workdir: path to the working directory where the images will be created.
+    :return: the prepared pages and the metrics recorded in this process while preparing them.
+    """
+    # Imported on first use, exports and other commands never render pdfs.
+    import pdf2image
+    # Without output folder, pdf2image reads the rendered pages from the pdftoppm output stream.
+    output_folder: Optional[str] = None if setup.RASTERIZE_IN_MEMORY else workdir
+    with metrics.time('pdf_step_seconds', step='render'):
+        images: List[Image] = pdf2image.convert_from_path(
+            filepath,
+            dpi=image_handler.dpi,
+            output_folder=output_folder,
+            first_page=first_page + 1,
+            last_page=first_page + page_count
+        )
+    pages: List[Dict[str, any]] = []
+    for i, image in enumerate(images):
+        pages.append(_prepare_page(image, page_number=first_page + i, workdir=workdir))
+        image.close()
+    return pages, metrics.drain()
+
+
+def _get_chunks(texts: List[Optional[str]], chunk_size: int) -> Iterator[Tuple[int, int, bool]]:
+    """
+    Splits the pages into runs of consecutive text layer pages and runs of consecutive pages to render,
+    the latter in chunks of at most chunk_size pages, so that no text layer page is rendered.
+    :param texts: the usable text layer of each page, None for the pages to render.
+    :param chunk_size: the maximum number of pages rendered at once.
+    :return: an iterator over the first page, the page count and whether the pages are rendered, in page order.
+    """
+    for render, run in itertools.groupby(range(len(texts)), key=lambda page_number: texts[page_number] is None):
+        page_numbers: List[int] = list(run)
+        step: int = chunk_size if render else len(page_numbers)
+        for start in range(0, len(page_numbers), step):
+            yield page_numbers[start], min(step, len(page_numbers) - start), render
+
+
+def _get_raster_pool() -> ProcessPoolExecutor:
+    """
+    Get the raster processes, sized to the available cores by default.
+    The processes are spawned instead of forked, the pipeline threads may hold locks at the time of the fork.
+    They re-import the modules, their logger leaves the log file to this process (see log_handler).
+    :return: the process pool.
+    """
+    global _raster_pool
+    with _raster_pool_lock:
+        if _raster_pool is None:
+            _raster_pool = ProcessPoolExecutor(
+                max_workers=max(1, setup.RASTER_PROCESSES),
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return _raster_pool
+
+
+def _shutdown_raster_pool() -> None:
+    """
+    Stops the raster processes, if they were started.
+    :return:
+    """
+    global _raster_pool
+    with _raster_pool_lock:
+        if _raster_pool is not None:
+            _raster_pool.shutdown(wait=True, cancel_futures=True)
+            _raster_pool = None
+
+
+def _split_pages(filepath: str, workdir: str) -> Generator[Dict[str, any], None, None]:
+    """
+    Splits the given pdf file into separate pages and a prepared image for each.
+    Pages with a usable text layer keep their text instead of an image.
+    In memory mode, the pages are rendered and encoded without touching the disk.
+    The pages without a usable text layer are rendered in chunks by the raster processes and yielded in order
+    as soon as their chunk is done, while the following chunks are still rendering.
+    Only a few chunks per document are rendered ahead.
+    :param filepath: path to the pdf file.
+    :param workdir: path to the working directory where the images will be created.
+    :return: An iterator over the pages, each with its text, the path to its image or the encoded image itself.
+    """
+    texts: List[Optional[str]] = []
+    if setup.TEXT_LAYER:
+        with metrics.time('pdf_step_seconds', step='text_layer'):
+            texts = [text if _is_usable_text(text) else None for text in _extract_text_layer(filepath)]
+        logger.debug('Pages with a usable text layer in', filepath, ':',
+                     sum(text is not None for text in texts), 'of', len(texts), module=Module.PDF)
+    if texts and all(text is not None for text in texts):
+        # Digitally generated pdf, nothing to render.
+        for i, text in enumerate(texts):
+            yield _prepare_page(None, page_number=i, workdir=workdir, text=text)
+        return
+    import pdf2image
+    page_count: int = pdf2image.pdfinfo_from_path(filepath)['Pages']
+    texts = (texts + [None] * page_count)[:page_count]
+    chunk_size: int = max(1, setup.RASTER_CHUNK_SIZE)
+    ahead: int = max(1, setup.RASTER_PROCESSES)
+    logger.debug('Rendering', sum(text is None for text in texts), 'of', page_count, 'pages of', filepath,
+                 'in chunks of', chunk_size, module=Module.PDF)
+    pool: ProcessPoolExecutor = _get_raster_pool()
+    chunks: Iterator[Tuple[int, int, bool]] = _get_chunks(texts, chunk_size)
+    # The runs of text layer pages have no future, they are prepared in this thread once it is their turn.
+    pending: Deque[Tuple[int, int, Optional[Future]]] = deque()
+    try:
+        while True:
+            for first_page, count, render in chunks:
+                future: Optional[Future] = pool.submit(
+                    _render_chunk, filepath, first_page, count, workdir
+                ) if render else None
+                pending.append((first_page, count, future))
+                if sum(future is not None for _, _, future in pending) >= ahead:
+                    break
+            if not pending:
+                return
+            first_page, count, future = pending.popleft()
+            if future is None:
+                for page_number in range(first_page, first_page + count):
+                    yield _prepare_page(None, page_number=page_number, workdir=workdir, text=texts[page_number])
+                continue
+            pages, samples = future.result()
+            metrics.merge(samples)
+            yield from pages
+    finally:
+        # The document failed or was abandoned, drop the chunks not rendered yet.
+        for _, _, future in pending:
+            if future is not None:
+                future.cancel()
+
+
+def _get_page_name(page: Dict[str, any]) -> str:
+    """
+    Get a readable name of the page for logging.
+    :param page: the pdf page.
+    :return: the page's image path or its page number.
+    """
+    return page['page_path'] or f'page {page["page_number"]}'
+
+
+def _get_adapter() -> 'AzureOpenAIAdapter':
+    """
+    Get the Azure OpenAI adapter, langchain and the openai client are only imported once it is needed.
+    :return: the adapter singleton.
+    """
+    from ai import azure_openai_connector
+    return azure_openai_connector.get_instance()
+
+
+def _ask_openai(
+        prompt: str,
+        page: Dict[str, any],
+        response_schema: Dict[str, any],
+        on_item: Optional[Callable[[Dict[str, any]], None]] = None
+) -> str:
+    """
+    Sends the prompt together with the image of the page to the llm.
+    Text pages are sent without image, their text is part of the prompt.
+    :param prompt: the prompt.
+    :param page: the pdf page.
+    :param response_schema: the json schema of the response.
+    :param on_item: called with each transaction of the response as soon as it is parsed, if any.
+    :return: the llm's response.
+    """
+    azure_openai_adapter: AzureOpenAIAdapter = _get_adapter()
+    if page.get('text') is not None:
+        return azure_openai_adapter.ask_openai(prompt, response_schema=response_schema, on_item=on_item)
+    if page.get('image_data') is not None:
+        return azure_openai_adapter.ask_openai(
+            prompt, image_data=page['image_data'], image_type=page['image_type'], response_schema=response_schema,
+            on_item=on_item
+        )
+    return azure_openai_adapter.ask_openai(
+        prompt, image_uri=page['page_path'], response_schema=response_schema, on_item=on_item
+    )
+
+
+def _get_image(page: Dict[str, any]) -> Tuple[bytes, str]:
+    """
+    Get the encoded image of a page, kept in memory or read from its image file.
+    :param page: the pdf page.
+    :return: the image data and the image type.
     """
-    images: List[Image] = pdf2image.convert_from_path(filepath, output_folder=workdir)
-    logger.debug('Split PDF {} into {} images.'.format(filepath, len(images)), module=Module.PDF)
-    return _save_images(images, workdir)
+    if page.get('image_data') is not None:
+        return page['image_data'], page['image_type']
+    with open(page['page_path'], 'rb') as image_file:
+        return image_file.read(), os.path.splitext(page['page_path'])[1].lstrip('.')
 
 
-def _ocr_transactions(pdf_page_path: str) -> str:
+def _ocr_transactions(page: Dict[str, any], on_item: Optional[Callable[[Dict[str, any]], None]] = None) -> str:
     """
     Performs OCR on a given pdf page.
-    :param pdf_page_path: path to the the image of the page extracted from the PDF.
+    :param page: the page extracted from the PDF.
+    :param on_item: called with each transaction as soon as it is parsed, if any.
     :return: the content on the given page.
     """
     transactions_prompt: str = ai.prompts.get_transactions_prompt()
-    logger.debug('Performing transactions request with page path', pdf_page_path, module=Module.PDF)
-    gpt_response: str = azure_openai_adapter.ask_openai(transactions_prompt, image_uri=pdf_page_path)
+    if page.get('text') is not None:
+        transactions_prompt = ai.prompts.get_transactions_text_prompt(page_text=page['text'])
+    logger.debug('Performing transactions request for', _get_page_name(page), module=Module.PDF)
+    gpt_response: str = _ask_openai(transactions_prompt, page=page,
+                                    response_schema=ai.prompts.get_transactions_schema(), on_item=on_item)
     logger.debug('Received response:', gpt_response, module=Module.PDF)
     return gpt_response
 
 
-def _ocr_account_info(cover_page_path: str) -> str:
+def _ocr_account_info(cover_page: Dict[str, any]) -> str:
     """
     Extracts the customer's account info from the cover page of the transactions report.
-    :param cover_page_path: path to the cover page of the transactions report.
+    :param cover_page: the cover page of the transactions report.
     :return: the customer's account info.
     """
     account_info_prompt: str = ai.prompts.get_basic_account_info_prompt()
-    logger.debug('Performing account info request with page path', cover_page_path, module=Module.PDF)
-    gpt_response: str = azure_openai_adapter.ask_openai(account_info_prompt, image_uri=cover_page_path)
+    if cover_page.get('text') is not None:
+        account_info_prompt = ai.prompts.get_basic_account_info_text_prompt(page_text=cover_page['text'])
+    # Only the header block of the cover page, if the pages are cropped.
+    header: Dict[str, any] = cover_page.get('header', cover_page)
+    logger.debug('Performing account info request for', _get_page_name(header), module=Module.PDF)
+    gpt_response: str = _ask_openai(account_info_prompt, page=header,
+                                    response_schema=ai.prompts.get_basic_account_info_schema())
     logger.debug('Received response:', gpt_response, module=Module.PDF)
     return gpt_response
 
 
-def _create_pdf_metadata(filepath: str, images: List[str]) -> Dict[str, any]:
+def _ocr_pack(
+        pages: List[Dict[str, any]],
+        account_information: bool,
+        on_item: Optional[Callable[[Dict[str, any]], None]] = None
+) -> str:
+    """
+    Performs OCR on several pages with a single request.
+    Image pages are attached in page order, text pages are part of the prompt.
+    :param pages: the pages, in order.
+    :param account_information: whether the first page is the cover page and its account info is requested too.
+    :param on_item: called with each transaction, tagged with its page index, as soon as it is parsed, if any.
+    :return: the transactions of all pages tagged with their page index, and the account info if requested.
+    """
+    images: List[Tuple[bytes, str]] = []
+    image_names: List[str] = []
+    page_texts: Dict[int, str] = {}
+    for page_index, page in enumerate(pages):
+        if page.get('text') is not None:
+            page_texts[page_index] = page['text']
+            continue
+        images.append(_get_image(page))
+        image_names.append(f'page_index {page_index}')
+    if account_information and 'header' in pages[0]:
+        # Cropped cover page, the account info is in the header block.
+        images.append(_get_image(pages[0]['header']))
+        image_names.append('the header of page_index 0')
+    prompt: str = ai.prompts.get_packed_prompt(
+        page_count=len(pages),
+        images=image_names,
+        page_texts=page_texts,
+        account_data=account_information
+    )
+    logger.debug('Performing packed request for', ', '.join(_get_page_name(page) for page in pages), module=Module.PDF)
+    gpt_response: str = _get_adapter().ask_openai(
+        prompt,
+        images=images,
+        response_schema=ai.prompts.get_packed_schema(account_data=account_information),
+        on_item=on_item
+    )
+    logger.debug('Received response:', gpt_response, module=Module.PDF)
+    return gpt_response
+
+
+def _untag_transaction(transaction: Dict[str, any], page_count: int) -> Tuple[Optional[int], Dict[str, any]]:
+    """
+    Removes the page index from a transaction of a packed request.
+    :param transaction: the transaction, tagged with the index of its page in the request.
+    :param page_count: the number of pages of the request.
+    :return: the page index, None if it is missing or invalid, and the transaction without it.
+    """
+    transaction = dict(transaction)
+    try:
+        page_index: Optional[int] = int(transaction.pop('page_index', None))
+    except (TypeError, ValueError):
+        page_index = None
+    return (page_index if page_index is not None and 0 <= page_index < page_count else None), transaction
+
+
+def _split_pack(
+        data: Dict[str, any],
+        pages: List[Dict[str, any]],
+        account_information: bool
+) -> Dict[Tuple[int, str], any]:
+    """
+    Splits the response of a packed request into the results of its pages, shaped like single page responses.
+    :param data: the parsed response.
+    :param pages: the pages of the request, in order.
+    :param account_information: whether the account info was requested.
+    :return: the extracted data, by page number and kind.
+    """
+    transactions: List[List[Dict[str, any]]] = [[] for _ in pages]
+    untagged: int = 0
+    for transaction in data.get('transactions') or []:
+        page_index, transaction = _untag_transaction(transaction, page_count=len(pages))
+        if page_index is None:
+            # Kept with the first page of the request rather than dropped.
+            untagged += 1
+            page_index = 0
+        transactions[page_index].append(transaction)
+    if untagged:
+        logger.warning(f'{untagged} transactions without a valid page_index, assigned to',
+                       _get_page_name(pages[0]), module=Module.PDF)
+    results: Dict[Tuple[int, str], any] = {
+        (page['page_number'], 'transactions'): {'transactions': page_transactions}
+        for page, page_transactions in zip(pages, transactions)
+    }
+    if account_information:
+        results[(pages[0]['page_number'], 'account_information')] = {'account_data': data.get('account_data') or {}}
+    return results
+
+
+def _ocr_json(ocr: Callable[..., str], page_name: str, **kwargs) -> Tuple[str, any]:
+    """
+    Performs an llm request and parses its json response.
+    A malformed response, e.g. cut off, is requested again instead of failing the whole document.
+    Malformed responses are never cached, so the request reaches the model again.
+    :param ocr: the ocr function performing the llm request.
+    :param page_name: the name of the page for logging.
+    :param kwargs: the arguments of the ocr function.
+    :return: the response and the parsed response.
+    :raise ValueError: if the response is still malformed after JSON_RETRIES retries.
+    """
+    for attempt in itertools.count():
+        with metrics.time('pdf_step_seconds', in_flight='pdf_steps_in_flight', step='ocr'):
+            response: str = ocr(**kwargs)
+        try:
+            with metrics.time('pdf_step_seconds', step='json_parse'):
+                return response, json.loads(response)
+        except ValueError as e:
+            if attempt >= setup.JSON_RETRIES:
+                raise
+            logger.warning(f'Malformed response for {page_name}, requesting it again. Trace:', e, module=Module.PDF)
+
+
+def _extract_page(
+        pdf_hash: str,
+        page_number: int,
+        kind: str,
+        checkpoints: Dict[Tuple[int, str], str],
+        ocr: Callable[..., str],
+        on_transaction: Optional[Callable[[int, Dict[str, any]], None]] = None,
+        **kwargs
+) -> Dict[Tuple[int, str], any]:
+    """
+    Extracts the data of a page, unless it was checkpointed by an earlier, interrupted run.
+    New results are checkpointed as soon as they are complete.
+    :param pdf_hash: the content hash of the pdf file.
+    :param page_number: the number of the page.
+    :param kind: the kind of the extracted data, e.g. transactions or account_information.
+    :param checkpoints: the checkpointed llm responses of the pdf file.
+    :param ocr: the ocr function performing the llm request.
+    :param on_transaction: called with the page number and each transaction as soon as it is parsed, if any,
+        the ocr function must accept on_item.
+    :param kwargs: the arguments of the ocr function.
+    :return: the extracted data, by page number and kind.
+    """
+    response: Optional[str] = checkpoints.get((page_number, kind))
+    if response is not None:
+        metrics.inc('page_results_total', kind=kind, source='checkpoint')
+        data: any = json.loads(response)
+        if on_transaction is not None:
+            for transaction in data.get('transactions') or []:
+                on_transaction(page_number, transaction)
+        return {(page_number, kind): data}
+    if on_transaction is not None:
+        kwargs['on_item'] = functools.partial(on_transaction, page_number)
+    response, data = _ocr_json(ocr, f'{kind} of page {page_number}', **kwargs)
+    metrics.inc('page_results_total', kind=kind, source='llm')
+    db_handler.get_instance().save_page(document_hash=pdf_hash, page_number=page_number, kind=kind, result=response)
+    return {(page_number, kind): data}
+
+
+def _extract_pack(
+        pdf_hash: str,
+        pages: List[Dict[str, any]],
+        account_information: bool,
+        checkpoints: Dict[Tuple[int, str], str],
+        on_transaction: Optional[Callable[[int, Dict[str, any]], None]] = None
+) -> Dict[Tuple[int, str], any]:
+    """
+    Extracts the transactions of several pages with a single request, together with the account info
+    if the cover page is among them, unless all of it was checkpointed by an earlier, interrupted run.
+    The results are checkpointed per page like those of single page requests, so a run can resume in either mode.
+    :param pdf_hash: the content hash of the pdf file.
+    :param pages: the pages, in order.
+    :param account_information: whether the first page is the cover page and its account info is requested too.
+    :param checkpoints: the checkpointed llm responses of the pdf file.
+    :param on_transaction: called with the page number and each transaction as soon as it is parsed, if any.
+    :return: the extracted data, by page number and kind.
+    """
+    keys: List[Tuple[int, str]] = [(page['page_number'], 'transactions') for page in pages]
+    if account_information:
+        keys.append((pages[0]['page_number'], 'account_information'))
+    if all(key in checkpoints for key in keys):
+        results: Dict[Tuple[int, str], any] = {}
+        for page_number, kind in keys:
+            metrics.inc('page_results_total', kind=kind, source='checkpoint')
+            results[(page_number, kind)] = json.loads(checkpoints[(page_number, kind)])
+            if on_transaction is not None and kind == 'transactions':
+                for transaction in results[(page_number, kind)].get('transactions') or []:
+                    on_transaction(page_number, transaction)
+        return results
+
+    def _on_item(item: Dict[str, any]) -> None:
+        page_index, transaction = _untag_transaction(item, page_count=len(pages))
+        on_transaction(pages[page_index or 0]['page_number'], transaction)
+
+    _, data = _ocr_json(
+        _ocr_pack,
+        ', '.join(_get_page_name(page) for page in pages),
+        pages=pages,
+        account_information=account_information,
+        on_item=_on_item if on_transaction is not None else None
+    )
+    results = _split_pack(data, pages, account_information)
+    for (page_number, kind), result in results.items():
+        metrics.inc('page_results_total', kind=kind, source='llm')
+        db_handler.get_instance().save_page(
+            document_hash=pdf_hash,
+            page_number=page_number,
+            kind=kind,
+            result=json.dumps(result, ensure_ascii=False)
+        )
+    return results
+
+
+def _create_pdf_metadata(
+        filepath: str,
+        pages: Iterable[Dict[str, any]],
+        pdf_hash: str,
+        on_transaction: Optional[Callable[[int, Dict[str, any]], None]] = None
+) -> Dict[str, any]:
     """
     For the given pdf, create a metadata dictionary containing the text from each page.
+    Pages already extracted by an earlier run of the same pdf are not requested again.
+    The requests of a page are sent as soon as the page is rendered, the first page not skipped being the cover page.
+    With PAGES_PER_REQUEST > 1, consecutive pages are packed into one request, the cover page's account info included.
+    At most two requests per worker are pending, the next pages are only rendered once a request has finished,
+    so a long document does not hold all of its pages in memory while the requests are waiting.
+    Pages skipped by the page filter are recorded with the reason and no transactions, without a request.
     :param filepath: path to the pdf file.
-    :param images: list of image paths for the extracted pdf pages.
+    :param pages: the extracted pdf pages, in order.
+    :param pdf_hash: the content hash of the pdf file.
+    :param on_transaction: called with the page number and each transaction as soon as it is parsed, if any.
     :return: the metadata dictionary.
     """
-    cover_page: str = images[0]
-    metadata: Dict[str, str] = {
-        'pdf_path': filepath,
-        'page_count': len(images),
-        'page_content': [
-            {
-                'page_path': page_path,
-                'transactions': json.loads(_ocr_transactions(pdf_page_path=page_path))
-            }
-            for page_path in images
-        ],
-        'account_information': json.loads(_ocr_account_info(cover_page_path=cover_page))
-    }
+    checkpoints: Dict[Tuple[int, str], str] = db_handler.get_instance().find_pages(document_hash=pdf_hash)
+    if checkpoints:
+        logger.info(f'Resuming "{filepath}", {len(checkpoints)} extraction results are checkpointed.',
+                    module=Module.PDF)
+    workers: int = max(1, setup.OCR_WORKERS)
+    pack_size: int = max(1, setup.PAGES_PER_REQUEST)
+    logger.debug('Extracting pages of', filepath, 'concurrent requests:', workers, 'pages per request:', pack_size,
+                 module=Module.PDF)
+    executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ocr')
+    try:
+        requests: List[Future] = []
+        pending: Set[Future] = set()
+
+        def _submit(fn: Callable[..., Dict[Tuple[int, str], any]], *args, **kwargs) -> None:
+            nonlocal pending
+            while len(pending) >= 2 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                # A failed page fails the document, without rendering the remaining pages first.
+                for request in done:
+                    request.result()
+            request: Future = executor.submit(fn, *args, **kwargs)
+            pending.add(request)
+            requests.append(request)
+
+        page_content: List[Dict[str, any]] = []
+        pack: List[Dict[str, any]] = []
+        cover_page_number: Optional[int] = None
+        for page in pages:
+            page_content.append({
+                'page_number': page['page_number'],
+                'page_path': page['page_path'],
+                'text_layer': page.get('text') is not None
+            })
+            if page.get('skip_reason') is not None:
+                logger.debug('Skipping', _get_page_name(page), 'of', filepath, ':', page['skip_reason'],
+                             module=Module.PDF)
+                page_content[-1].update(page_class='skip', skip_reason=page['skip_reason'])
+                continue
+            cover_page: bool = cover_page_number is None
+            if cover_page:
+                cover_page_number = page['page_number']
+            page_content[-1]['page_class'] = 'cover' if cover_page else 'transactions'
+            if pack_size == 1:
+                if cover_page:
+                    _submit(
+                        _extract_page, pdf_hash, page['page_number'], 'account_information', checkpoints,
+                        _ocr_account_info, cover_page=page
+                    )
+                _submit(
+                    _extract_page, pdf_hash, page['page_number'], 'transactions', checkpoints,
+                    _ocr_transactions, on_transaction, page=page
+                )
+                continue
+            if (page['page_number'], 'transactions') in checkpoints and \
+                    (not cover_page or (page['page_number'], 'account_information') in checkpoints):
+                # Served from the checkpoints, without taking a place in a request.
+                _submit(
+                    _extract_pack, pdf_hash, [page], cover_page, checkpoints, on_transaction
+                )
+                continue
+            pack.append(page)
+            if len(pack) == pack_size:
+                _submit(
+                    _extract_pack, pdf_hash, pack, pack[0]['page_number'] == cover_page_number, checkpoints,
+                    on_transaction
+                )
+                pack = []
+        if pack:
+            _submit(
+                _extract_pack, pdf_hash, pack, pack[0]['page_number'] == cover_page_number, checkpoints,
+                on_transaction
+            )
+        results: Dict[Tuple[int, str], any] = {}
+        for request in requests:
+            results.update(request.result())
+        for page in page_content:
+            page['transactions'] = results.get((page['page_number'], 'transactions'), {'transactions': []})
+        if cover_page_number is None:
+            logger.warning(f'All pages of "{filepath}" were skipped by the page filter.', module=Module.PDF)
+        metadata: Dict[str, str] = {
+            'pdf_path': filepath,
+            'page_count': len(page_content),
+            'page_content': page_content,
+            'account_information': results.get((cover_page_number, 'account_information'), {'account_data': {}})
+        }
+    finally:
+        # Drop the pending requests if a page failed, the finished pages are checkpointed.
+        executor.shutdown(wait=True, cancel_futures=True)
     return metadata
 
 
@@ -128,39 +754,223 @@ def _cleanup(file_path: str, workdir: str, success: bool = True) -> None:
     logger.info(f'Moved PDF file {file_path} into {target_dir}', module=Module.PDF)
 
 
-def _process_pdf(filepath: str) -> None:
+def _rasterize(job: Dict[str, any]) -> Dict[str, any]:
     """
-    Processes a PDF file - extracts pdf pages as images and performs ocr for each page.
-    :param filepath: path to the PDF file.
+    Rasterization stage - skips known documents by their content hash,
+    creates the working directory and extracts the pdf pages as images.
+    A pdf with the same content as a pdf in the pipeline is not processed, it waits for that pdf instead.
+    :param job: the pipeline job for the pdf file.
+    :return: the job, extended by the working directory, the cover page and the iterator over the other pages.
+    """
+    filepath: str = job['filepath']
+    logger.info('Processing PDF:', filepath, module=Module.PDF)
+    pdf_hash: str = _hash_file(filepath=filepath)
+    with _in_flight_lock:
+        if pdf_hash in _in_flight_hashes:
+            logger.info(f'A pdf with the same content as "{filepath}" is already being processed, waiting for it.',
+                        module=Module.PDF)
+            job['waits_for'] = pdf_hash
+            return job
+        _in_flight_hashes.add(pdf_hash)
+    job['pdf_hash'] = pdf_hash
+    job['duplicate_of'] = db_handler.get_instance().find_document_by_hash(document_hash=pdf_hash)
+    if job['duplicate_of']:
+        # Known document - skip rasterization and the llm requests.
+        return job
+    # In memory mode, nothing is written to the image directory.
+    workdir: str = ''
+    if not setup.RASTERIZE_IN_MEMORY:
+        # Left behind by a run that crashed while rendering the pdf, the in-flight hashes keep other jobs out of it.
+        remove_stale_workdir(filepath=filepath)
+        workdir = _create_workdir(filepath=filepath)
+    job['workdir'] = workdir
+    pages: Generator[Dict[str, any], None, None] = _split_pages(filepath=filepath, workdir=job['workdir'])
+    # The first chunk is rendered in this stage, the following chunks render while the job waits for extraction.
+    job['cover_page'] = next(pages, None)
+    job['pages'] = pages
+    if job['cover_page'] is None:
+        raise Exception(f'No images found in "{filepath}".')
+    return job
+
+
+def _extract(job: Dict[str, any]) -> Dict[str, any]:
+    """
+    Extraction stage - performs the llm requests for all pages of the pdf file.
+    :param job: the pipeline job for the pdf file.
+    :return: the job, extended by the metadata dictionary.
+    """
+    if job.get('duplicate_of') or job.get('waits_for'):
+        return job
+    on_transaction: Optional[Callable[[str, int, Dict[str, any]], None]] = job.get('on_transaction')
+    try:
+        job['metadata'] = _create_pdf_metadata(
+            filepath=job['filepath'],
+            pages=itertools.chain([job['cover_page']], job['pages']),
+            pdf_hash=job['pdf_hash'],
+            on_transaction=functools.partial(on_transaction, job['filepath']) if on_transaction is not None else None
+        )
+    finally:
+        # Stops rendering the remaining pages if a page failed.
+        job['pages'].close()
+    job['metadata']['pdf_hash'] = job['pdf_hash']
+    logger.debug('Processed data:', job['metadata'], module=Module.PDF)
+    return job
+
+
+def _release_hash(job: Dict[str, any]) -> None:
+    """
+    Removes the content hash of a finished job from the in-flight hashes
+    and settles the jobs waiting for it. Called once the pdf file of the job is committed or failed.
+    :param job: the pipeline job for the pdf file.
     :return:
     """
+    with _in_flight_lock:
+        _in_flight_hashes.discard(job.get('pdf_hash'))
+        waiting: List[Dict[str, any]] = _waiting_jobs.pop(job.get('pdf_hash'), [])
+    for waiting_job in waiting:
+        try:
+            _settle_waiting_job(job=waiting_job)
+        except Exception as e:
+            logger.error(f'Failed to settle "{waiting_job["filepath"]}". Trace:', e, module=Module.PDF)
+
+
+def _settle_waiting_job(job: Dict[str, any]) -> None:
+    """
+    Settles a job that waited for a pdf with the same content, once that pdf has left the pipeline.
+    The pdf file is skipped as a duplicate if that pdf was imported, and failed with it otherwise.
+    :param job: the waiting pipeline job.
+    :return:
+    """
+    filepath: str = job['filepath']
+    error: Optional[Exception] = None
+    job['duplicate_of'] = db_handler.get_instance().find_document_by_hash(document_hash=job['waits_for'])
+    if job['duplicate_of']:
+        metrics.inc('documents_total', outcome='duplicate')
+        logger.info(f'PDF {filepath} was imported meanwhile as {job["duplicate_of"]}, skipping.', module=Module.PDF)
+    else:
+        metrics.inc('documents_total', outcome='failed')
+        error = Exception(f'The pdf with the same content as "{filepath}" failed.')
+        logger.warning(f'The pdf with the same content as "{filepath}" failed, failing it too.', module=Module.PDF)
     try:
-        workdir: str = _create_workdir(filepath=filepath)
+        _cleanup(file_path=filepath, workdir='', success=error is None)
+    finally:
+        _notify(job=job, error=error)
+
+
+def _notify(job: Dict[str, any], error: Optional[Exception]) -> None:
+    """
+    Reports a pdf file leaving the pipeline to the on_finished callback of process_files, if any.
+    :param job: the pipeline job for the pdf file.
+    :param error: the error the pdf failed with, None if it was imported or skipped as a duplicate.
+    :return:
+    """
+    on_finished: Optional[Callable[[str, Optional[Exception]], None]] = job.get('on_finished')
+    if on_finished is None:
+        return
+    try:
+        on_finished(job['filepath'], error)
     except Exception as e:
-        logger.error('Failed to create working directory. Trace:', e, module=Module.PDF)
+        logger.error(f'Error in the callback for "{job["filepath"]}". Trace:', e, module=Module.PDF)
+
+
+def _persist(job: Dict[str, any], error: Optional[Exception]) -> None:
+    """
+    Persistence stage - saves the extracted data to the database and moves the pdf file.
+    :param job: the pipeline job for the pdf file.
+    :param error: the error raised by a previous stage, if any.
+    :return:
+    """
+    filepath: str = job['filepath']
+    if job.get('waits_for') and error is None:
+        with _in_flight_lock:
+            waiting: bool = job['waits_for'] in _in_flight_hashes
+            if waiting:
+                _waiting_jobs.setdefault(job['waits_for'], []).append(job)
+        if not waiting:
+            # The pdf with the same content has left the pipeline in the meantime.
+            _settle_waiting_job(job=job)
+        return
+    if job.get('duplicate_of') and error is None:
+        metrics.inc('documents_total', outcome='duplicate')
+        logger.info(f'PDF {filepath} was already imported as {job["duplicate_of"]}, skipping.', module=Module.PDF)
+        _release_hash(job=job)
+        try:
+            _cleanup(file_path=filepath, workdir='', success=True)
+        finally:
+            _notify(job=job, error=None)
+        return
+    if 'workdir' not in job:
+        # The pdf was not touched, leave it in the source directory.
+        logger.error(f'Failed to prepare "{filepath}", leaving it in the source directory. Trace:', error,
+                     module=Module.PDF)
+        metrics.inc('documents_total', outcome='not_prepared')
+        _release_hash(job=job)
+        _notify(job=job, error=error)
+        return
+    if error is not None:
+        # The error was logged by the pipeline.
+        metrics.inc('documents_total', outcome='failed')
+        _release_hash(job=job)
+        try:
+            _cleanup(file_path=filepath, workdir=job['workdir'], success=False)
+        finally:
+            _notify(job=job, error=error)
         return
-    success: bool = True
+
+    start: float = time.perf_counter()
+
+    def _on_commit(import_error: Optional[Exception]) -> None:
+        # The pdf is only moved once its data is committed.
+        metrics.observe('pipeline_stage_seconds', time.perf_counter() - start, stage='persist')
+        metrics.inc('documents_total', outcome='imported' if import_error is None else 'failed')
+        if import_error is not None:
+            logger.error(f'Failed to save the OCR data of "{filepath}". Trace:', import_error, module=Module.PDF)
+        _release_hash(job=job)
+        try:
+            _cleanup(file_path=filepath, workdir=job['workdir'], success=import_error is None)
+        finally:
+            _notify(job=job, error=import_error)
+
+    logger.info('Saving OCR data to database', module=Module.PDF)
     try:
-        images: List[str] = _split_pages(filepath=filepath, workdir=workdir)
-        if not len(images):
-            raise Exception(f'No images found in "{filepath}".')
-        metadata_dictionary: Dict[str, any] = _create_pdf_metadata(filepath=filepath, images=images)
-        logger.debug('Processed data:', metadata_dictionary, module=Module.PDF)
-        logger.info('Saving OCR data to database', module=Module.PDF)
-        database.import_pdf_data(pdf_metadata_dictionary=metadata_dictionary)
+        db_handler.get_instance().import_pdf_data(pdf_metadata_dictionary=job['metadata'], on_commit=_on_commit)
     except Exception as e:
-        logger.error('An error occurred while processing the PDF. Trace:', e, module=Module.PDF)
-        success = False
-    finally:
-        _cleanup(file_path=filepath, workdir=workdir, success=success)
+        _on_commit(e)
 
 
-def process_files(files: List[str]) -> None:
+def process_files(
+        files: Iterable[str],
+        on_finished: Optional[Callable[[str, Optional[Exception]], None]] = None,
+        on_transaction: Optional[Callable[[str, int, Dict[str, any]], None]] = None
+) -> None:
     """
     Processes the given pdf files, extracts data and saves it to the database.
+    Rasterization, llm extraction and persistence run as overlapping pipeline stages,
+    the database writes are batched by the database writer thread.
     :param files: the pdf files to process.
+    :param on_finished: called with the path and the error (None on success) of each pdf file once it left
+        the pipeline and was moved, may run in the database writer thread. A pdf file with the same content as
+        a pdf in the pipeline is reported once that pdf has left the pipeline, like a known document if that pdf
+        was imported and with an error otherwise.
+    :param on_transaction: called with the path, the page number and each extracted transaction as soon as it is
+        parsed, while the response is still streaming (STREAMING), runs in the request threads. Transactions of
+        checkpointed pages are emitted too, those of a response requested again after an error may be emitted twice.
     :return:
     """
-    for pdf_file in files:
-        logger.info('Processing PDF:', pdf_file, module=Module.PDF)
-        _process_pdf(pdf_file)
+    setup.check_openai_api_key()
+    # Created up front, so that config errors surface before the first pdf is rasterized.
+    azure_openai_adapter: AzureOpenAIAdapter = _get_adapter()
+    database: Database = db_handler.get_instance()
+    pipeline: Pipeline = Pipeline(queue_size=setup.PIPELINE_QUEUE_SIZE)
+    pipeline.add_stage('rasterize', _rasterize, workers=setup.RASTER_WORKERS)
+    pipeline.add_stage('extract', _extract, workers=setup.DOCUMENT_WORKERS)
+    pipeline.run(
+        jobs=(
+            {'filepath': pdf_file, 'on_finished': on_finished, 'on_transaction': on_transaction} for pdf_file in files
+        ),
+        sink=_persist
+    )
+    _shutdown_raster_pool()
+    database.flush()
+    if azure_openai_adapter.response_cache is not None:
+        logger.info('Response cache statistics:', azure_openai_adapter.response_cache.stats(), module=Module.PDF)
@@ -1,16 +1,27 @@
 #!/usr/bin/env python3
+import atexit
 import glob
 import json
 import os
+import queue
 import sqlite3
+import threading
+import time
 from sqlite3 import Connection, Cursor
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple, Iterator, Callable
 
 import setup
+from persistence.normalization import normalize_amount, normalize_date, normalize_iban
 from log_handling import log_handler
 from log_handling.log_handler import Logger, Module
+from metrics_handling import metrics_handler
+from metrics_handling.metrics_handler import Metrics
 
 logger: Logger = log_handler.get_instance()
+metrics: Metrics = metrics_handler.get_instance()
+
+# Stops the writer thread.
+_STOP = object()
 
 
 class Database:
@@ -18,40 +29,365 @@ class Database:
     Handles the sqlite db connection.
     """
     DATABASE_PATH: str = os.path.join(setup.DB_PATH)
+    # Number of documents fetched at once by the export.
+    EXPORT_FETCH_SIZE: int = 16
+    BUSY_TIMEOUT_MS: int = 30000
+    BATCH_SIZE_BUCKETS: Tuple[float, ...] = (1, 2, 4, 8, 16, 32, 64, 128, 256)
     MIGRATIONS_PATH: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
-    INSERT_DOCUMENT_QUERY: str = 'INSERT INTO DOCUMENTS VALUES (NULL, ?, ?)'
+    # Version of the migration creating the normalized tables, the documents imported before are backfilled with it.
+    NORMALIZED_TABLES_MIGRATION: int = 2
+    INSERT_DOCUMENT_QUERY: str = '''
+        INSERT INTO DOCUMENTS (DOCUMENT_NAME, DOCUMENT_DATA, DOCUMENT_HASH, UPDATED_AT)
+        VALUES (?, ?, ?, STRFTIME('%Y-%m-%dT%H:%M:%f', 'NOW'))
+    '''
     EXPORT_ALL_DOCUMENTS_QUERY: str = 'SELECT DOCUMENT_NAME, DOCUMENT_DATA FROM DOCUMENTS'
+    # A document is exported again once EXPORTED_AT is reset to NULL, which the partial index
+    # DOCUMENTS_UNEXPORTED covers, so every write changing a document has to reset it.
+    UNEXPORTED_DOCUMENTS_QUERY: str = '''
+        SELECT ID, DOCUMENT_NAME, DOCUMENT_DATA, UPDATED_AT FROM DOCUMENTS
+        WHERE EXPORTED_AT IS NULL
+        ORDER BY ID
+    '''
+    # Only marks the exported version, a document changed during the export stays unexported.
+    MARK_EXPORTED_QUERY: str = '''
+        UPDATE DOCUMENTS SET EXPORTED_AT = COALESCE(?1, STRFTIME('%Y-%m-%dT%H:%M:%f', 'NOW'))
+        WHERE ID = ?2 AND UPDATED_AT IS ?1
+    '''
+    FIND_DOCUMENT_BY_HASH_QUERY: str = 'SELECT DOCUMENT_NAME FROM DOCUMENTS WHERE DOCUMENT_HASH = ? LIMIT 1'
+    UPSERT_ACCOUNT_QUERY: str = '''
+        INSERT INTO ACCOUNTS (IBAN, NAME) VALUES (?, ?)
+        ON CONFLICT (IBAN) DO UPDATE SET NAME = COALESCE(EXCLUDED.NAME, NAME)
+    '''
+    FIND_ACCOUNT_QUERY: str = 'SELECT ID FROM ACCOUNTS WHERE IBAN = ?'
+    INSERT_STATEMENT_QUERY: str = '''
+        INSERT INTO STATEMENTS (DOCUMENT_ID, ACCOUNT_ID, DOCUMENT_DATE, PREVIOUS_BALANCE_CENTS, NEW_BALANCE_CENTS)
+        VALUES (?, ?, ?, ?, ?)
+    '''
+    INSERT_TRANSACTION_QUERY: str = '''
+        INSERT INTO TRANSACTIONS (
+            STATEMENT_ID, ACCOUNT_ID, PAGE_NUMBER, TRANSACTION_DATE, AMOUNT_CENTS, TRANSACTION_TEXT
+        ) VALUES (?, ?, ?, ?, ?, ?)
+    '''
+    UPSERT_PAGE_QUERY: str = '''
+        INSERT OR REPLACE INTO PAGES (DOCUMENT_HASH, PAGE_NUMBER, KIND, RESULT) VALUES (?, ?, ?, ?)
+    '''
+    FIND_PAGES_QUERY: str = 'SELECT PAGE_NUMBER, KIND, RESULT FROM PAGES WHERE DOCUMENT_HASH = ?'
+    DELETE_PAGES_QUERY: str = 'DELETE FROM PAGES WHERE DOCUMENT_HASH = ?'
+    DOCUMENTS_WITHOUT_STATEMENT_QUERY: str = '''
+        SELECT D.ID, D.DOCUMENT_DATA FROM DOCUMENTS D
+        LEFT JOIN STATEMENTS S ON S.DOCUMENT_ID = D.ID
+        WHERE S.ID IS NULL
+    '''
+    FIND_TRANSACTIONS_QUERY: str = '''
+        SELECT A.IBAN, T.TRANSACTION_DATE, T.AMOUNT_CENTS, T.TRANSACTION_TEXT, T.PAGE_NUMBER, D.DOCUMENT_NAME
+        FROM TRANSACTIONS T
+        JOIN ACCOUNTS A ON A.ID = T.ACCOUNT_ID
+        JOIN STATEMENTS S ON S.ID = T.STATEMENT_ID
+        JOIN DOCUMENTS D ON D.ID = S.DOCUMENT_ID
+        WHERE A.IBAN = ? AND T.TRANSACTION_DATE BETWEEN ? AND ?
+        ORDER BY T.TRANSACTION_DATE, T.ID
+    '''
 
-    def _connect(self) -> Connection:
+    def _connect(self, autocommit: bool = False) -> Connection:
         """
         Connect to the sqlite3 database.
+        The database runs in WAL mode, so that readers do not block the writer and vice versa.
+        :param autocommit: whether the sqlite3 module leaves the transaction handling to the caller.
         :return: the sqlite3 db connection.
         """
         logger.info(f'Connecting to database \"{self.DATABASE_PATH}\"...', module=Module.DB)
-        return sqlite3.connect(self.DATABASE_PATH)
+        conn: Connection = sqlite3.connect(
+            self.DATABASE_PATH,
+            isolation_level=None if autocommit else '',
+            check_same_thread=False
+        )
+        conn.execute('PRAGMA journal_mode = WAL')
+        # In WAL mode, NORMAL only syncs on checkpoints and is still safe against corruption.
+        conn.execute('PRAGMA synchronous = NORMAL')
+        conn.execute(f'PRAGMA cache_size = -{setup.DB_CACHE_KIB}')
+        conn.execute(f'PRAGMA busy_timeout = {self.BUSY_TIMEOUT_MS}')
+        return conn
+
+    def __get_reader(self) -> Connection:
+        """
+        Get the reader connection of the calling thread, reads never wait for the writer thread.
+        :return: the sqlite3 db connection.
+        """
+        conn: Optional[Connection] = getattr(self.readers, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self.readers.conn = conn
+        return conn
+
+    @staticmethod
+    def __get_migration_version(file: str) -> int:
+        """
+        Get the version of a migration file named migrations_<version>_<name>.sql.
+        :param file: path to the migration file.
+        :return: the migration version.
+        """
+        return int(os.path.basename(file).split('_')[1])
+
+    @staticmethod
+    def __split_statements(sql: str) -> List[str]:
+        """
+        Splits a migration script into its sql statements.
+        :param sql: the migration script, the last statement may omit the semicolon.
+        :return: the sql statements.
+        """
+        statements: List[str] = []
+        statement: str = ''
+        # Semicolons within strings or triggers do not end a statement, sqlite tells complete statements apart.
+        for part in sql.split(';'):
+            statement += part + ';'
+            if sqlite3.complete_statement(statement):
+                if statement.strip(' \t\r\n;'):
+                    statements.append(statement)
+                statement = ''
+        return statements
 
     def _apply_migrations(self) -> None:
         """
-        Applies the database migrations and sets up the db tables.
+        Applies the pending database migrations and sets up the db tables.
+        The number of applied migrations is tracked in the user_version of the database.
+        The migrations and the version update are applied in one transaction, which takes the write lock
+        before the version is read: workers starting at the same time do not apply a migration twice.
+        The documents of databases older than the normalized tables are backfilled in the same transaction, once.
         :return:
         """
-        globs: List[str] = glob.glob(os.path.join(self.MIGRATIONS_PATH, '*.sql'))
-        logger.info(f'Applying {len(globs)} migrations...', module=Module.DB)
-        for file in globs:
-            with open(file, 'r') as f:
-                sql: str = f.read()
-                logger.debug(f'Applying migration:\n\n{sql}\n', module=Module.DB)
-                self.conn.execute(sql)
-                self.conn.commit()
+        globs: List[str] = sorted(
+            glob.glob(os.path.join(self.MIGRATIONS_PATH, '*.sql')),
+            key=self.__get_migration_version
+        )
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            schema_version: int = self.conn.execute('PRAGMA user_version').fetchone()[0]
+            pending: List[str] = [file for file in globs if self.__get_migration_version(file) >= schema_version]
+            logger.info(f'Applying {len(pending)} of {len(globs)} migrations...', module=Module.DB)
+            for file in pending:
+                with open(file, 'r') as f:
+                    sql: str = f.read()
+                logger.debug('Applying migration:\n\n', sql, module=Module.DB)
+                for statement in self.__split_statements(sql):
+                    self.conn.execute(statement)
+                self.conn.execute(f'PRAGMA user_version = {self.__get_migration_version(file) + 1}')
+            if any(self.__get_migration_version(file) == self.NORMALIZED_TABLES_MIGRATION for file in pending):
+                self._backfill_statements()
+            self.conn.execute('COMMIT')
+        except Exception:
+            self.conn.execute('ROLLBACK')
+            raise
         logger.info('Finished applying migrations.', module=Module.DB)
 
+    def __write_loop(self) -> None:
+        """
+        Loop of the writer thread. Writes are collected into batches, which are committed
+        once they reach the batch size, the flush interval has passed or a caller waits for the write.
+        :return:
+        """
+        stopped: bool = False
+        while not stopped:
+            item = self.write_queue.get()
+            if item is _STOP:
+                break
+            batch: List[Tuple[Callable[[], any], Callable[[Optional[Exception]], None], bool]] = [item]
+            deadline: float = time.monotonic() + self.flush_interval
+            # A waiting caller is not kept waiting for the flush interval.
+            while len(batch) < self.batch_size and not batch[-1][2]:
+                timeout: float = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self.write_queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopped = True
+                    break
+                batch.append(item)
+            self.__commit_batch(batch)
+
+    def __commit_batch(
+            self,
+            batch: List[Tuple[Callable[[], any], Callable[[Optional[Exception]], None], bool]]
+    ) -> None:
+        """
+        Runs a batch of writes in one transaction. Each write runs in its own savepoint,
+        a failing write is rolled back without affecting the others.
+        :param batch: the writes, their commit callbacks and whether a caller waits for them.
+        :return:
+        """
+        results: List[Tuple[Callable[[Optional[Exception]], None], Optional[Exception]]] = []
+        metrics.set('db_write_queue_depth', self.write_queue.qsize())
+        metrics.observe('db_batch_size', len(batch), buckets=self.BATCH_SIZE_BUCKETS)
+        start: float = time.perf_counter()
+        try:
+            self.conn.execute('BEGIN')
+            for operation, on_commit, _ in batch:
+                self.conn.execute('SAVEPOINT WRITE')
+                try:
+                    operation()
+                    self.conn.execute('RELEASE WRITE')
+                    results.append((on_commit, None))
+                except Exception as e:
+                    self.conn.execute('ROLLBACK TO WRITE')
+                    self.conn.execute('RELEASE WRITE')
+                    results.append((on_commit, e))
+            self.conn.execute('COMMIT')
+        except Exception as e:
+            logger.error(f'Failed to commit {len(batch)} database writes. Trace:', e, module=Module.DB)
+            if self.conn.in_transaction:
+                self.conn.execute('ROLLBACK')
+            results = [(on_commit, error or e) for on_commit, error in results]
+            results += [(on_commit, e) for _, on_commit, _ in batch[len(results):]]
+        metrics.observe('db_commit_seconds', time.perf_counter() - start)
+        for _, error in results:
+            metrics.inc('db_writes_total', outcome='ok' if error is None else 'failed')
+        logger.debug('Committed database writes:', len(batch), module=Module.DB)
+        for on_commit, error in results:
+            try:
+                on_commit(error)
+            except Exception as e:
+                logger.error('Error in database commit callback. Trace:', e, module=Module.DB)
+
+    def __write(
+            self,
+            operation: Callable[[], any],
+            on_commit: Optional[Callable[[Optional[Exception]], None]] = None
+    ) -> None:
+        """
+        Hands a write to the writer thread.
+        :param operation: the write, runs in the writer thread within the batch transaction.
+        :param on_commit: called with None once the write is committed, or with the error if it failed.
+            Runs in the writer thread. Without callback, the call blocks until the write is committed
+            and raises its error.
+        :return:
+        """
+        if on_commit is not None:
+            self.write_queue.put((operation, on_commit, False))
+            return
+        done: threading.Event = threading.Event()
+        errors: List[Exception] = []
+
+        def _on_commit(error: Optional[Exception]) -> None:
+            if error is not None:
+                errors.append(error)
+            done.set()
+
+        self.write_queue.put((operation, _on_commit, True))
+        done.wait()
+        if errors:
+            raise errors[0]
+
+    def flush(self) -> None:
+        """
+        Waits until all pending writes are committed.
+        :return:
+        """
+        self.__write(lambda: None)
+
+    def close(self) -> None:
+        """
+        Commits the pending writes and stops the writer thread.
+        :return:
+        """
+        if self.writer.is_alive():
+            self.write_queue.put(_STOP)
+            self.writer.join()
+
+    @staticmethod
+    def __get_account_data(pdf_metadata_dictionary: Dict[str, any]) -> Dict[str, any]:
+        """
+        Get the account data extracted from the cover page, with lower case keys.
+        :param pdf_metadata_dictionary: pdf data dictionary, containing extracted ocr data from gpt.
+        :return: the account data, empty if none was extracted.
+        """
+        account_information: any = pdf_metadata_dictionary.get('account_information') or {}
+        account_data: any = account_information.get('account_data', account_information) \
+            if isinstance(account_information, dict) else {}
+        if not isinstance(account_data, dict):
+            return {}
+        return {str(key).lower(): value for key, value in account_data.items()}
+
+    def __get_account_id(self, account_data: Dict[str, any]) -> Optional[int]:
+        """
+        Creates or updates the account of a statement. Runs in the writer thread.
+        :param account_data: the account data extracted from the cover page.
+        :return: the account id, or None if the statement has no iban.
+        """
+        iban: Optional[str] = normalize_iban(account_data.get('iban'))
+        if iban is None:
+            return None
+        name: Optional[str] = account_data.get('name') if isinstance(account_data.get('name'), str) else None
+        self.conn.execute(self.UPSERT_ACCOUNT_QUERY, [iban, name or None])
+        return self.conn.execute(self.FIND_ACCOUNT_QUERY, [iban]).fetchone()[0]
+
+    def __insert_statement(self, document_id: int, pdf_metadata_dictionary: Dict[str, any]) -> int:
+        """
+        Writes the account, the statement and the transactions of a document to the normalized tables.
+        Runs in the writer thread, or in the migrations before it is started.
+        :param document_id: the id of the document.
+        :param pdf_metadata_dictionary: pdf data dictionary, containing extracted ocr data from gpt.
+        :return: the number of transactions written.
+        """
+        account_data: Dict[str, any] = self.__get_account_data(pdf_metadata_dictionary)
+        account_id: Optional[int] = self.__get_account_id(account_data)
+        document_date: Optional[str] = normalize_date(account_data.get('document_date'))
+        # Transaction dates without year belong to the year of the statement.
+        reference_year: Optional[int] = int(document_date[:4]) if document_date else None
+        cursor: Cursor = self.conn.execute(self.INSERT_STATEMENT_QUERY, [
+            document_id,
+            account_id,
+            document_date,
+            normalize_amount(account_data.get('previous_account_balance')),
+            normalize_amount(account_data.get('new_account_balance'))
+        ])
+        statement_id: int = cursor.lastrowid
+        rows: List[Tuple] = []
+        for page_index, page in enumerate(pdf_metadata_dictionary.get('page_content', [])):
+            page_number: int = page.get('page_number', page_index)
+            transactions: any = page.get('transactions') or {}
+            for transaction in (transactions.get('transactions') or []) if isinstance(transactions, dict) else []:
+                if not isinstance(transaction, dict):
+                    continue
+                rows.append((
+                    statement_id,
+                    account_id,
+                    page_number,
+                    normalize_date(transaction.get('date'), reference_year=reference_year),
+                    normalize_amount(transaction.get('amount')),
+                    transaction.get('transaction_text')
+                ))
+        self.conn.executemany(self.INSERT_TRANSACTION_QUERY, rows)
+        return len(rows)
+
+    def _backfill_statements(self) -> None:
+        """
+        Writes documents imported before the normalized tables existed to the normalized tables.
+        Runs within the transaction of the migrations.
+        :return:
+        """
+        rows: List[Tuple[int, str]] = self.conn.execute(self.DOCUMENTS_WITHOUT_STATEMENT_QUERY).fetchall()
+        if not rows:
+            return
+        logger.info(f'Backfilling transactions of {len(rows)} documents...', module=Module.DB)
+        for document_id, document_data in rows:
+            self.conn.execute('SAVEPOINT BACKFILL')
+            try:
+                self.__insert_statement(document_id, json.loads(document_data))
+            except Exception as e:
+                logger.error(f'Failed to backfill document {document_id}. Trace:', e, module=Module.DB)
+                self.conn.execute('ROLLBACK TO BACKFILL')
+                self.conn.execute(self.INSERT_STATEMENT_QUERY, [document_id, None, None, None, None])
+            self.conn.execute('RELEASE BACKFILL')
+        logger.info('Finished backfilling transactions.', module=Module.DB)
+
     def export_data(self) -> List[Dict[str, any]]:
         """
         Export all data from the database.
         :return:
         """
-        cursor: Cursor = self.conn.cursor()
-        rows: List[any] = cursor.execute(self.EXPORT_ALL_DOCUMENTS_QUERY).fetchall()
+        rows: List[any] = self.__get_reader().execute(self.EXPORT_ALL_DOCUMENTS_QUERY).fetchall()
         return [
             {
                 'document_name': data[0],
@@ -59,17 +395,131 @@ class Database:
             } for data in rows
         ]
 
-    def import_pdf_data(self, pdf_metadata_dictionary: Dict[str, any]) -> None:
+    def iter_unexported_documents(self) -> Iterator[Dict[str, any]]:
+        """
+        Lazily iterates the documents that were imported or changed since their last export.
+        The documents are fetched from the cursor in small chunks, imports may continue meanwhile.
+        :return: an iterator over the documents.
+        """
+        cursor: Cursor = self.__get_reader().execute(self.UNEXPORTED_DOCUMENTS_QUERY)
+        try:
+            while True:
+                rows: List[Tuple] = cursor.fetchmany(self.EXPORT_FETCH_SIZE)
+                if not rows:
+                    return
+                for row in rows:
+                    yield {
+                        'document_id': row[0],
+                        'document_name': row[1],
+                        'document_data': json.loads(row[2]),
+                        'updated_at': row[3]
+                    }
+        finally:
+            cursor.close()
+
+    def mark_document_exported(
+            self,
+            document_id: int,
+            updated_at: Optional[str],
+            on_commit: Optional[Callable[[Optional[Exception]], None]] = None
+    ) -> None:
+        """
+        Sets the export watermark of a document.
+        :param document_id: the id of the document.
+        :param updated_at: the update time of the exported version of the document,
+            so that later changes are exported again.
+        :param on_commit: called once the watermark is committed, see import_pdf_data.
+        :return:
+        """
+        self.__write(lambda: self.conn.execute(self.MARK_EXPORTED_QUERY, [updated_at, document_id]), on_commit)
+
+    def import_pdf_data(
+            self,
+            pdf_metadata_dictionary: Dict[str, any],
+            on_commit: Optional[Callable[[Optional[Exception]], None]] = None
+    ) -> None:
         """
         Imports extracted data from pdf files to the database.
+        The document is written by the writer thread, batched with other writes.
         :param pdf_metadata_dictionary: pdf data dictionary, containing extracted ocr data from gpt.
+        :param on_commit: called in the writer thread with None once the document is committed,
+            or with the error if the import failed. Without callback, the call blocks until the commit.
         :return:
         """
         document_name: str = os.path.basename(pdf_metadata_dictionary['pdf_path'])
+        document_hash: Optional[str] = pdf_metadata_dictionary.get('pdf_hash')
         json_data: str = json.dumps(pdf_metadata_dictionary)
-        self.conn.execute(self.INSERT_DOCUMENT_QUERY, [document_name, json_data])
-        self.conn.commit()
-        logger.info('Data for document {} written to db.'.format(document_name), module=Module.DB)
+
+        def _import() -> None:
+            cursor: Cursor = self.conn.execute(self.INSERT_DOCUMENT_QUERY, [document_name, json_data, document_hash])
+            transaction_count: int = self.__insert_statement(cursor.lastrowid, pdf_metadata_dictionary)
+            # The page checkpoints are no longer needed once the document is imported.
+            if document_hash is not None:
+                self.conn.execute(self.DELETE_PAGES_QUERY, [document_hash])
+            logger.info(f'Data for document {document_name} written to db ({transaction_count} transactions).',
+                        module=Module.DB)
+
+        self.__write(_import, on_commit)
+
+    def save_page(self, document_hash: str, page_number: int, kind: str, result: str) -> None:
+        """
+        Checkpoints the llm response for a page of a document, so that an interrupted document
+        can be resumed without repeating the request. The write is asynchronous.
+        :param document_hash: the sha256 hex digest of the pdf file.
+        :param page_number: the number of the page.
+        :param kind: the kind of the extracted data, e.g. transactions or account_information.
+        :param result: the llm's response.
+        :return:
+        """
+        def _on_commit(error: Optional[Exception]) -> None:
+            if error is not None:
+                logger.error(f'Failed to checkpoint page {page_number} ({kind}). Trace:', error, module=Module.DB)
+
+        self.__write(
+            lambda: self.conn.execute(self.UPSERT_PAGE_QUERY, [document_hash, page_number, kind, result]),
+            _on_commit
+        )
+
+    def find_pages(self, document_hash: str) -> Dict[Tuple[int, str], str]:
+        """
+        Finds the checkpointed pages of a document.
+        :param document_hash: the sha256 hex digest of the pdf file.
+        :return: the llm responses by page number and kind.
+        """
+        rows: List[Tuple] = self.__get_reader().execute(self.FIND_PAGES_QUERY, [document_hash]).fetchall()
+        return {(row[0], row[1]): row[2] for row in rows}
+
+    def find_transactions(self, iban: str, start_date: str, end_date: str) -> List[Dict[str, any]]:
+        """
+        Finds the transactions of an account within a date range.
+        :param iban: the iban of the account.
+        :param start_date: first day of the range, YYYY-MM-DD.
+        :param end_date: last day of the range, YYYY-MM-DD.
+        :return: the transactions, ordered by date.
+        """
+        rows: List[Tuple] = self.__get_reader().execute(
+            self.FIND_TRANSACTIONS_QUERY,
+            [normalize_iban(iban), start_date, end_date]
+        ).fetchall()
+        return [
+            {
+                'iban': row[0],
+                'date': row[1],
+                'amount_cents': row[2],
+                'transaction_text': row[3],
+                'page_number': row[4],
+                'document_name': row[5]
+            } for row in rows
+        ]
+
+    def find_document_by_hash(self, document_hash: str) -> Optional[str]:
+        """
+        Looks up an imported document by the content hash of its pdf file.
+        :param document_hash: the sha256 hex digest of the pdf file.
+        :return: the name of the imported document, or None if the pdf is unknown.
+        """
+        row = self.__get_reader().execute(self.FIND_DOCUMENT_BY_HASH_QUERY, [document_hash]).fetchone()
+        return row[0] if row else None
 
     def __init__(self, db_path: str = DATABASE_PATH):
         """
@@ -79,19 +529,41 @@ class Database:
         """
         logger.info('Initializing DB handler...', module=Module.DB)
         self.DATABASE_PATH = db_path
+        self.batch_size: int = max(1, setup.DB_BATCH_SIZE)
+        self.flush_interval: float = setup.DB_FLUSH_INTERVAL
+        self.write_queue: queue.Queue = queue.Queue()
+        # One reader connection per thread, the writer connection is owned by the writer thread.
+        self.readers: threading.local = threading.local()
+        self.writer: threading.Thread = threading.Thread(target=self.__write_loop, name='db-writer', daemon=True)
         try:
-            self.conn: Connection = self._connect()
+            self.conn: Connection = self._connect(autocommit=True)
             self._apply_migrations()
+            self.writer.start()
+            atexit.register(self.close)
             logger.info('DB Handler initialized.', module=Module.DB)
         except Exception as e:
             logger.error('Failed to initialize DB handler. Trace:', e, module=Module.DB)
             exit(-1)
 
 
-# DB Handler singleton
-database: Database = Database()
+# DB Handler singleton, the database is opened and migrated on first use.
+_instance: Optional[Database] = None
+_instance_lock: threading.Lock = threading.Lock()
+
+
+def get_instance() -> Database:
+    """
+    DB Handler singleton.
+    :return: the Database singleton instance.
+    """
+    global _instance
+    if _instance is None:
+        with _instance_lock:
+            if _instance is None:
+                _instance = Database()
+    return _instance
 
 
 # Test only
 if __name__ == '__main__':
-    database.export_data()
\ No newline at end of file
+    get_instance().export_data()
\ No newline at end of file
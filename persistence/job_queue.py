@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from sqlite3 import Connection, Cursor
+from typing import Callable, Dict, List, Optional
+
+import setup
+from log_handling import log_handler
+from log_handling.log_handler import Logger, Module
+
+logger: Logger = log_handler.get_instance()
+
+# Job states.
+QUEUED: str = 'queued'
+LEASED: str = 'leased'
+DONE: str = 'done'
+DEAD: str = 'dead'
+
+
+class JobQueue(ABC):
+    """
+    Queue of the pdf files of the import directory, shared by all workers.
+    A worker claims a job with a lease and renews the lease with heartbeats while it processes the file.
+    Jobs whose lease expired, e.g. because their worker crashed, are claimed again by the next worker.
+    A job is retried on failure until it ran out of attempts, then it is dead-lettered.
+    Jobs are identified by the name of their pdf file, a file arriving again after its job finished is queued again.
+    """
+
+    @abstractmethod
+    def enqueue(self, name: str) -> bool:
+        """
+        Queues a pdf file, unless it already has a queued or leased job.
+        :param name: the file name of the pdf in the import directory.
+        :return: whether a job was queued.
+        """
+
+    @abstractmethod
+    def claim(self, worker: str, lease_seconds: float) -> Optional[Dict[str, any]]:
+        """
+        Claims the oldest queued job, or a job whose lease expired, and counts the attempt.
+        :param worker: the id of the claiming worker.
+        :param lease_seconds: duration of the lease.
+        :return: the job (id, name and attempts), or None if no job is available.
+        """
+
+    @abstractmethod
+    def heartbeat(self, job_ids: List[int], worker: str, lease_seconds: float) -> int:
+        """
+        Renews the leases of jobs of a worker.
+        :param job_ids: the ids of the jobs.
+        :param worker: the id of the worker holding the leases.
+        :param lease_seconds: duration of the renewed leases.
+        :return: the number of renewed leases.
+        """
+
+    @abstractmethod
+    def complete(self, job_id: int, worker: str) -> bool:
+        """
+        Acknowledges a processed job.
+        :param job_id: the id of the job.
+        :param worker: the id of the worker holding the lease.
+        :return: whether the worker still held the lease.
+        """
+
+    @abstractmethod
+    def fail(self, job_id: int, worker: str, error: str, retry: bool) -> bool:
+        """
+        Reports a failed job, which is queued again or dead-lettered.
+        :param job_id: the id of the job.
+        :param worker: the id of the worker holding the lease.
+        :param error: the error message, kept with the job.
+        :param retry: whether the job is queued again, otherwise it is dead-lettered.
+        :return: whether the worker still held the lease.
+        """
+
+    @abstractmethod
+    def count_jobs(self) -> Dict[str, int]:
+        """
+        Get the number of jobs in each state.
+        :return: the number of jobs by state.
+        """
+
+
+class SQLiteJobQueue(JobQueue):
+    """
+    Job queue in a local sqlite database, shared by the worker processes of a host or of containers
+    mounting the same volume. Sqlite locking is not reliable on network file systems,
+    workers on several nodes need a backend on a shared server.
+    Every operation is a single transaction, so that the claims of concurrent workers are serialized by sqlite.
+    """
+    BUSY_TIMEOUT_MS: int = 30000
+    CREATE_TABLE_QUERY: str = '''
+        CREATE TABLE IF NOT EXISTS JOBS (
+            ID INTEGER PRIMARY KEY AUTOINCREMENT,
+            NAME TEXT NOT NULL UNIQUE,
+            STATE TEXT NOT NULL,
+            ATTEMPTS INTEGER NOT NULL DEFAULT 0,
+            WORKER TEXT,
+            LEASE_UNTIL REAL,
+            LAST_ERROR TEXT,
+            UPDATED_AT REAL NOT NULL
+        )
+    '''
+    CREATE_INDEX_QUERY: str = 'CREATE INDEX IF NOT EXISTS JOBS_STATE ON JOBS (STATE, LEASE_UNTIL)'
+    ENQUEUE_QUERY: str = f'''
+        INSERT INTO JOBS (NAME, STATE, UPDATED_AT) VALUES (?, '{QUEUED}', ?)
+        ON CONFLICT (NAME) DO UPDATE SET
+            STATE = '{QUEUED}', ATTEMPTS = 0, WORKER = NULL, LEASE_UNTIL = NULL, LAST_ERROR = NULL,
+            UPDATED_AT = EXCLUDED.UPDATED_AT
+        WHERE STATE IN ('{DONE}', '{DEAD}')
+    '''
+    CLAIM_QUERY: str = f'''
+        UPDATE JOBS SET STATE = '{LEASED}', ATTEMPTS = ATTEMPTS + 1, WORKER = ?, LEASE_UNTIL = ?, UPDATED_AT = ?
+        WHERE ID = (
+            SELECT ID FROM JOBS
+            WHERE STATE = '{QUEUED}' OR (STATE = '{LEASED}' AND LEASE_UNTIL < ?)
+            ORDER BY ID LIMIT 1
+        )
+        RETURNING ID, NAME, ATTEMPTS
+    '''
+    HEARTBEAT_QUERY: str = f"UPDATE JOBS SET LEASE_UNTIL = ? WHERE ID = ? AND WORKER = ? AND STATE = '{LEASED}'"
+    FINISH_QUERY: str = f'''
+        UPDATE JOBS SET STATE = ?, LEASE_UNTIL = NULL, LAST_ERROR = ?, UPDATED_AT = ?
+        WHERE ID = ? AND WORKER = ? AND STATE = '{LEASED}'
+    '''
+    COUNT_QUERY: str = 'SELECT STATE, COUNT(*) FROM JOBS GROUP BY STATE'
+
+    def enqueue(self, name: str) -> bool:
+        return self.__execute(self.ENQUEUE_QUERY, [name, time.time()]).rowcount > 0
+
+    def claim(self, worker: str, lease_seconds: float) -> Optional[Dict[str, any]]:
+        now: float = time.time()
+        with self.lock:
+            # Fetches all rows, the claim is only committed once the statement is done.
+            rows = self.conn.execute(self.CLAIM_QUERY, [worker, now + lease_seconds, now, now]).fetchall()
+        if not rows:
+            return None
+        return {'id': rows[0][0], 'name': rows[0][1], 'attempts': rows[0][2]}
+
+    def heartbeat(self, job_ids: List[int], worker: str, lease_seconds: float) -> int:
+        if not job_ids:
+            return 0
+        lease_until: float = time.time() + lease_seconds
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                renewed: int = self.conn.executemany(
+                    self.HEARTBEAT_QUERY, [(lease_until, job_id, worker) for job_id in job_ids]
+                ).rowcount
+                self.conn.execute('COMMIT')
+            except Exception:
+                self.conn.execute('ROLLBACK')
+                raise
+        return renewed
+
+    def complete(self, job_id: int, worker: str) -> bool:
+        return self.__execute(self.FINISH_QUERY, [DONE, None, time.time(), job_id, worker]).rowcount > 0
+
+    def fail(self, job_id: int, worker: str, error: str, retry: bool) -> bool:
+        state: str = QUEUED if retry else DEAD
+        return self.__execute(self.FINISH_QUERY, [state, error, time.time(), job_id, worker]).rowcount > 0
+
+    def count_jobs(self) -> Dict[str, int]:
+        with self.lock:
+            return {state: count for state, count in self.conn.execute(self.COUNT_QUERY).fetchall()}
+
+    def __execute(self, query: str, parameters: list) -> Cursor:
+        """
+        Runs a statement in its own transaction.
+        :param query: the sql statement.
+        :param parameters: the parameters of the statement.
+        :return: the cursor of the statement.
+        """
+        with self.lock:
+            return self.conn.execute(query, parameters)
+
+    def __init__(self, db_path: str = setup.JOB_QUEUE_PATH):
+        """
+        Default constructor.
+        :param db_path: path to the queue database, default: export/jobs.db.
+        """
+        self.lock: threading.Lock = threading.Lock()
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        # Shared by the worker threads, access is serialized by the lock. Autocommit, every statement commits.
+        self.conn: Connection = sqlite3.connect(db_path, isolation_level=None, check_same_thread=False)
+        self.conn.execute(f'PRAGMA busy_timeout = {self.BUSY_TIMEOUT_MS}')
+        self.conn.execute('PRAGMA journal_mode = WAL')
+        self.conn.execute(self.CREATE_TABLE_QUERY)
+        self.conn.execute(self.CREATE_INDEX_QUERY)
+        logger.info(f'Job queue "{db_path}" opened.', module=Module.QUEUE)
+
+
+# Job queue backends by name, selected by JOB_QUEUE_BACKEND. Other backends register here.
+BACKENDS: Dict[str, Callable[[], JobQueue]] = {
+    'sqlite': SQLiteJobQueue
+}
+
+# Job queue singleton, opened on first use.
+_instance: Optional[JobQueue] = None
+_instance_lock: threading.Lock = threading.Lock()
+
+
+def get_instance() -> JobQueue:
+    """
+    Job queue singleton, of the backend configured by JOB_QUEUE_BACKEND.
+    :return: the JobQueue singleton instance.
+    """
+    global _instance
+    if _instance is None:
+        with _instance_lock:
+            if _instance is None:
+                if setup.JOB_QUEUE_BACKEND not in BACKENDS:
+                    raise ValueError(f'Unknown job queue backend "{setup.JOB_QUEUE_BACKEND}", '
+                                     f'available: {", ".join(BACKENDS)}.')
+                _instance = BACKENDS[setup.JOB_QUEUE_BACKEND]()
+    return _instance
@@ -0,0 +1,2 @@
+ALTER TABLE DOCUMENTS ADD COLUMN DOCUMENT_HASH TEXT;
+CREATE INDEX IF NOT EXISTS DOCUMENTS_DOCUMENT_HASH ON DOCUMENTS (DOCUMENT_HASH)
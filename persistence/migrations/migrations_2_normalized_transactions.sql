@@ -0,0 +1,25 @@
+CREATE TABLE IF NOT EXISTS ACCOUNTS (
+    ID INTEGER PRIMARY KEY AUTOINCREMENT,
+    IBAN TEXT NOT NULL UNIQUE,
+    NAME TEXT
+);
+CREATE TABLE IF NOT EXISTS STATEMENTS (
+    ID INTEGER PRIMARY KEY AUTOINCREMENT,
+    DOCUMENT_ID INTEGER NOT NULL UNIQUE REFERENCES DOCUMENTS (ID),
+    ACCOUNT_ID INTEGER REFERENCES ACCOUNTS (ID),
+    DOCUMENT_DATE TEXT,
+    PREVIOUS_BALANCE_CENTS INTEGER,
+    NEW_BALANCE_CENTS INTEGER
+);
+CREATE TABLE IF NOT EXISTS TRANSACTIONS (
+    ID INTEGER PRIMARY KEY AUTOINCREMENT,
+    STATEMENT_ID INTEGER NOT NULL REFERENCES STATEMENTS (ID),
+    ACCOUNT_ID INTEGER REFERENCES ACCOUNTS (ID),
+    PAGE_NUMBER INTEGER NOT NULL,
+    TRANSACTION_DATE TEXT,
+    AMOUNT_CENTS INTEGER,
+    TRANSACTION_TEXT TEXT
+);
+CREATE INDEX IF NOT EXISTS STATEMENTS_ACCOUNT_DATE ON STATEMENTS (ACCOUNT_ID, DOCUMENT_DATE);
+CREATE INDEX IF NOT EXISTS TRANSACTIONS_ACCOUNT_DATE ON TRANSACTIONS (ACCOUNT_ID, TRANSACTION_DATE);
+CREATE INDEX IF NOT EXISTS TRANSACTIONS_STATEMENT ON TRANSACTIONS (STATEMENT_ID)
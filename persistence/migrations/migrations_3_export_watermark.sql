@@ -0,0 +1,3 @@
+ALTER TABLE DOCUMENTS ADD COLUMN UPDATED_AT TEXT;
+ALTER TABLE DOCUMENTS ADD COLUMN EXPORTED_AT TEXT;
+CREATE INDEX IF NOT EXISTS DOCUMENTS_EXPORTED_AT ON DOCUMENTS (EXPORTED_AT)
@@ -0,0 +1,8 @@
+CREATE TABLE IF NOT EXISTS PAGES (
+    DOCUMENT_HASH TEXT NOT NULL,
+    PAGE_NUMBER INTEGER NOT NULL,
+    KIND TEXT NOT NULL,
+    RESULT TEXT NOT NULL,
+    CREATED_AT TEXT NOT NULL DEFAULT (STRFTIME('%Y-%m-%dT%H:%M:%f', 'NOW')),
+    PRIMARY KEY (DOCUMENT_HASH, PAGE_NUMBER, KIND)
+)
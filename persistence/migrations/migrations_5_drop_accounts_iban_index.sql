@@ -0,0 +1 @@
+DROP INDEX IF EXISTS ACCOUNTS_IBAN
@@ -0,0 +1,3 @@
+UPDATE DOCUMENTS SET EXPORTED_AT = NULL WHERE EXPORTED_AT < UPDATED_AT;
+DROP INDEX IF EXISTS DOCUMENTS_EXPORTED_AT;
+CREATE INDEX IF NOT EXISTS DOCUMENTS_UNEXPORTED ON DOCUMENTS (ID) WHERE EXPORTED_AT IS NULL
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+import re
+from datetime import date
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from typing import Optional, Dict, List
+
+# German and english month names and abbreviations.
+MONTHS: Dict[str, int] = {
+    'jan': 1, 'januar': 1, 'january': 1,
+    'feb': 2, 'februar': 2, 'february': 2,
+    'mär': 3, 'mar': 3, 'märz': 3, 'march': 3,
+    'apr': 4, 'april': 4,
+    'mai': 5, 'may': 5,
+    'jun': 6, 'juni': 6, 'june': 6,
+    'jul': 7, 'juli': 7, 'july': 7,
+    'aug': 8, 'august': 8,
+    'sep': 9, 'sept': 9, 'september': 9,
+    'okt': 10, 'oct': 10, 'oktober': 10, 'october': 10,
+    'nov': 11, 'november': 11,
+    'dez': 12, 'dec': 12, 'dezember': 12, 'december': 12,
+}
+ISO_DATE: re.Pattern = re.compile(r'(\d{4})[-/.](\d{1,2})[-/.](\d{1,2})')
+NUMERIC_DATE: re.Pattern = re.compile(r'(\d{1,2})[./](\d{1,2})[./]?(\d{2,4})?')
+TEXT_DATE: re.Pattern = re.compile(r'(\d{1,2})\.?\s*([A-Za-zäÄ]+)\.?\s*(\d{2,4})?')
+AMOUNT: re.Pattern = re.compile(r'[\d.,\' ]*\d')
+# Debit markers after the amount: a minus, "S" (Soll) or "DR" as a word of their own, not the start of e.g. SEK.
+DEBIT_MARKER: re.Pattern = re.compile(r'-|(?:S|DR)\b')
+
+
+def _to_iso_date(year: Optional[int], month: int, day: int) -> Optional[str]:
+    """
+    Builds an iso date, if the date is valid.
+    :param year: the year, two digit years are in the 2000s.
+    :param month: the month.
+    :param day: the day.
+    :return: the date as YYYY-MM-DD, or None.
+    """
+    if year is None:
+        return None
+    if year < 100:
+        year += 2000
+    try:
+        return date(year, month, day).isoformat()
+    except ValueError:
+        return None
+
+
+def normalize_date(value: any, reference_year: Optional[int] = None) -> Optional[str]:
+    """
+    Normalizes a date as returned by the llm, e.g. 01.02.2023, 01.02.23, 01.02., 2023-02-01 or 1. Feb 2023.
+    :param value: the date.
+    :param reference_year: the year for dates without a year, usually the year of the statement.
+    :return: the date as YYYY-MM-DD, or None if it could not be parsed.
+    """
+    if not isinstance(value, str) or not value.strip():
+        return None
+    value = value.strip()
+    match: Optional[re.Match] = ISO_DATE.search(value)
+    if match:
+        return _to_iso_date(int(match.group(1)), int(match.group(2)), int(match.group(3)))
+    match = NUMERIC_DATE.search(value)
+    if match:
+        year: Optional[int] = int(match.group(3)) if match.group(3) else reference_year
+        return _to_iso_date(year, int(match.group(2)), int(match.group(1)))
+    match = TEXT_DATE.search(value)
+    if match and match.group(2).lower() in MONTHS:
+        year = int(match.group(3)) if match.group(3) else reference_year
+        return _to_iso_date(year, MONTHS[match.group(2).lower()], int(match.group(1)))
+    return None
+
+
+def normalize_amount(value: any) -> Optional[int]:
+    """
+    Normalizes an amount as returned by the llm to integer cents,
+    e.g. -1.234,56 EUR, 1.234,56 S, 1,234.56-, +12,5 or 12.
+    :param value: the amount.
+    :return: the amount in cents, or None if it could not be parsed.
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return int((Decimal(str(value)) * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+    if not isinstance(value, str):
+        return None
+    text: str = value.strip()
+    match: Optional[re.Match] = AMOUNT.search(text)
+    if not match:
+        return None
+    number: str = match.group(0).replace(' ', '').replace('\'', '')
+    before: str = text[:match.start()]
+    after: str = text[match.end():].strip().upper()
+    # Debit markers: leading or trailing minus, "S" (Soll) or "DR" after the amount.
+    negative: bool = '-' in before or DEBIT_MARKER.match(after) is not None
+    number = _normalize_separators(number)
+    try:
+        cents: int = int((Decimal(number) * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+    except InvalidOperation:
+        return None
+    return -cents if negative else cents
+
+
+def _normalize_separators(number: str) -> str:
+    """
+    Converts german and english number formatting to a plain decimal number.
+    The last separator is the decimal separator if at most two digits follow it, otherwise all are thousands.
+    :param number: the number with separators, e.g. 1.234,56 or 1,234.56.
+    :return: the plain number, e.g. 1234.56.
+    """
+    separators: List[int] = [i for i, c in enumerate(number) if c in '.,']
+    if not separators:
+        return number
+    last: int = separators[-1]
+    decimals: str = number[last + 1:]
+    integer: str = number[:last].replace('.', '').replace(',', '')
+    if 0 < len(decimals) <= 2:
+        return f'{integer or "0"}.{decimals}'
+    return integer + decimals
+
+
+def normalize_iban(value: any) -> Optional[str]:
+    """
+    Normalizes an iban by removing whitespace and converting it to upper case.
+    :param value: the iban.
+    :return: the normalized iban, or None if it is missing.
+    """
+    if not isinstance(value, str):
+        return None
+    iban: str = re.sub(r'\s+', '', value).upper()
+    return iban or None
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+import queue
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from log_handling import log_handler
+from log_handling.log_handler import Logger, Module
+from metrics_handling import metrics_handler
+from metrics_handling.metrics_handler import Metrics
+
+logger: Logger = log_handler.get_instance()
+metrics: Metrics = metrics_handler.get_instance()
+
+# Marks the end of the input for a stage worker.
+_END = object()
+
+
+class Pipeline:
+    """
+    Runs jobs through a chain of stages, each stage with its own pool of worker threads.
+    Stages are joined by bounded queues: a stage blocks as soon as the queue to the next stage is full,
+    so the input is only consumed at the rate of the slowest stage (explicit back-pressure).
+    Finished and failed jobs are handed to the sink, which runs in the calling thread.
+    """
+
+    def __init__(self, queue_size: int = 2):
+        """
+        Default constructor.
+        :param queue_size: maximum number of jobs waiting between two stages.
+        """
+        self.queue_size: int = max(1, queue_size)
+        self.stages: List[Tuple[str, Callable[[Dict[str, any]], Dict[str, any]], int]] = []
+
+    def add_stage(self, name: str, function: Callable[[Dict[str, any]], Dict[str, any]], workers: int = 1):
+        """
+        Appends a stage to the pipeline.
+        :param name: name of the stage, used for logging and thread names.
+        :param function: the stage function, takes a job and returns the job for the next stage.
+        :param workers: number of worker threads for the stage.
+        :return: the pipeline, for chaining.
+        """
+        self.stages.append((name, function, max(1, workers)))
+        return self
+
+    @staticmethod
+    def __feed(jobs: Iterable[Dict[str, any]], target: queue.Queue, workers: int) -> None:
+        """
+        Puts the input jobs into the first stage queue, blocking while the queue is full.
+        :param jobs: the input jobs.
+        :param target: queue of the first stage.
+        :param workers: number of workers of the first stage.
+        :return:
+        """
+        try:
+            for job in jobs:
+                target.put((job, None))
+        except Exception as e:
+            logger.error('Error reading pipeline input. Trace:', e, module=Module.PIPE)
+        finally:
+            for _ in range(workers):
+                target.put(_END)
+
+    def __work(
+            self,
+            name: str,
+            function: Callable[[Dict[str, any]], Dict[str, any]],
+            source: queue.Queue,
+            target: queue.Queue,
+            sink: queue.Queue,
+            finished: Dict[str, int],
+            lock: threading.Lock,
+            workers: int,
+            next_workers: int
+    ) -> None:
+        """
+        Worker loop of a stage. Failed jobs skip the remaining stages and go straight to the sink.
+        The last worker of a stage to finish signals the end of input to the next stage.
+        """
+        while True:
+            item = source.get()
+            if item is _END:
+                break
+            job, _ = item
+            metrics.set('pipeline_queue_depth', source.qsize(), stage=name)
+            try:
+                with metrics.time('pipeline_stage_seconds', in_flight='pipeline_stage_in_flight', stage=name):
+                    job = function(job)
+                target.put((job, None))
+            except Exception as e:
+                logger.error(f'Pipeline stage "{name}" failed. Trace:', e, module=Module.PIPE)
+                sink.put((job, e))
+        with lock:
+            finished[name] += 1
+            last: bool = finished[name] == workers
+        if last:
+            for _ in range(next_workers):
+                target.put(_END)
+
+    def run(self, jobs: Iterable[Dict[str, any]], sink: Callable[[Dict[str, any], Optional[Exception]], None]) -> None:
+        """
+        Runs all jobs through the pipeline and blocks until every job reached the sink.
+        :param jobs: the input jobs, may be a lazy iterable.
+        :param sink: called in the calling thread for each job with the job and the error, if a stage failed.
+        :return:
+        """
+        if not self.stages:
+            raise Exception('Pipeline has no stages.')
+        queues: List[queue.Queue] = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        # The sink queue is unbounded: failed jobs must never block a worker.
+        sink_queue: queue.Queue = queue.Queue()
+        finished: Dict[str, int] = {name: 0 for name, _, _ in self.stages}
+        lock: threading.Lock = threading.Lock()
+        threads: List[threading.Thread] = [
+            threading.Thread(
+                target=self.__feed,
+                args=(jobs, queues[0], self.stages[0][2]),
+                name='pipeline-feed',
+                daemon=True
+            )
+        ]
+        for i, (name, function, workers) in enumerate(self.stages):
+            last_stage: bool = i == len(self.stages) - 1
+            target: queue.Queue = sink_queue if last_stage else queues[i + 1]
+            next_workers: int = 1 if last_stage else self.stages[i + 1][2]
+            for n in range(workers):
+                threads.append(threading.Thread(
+                    target=self.__work,
+                    args=(name, function, queues[i], target, sink_queue, finished, lock, workers, next_workers),
+                    name=f'pipeline-{name}-{n}',
+                    daemon=True
+                ))
+        for thread in threads:
+            thread.start()
+        while True:
+            item = sink_queue.get()
+            if item is _END:
+                break
+            job, error = item
+            try:
+                sink(job, error)
+            except Exception as e:
+                logger.error('Pipeline sink failed. Trace:', e, module=Module.PIPE)
+        for thread in threads:
+            thread.join()
@@ -23,11 +23,100 @@ required_dirs: List[str] = [
     IMAGE_DIR
 ]
 
+# Processing
+# Maximum number of concurrent llm requests per pdf document.
+OCR_WORKERS: int = int(os.getenv('OCR_WORKERS') or 4)
+# Number of pdf documents rasterized concurrently.
+RASTER_WORKERS: int = int(os.getenv('RASTER_WORKERS') or 1)
+# Number of processes rendering pdf pages, shared by all documents.
+RASTER_PROCESSES: int = int(os.getenv('RASTER_PROCESSES') or os.cpu_count() or 1)
+# Number of pages rendered at once by a raster process, bounds the memory of the rendered pages.
+RASTER_CHUNK_SIZE: int = int(os.getenv('RASTER_CHUNK_SIZE') or 8)
+# Number of pdf documents in the llm extraction stage concurrently.
+DOCUMENT_WORKERS: int = int(os.getenv('DOCUMENT_WORKERS') or 2)
+# Maximum number of documents waiting between two pipeline stages.
+PIPELINE_QUEUE_SIZE: int = int(os.getenv('PIPELINE_QUEUE_SIZE') or 2)
+# Render and encode the pdf pages in memory instead of writing them to the image directory.
+RASTERIZE_IN_MEMORY: bool = (os.getenv('RASTERIZE_IN_MEMORY') or '').lower() in ('1', 'true', 'yes')
+# Number of consecutive pages sent to the llm in one request, 1 sends every page in its own request.
+PAGES_PER_REQUEST: int = int(os.getenv('PAGES_PER_REQUEST') or 1)
+# Number of times a page is requested again if the llm's response is not valid json.
+JSON_RETRIES: int = int(os.getenv('JSON_RETRIES') or 2)
+# Use the text layer of digitally generated pdf pages instead of sending page images.
+TEXT_LAYER: bool = (os.getenv('TEXT_LAYER') or 'true').lower() in ('1', 'true', 'yes')
+# Minimum number of non-whitespace characters for a usable text layer.
+TEXT_LAYER_MIN_CHARS: int = int(os.getenv('TEXT_LAYER_MIN_CHARS') or 100)
+# Maximum size of the llm response cache in bytes, 0 disables the cache.
+RESPONSE_CACHE_MAX_BYTES: int = int(os.getenv('RESPONSE_CACHE_MAX_BYTES') or 256 * 1024 * 1024)
+# Maximum number of documents written to the database in one transaction.
+DB_BATCH_SIZE: int = int(os.getenv('DB_BATCH_SIZE') or 16)
+# Maximum time in seconds a database write waits for more writes to batch with.
+DB_FLUSH_INTERVAL: float = float(os.getenv('DB_FLUSH_INTERVAL') or 0.5)
+# Page cache size of each database connection in KiB.
+DB_CACHE_KIB: int = int(os.getenv('DB_CACHE_KIB') or 65536)
+
+# Page images
+# Resolution the pdf pages are rendered with.
+IMAGE_DPI: int = int(os.getenv('IMAGE_DPI') or 200)
+# Maximum long edge of the uploaded page images in pixels, aligned down to the model's tiles.
+IMAGE_MAX_EDGE: int = int(os.getenv('IMAGE_MAX_EDGE') or 2048)
+# Upload the page images in grayscale.
+IMAGE_GRAYSCALE: bool = (os.getenv('IMAGE_GRAYSCALE') or '').lower() in ('1', 'true', 'yes')
+# Format of the uploaded page images: png (lossless), jpeg or webp.
+IMAGE_FORMAT: str = (os.getenv('IMAGE_FORMAT') or 'png').lower()
+# Quality of jpeg and webp page images.
+IMAGE_QUALITY: int = int(os.getenv('IMAGE_QUALITY') or 85)
+# Crop the pages to their content and the cover page to its header block for the account info request.
+CROP_PAGES: bool = (os.getenv('CROP_PAGES') or '').lower() in ('1', 'true', 'yes')
+# Skip pages without transactions before the llm requests.
+PAGE_FILTER: bool = (os.getenv('PAGE_FILTER') or '').lower() in ('1', 'true', 'yes')
+# Scanned pages with fewer text lines are skipped by the page filter.
+PAGE_FILTER_MIN_LINES: int = int(os.getenv('PAGE_FILTER_MIN_LINES') or 3)
+
+# Watch mode
+# Seconds between two scans of the import directory, if inotify is not available.
+WATCH_POLL_INTERVAL: float = float(os.getenv('WATCH_POLL_INTERVAL') or 2)
+# Seconds a new pdf file must remain unchanged before it is processed.
+WATCH_SETTLE_SECONDS: float = float(os.getenv('WATCH_SETTLE_SECONDS') or 2)
+# Seconds between two csv exports.
+WATCH_EXPORT_INTERVAL: float = float(os.getenv('WATCH_EXPORT_INTERVAL') or 10)
+
+# Worker mode
+# Backend of the job queue shared by the workers, see persistence/job_queue.py.
+JOB_QUEUE_BACKEND: str = os.getenv('JOB_QUEUE_BACKEND') or 'sqlite'
+# Path of the sqlite job queue, on the volume shared by all workers.
+JOB_QUEUE_PATH: str = os.getenv('JOB_QUEUE_PATH') or os.path.join(EXPORT_DIR, 'jobs.db')
+# Seconds a claimed job stays with its worker without a heartbeat, then other workers may claim it.
+JOB_LEASE_SECONDS: float = float(os.getenv('JOB_LEASE_SECONDS') or 120)
+# Seconds between two heartbeats of a worker, well below the lease.
+JOB_HEARTBEAT_INTERVAL: float = float(os.getenv('JOB_HEARTBEAT_INTERVAL') or 30)
+# Number of times a job is attempted before it is dead-lettered.
+JOB_MAX_ATTEMPTS: int = int(os.getenv('JOB_MAX_ATTEMPTS') or 3)
+# Seconds between two claims while the job queue is empty.
+JOB_POLL_INTERVAL: float = float(os.getenv('JOB_POLL_INTERVAL') or 2)
+
+# Metrics
+# Port of the prometheus metrics endpoint (/metrics), 0 disables the endpoint.
+METRICS_PORT: int = int(os.getenv('METRICS_PORT') or 0)
+# Path of the periodic json metrics snapshot, empty disables the snapshots.
+METRICS_SNAPSHOT_PATH: str = os.getenv('METRICS_SNAPSHOT_PATH') or ''
+# Seconds between two json metrics snapshots.
+METRICS_SNAPSHOT_INTERVAL: float = float(os.getenv('METRICS_SNAPSHOT_INTERVAL') or 15)
+
 # GPT
 OPENAI_API_KEY: str = os.getenv("OPENAI_API_KEY")
-if not OPENAI_API_KEY:
-    logger.error('OPENAI_API_KEY not set, terminating.', module=Module.SETUP)
-    exit(-1)
+
+
+def check_openai_api_key():
+    """
+    Checks that the OpenAI API key is set, before anything is sent to the llm.
+    Exports and other commands without llm requests run without a key.
+    :return:
+    Exits if the key is missing.
+    """
+    if not OPENAI_API_KEY:
+        logger.error('OPENAI_API_KEY not set, terminating.', module=Module.SETUP)
+        exit(-1)
 
 
 def create_dirs():
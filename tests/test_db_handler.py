@@ -0,0 +1,50 @@
+import os
+import tempfile
+import unittest
+
+from persistence.db_handler import Database
+
+
+class UnexportedDocumentsTest(unittest.TestCase):
+    """
+    Tests the export watermark of the documents.
+    """
+
+    def setUp(self) -> None:
+        self.workdir: tempfile.TemporaryDirectory = tempfile.TemporaryDirectory()
+        self.database: Database = Database(os.path.join(self.workdir.name, 'database.db'))
+
+    def tearDown(self) -> None:
+        self.database.close()
+        self.database.conn.close()
+        self.workdir.cleanup()
+
+    def __import(self, name: str) -> None:
+        self.database.import_pdf_data({'pdf_path': name, 'pdf_hash': name})
+        self.database.flush()
+
+    def test_query_uses_index(self) -> None:
+        plan: str = str(self.database.conn.execute(
+            'EXPLAIN QUERY PLAN ' + Database.UNEXPORTED_DOCUMENTS_QUERY
+        ).fetchall())
+        self.assertIn('USING INDEX DOCUMENTS_UNEXPORTED', plan)
+
+    def test_exported_documents_are_skipped(self) -> None:
+        self.__import('a.pdf')
+        self.__import('b.pdf')
+        first = next(self.database.iter_unexported_documents())
+        self.database.mark_document_exported(first['document_id'], first['updated_at'])
+        self.database.flush()
+        names = [document['document_name'] for document in self.database.iter_unexported_documents()]
+        self.assertEqual(names, ['b.pdf'])
+
+    def test_changed_documents_stay_unexported(self) -> None:
+        self.__import('a.pdf')
+        document = next(self.database.iter_unexported_documents())
+        self.database.mark_document_exported(document['document_id'], '1970-01-01T00:00:00.000')
+        self.database.flush()
+        self.assertEqual(len(list(self.database.iter_unexported_documents())), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
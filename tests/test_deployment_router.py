@@ -0,0 +1,33 @@
+import unittest
+from typing import Dict, List
+
+from ai.deployment_router import DeploymentRouter
+from ai.rate_limiter import RateLimiter
+
+
+def _deployments(*weights: float) -> List[Dict[str, any]]:
+    return [
+        {'name': f'deployment {i}', 'weight': weight, 'llm': None, 'rate_limiter': RateLimiter()}
+        for i, weight in enumerate(weights)
+    ]
+
+
+class DeploymentRouterTest(unittest.TestCase):
+    """
+    Tests the routing of the requests across the deployments.
+    """
+
+    def test_requests_are_spread_by_weight(self) -> None:
+        router: DeploymentRouter = DeploymentRouter(_deployments(2, 1))
+        with router.route(100) as first, router.route(100) as second, router.route(100) as third:
+            self.assertEqual([first['name'], second['name'], third['name']],
+                             ['deployment 0', 'deployment 1', 'deployment 0'])
+
+    def test_weights_must_be_positive(self) -> None:
+        for weight in (0, -1, float('nan')):
+            with self.assertRaises(ValueError):
+                DeploymentRouter(_deployments(1, weight))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import unittest
+from typing import Dict
+from unittest import mock
+
+from PIL import Image, ImageDraw
+
+import pdf_processor
+from image_handling.layout_handler import LayoutHandler
+from image_handling.page_filter import PageFilter
+
+
+def _draw_page(lines: int, header: bool = False) -> Image.Image:
+    """
+    Draws a white page with black bars as text lines.
+    :param lines: the number of text lines of the body.
+    :param header: whether the page starts with a header block, separated by a large gap.
+    :return: the page.
+    """
+    image: Image.Image = Image.new('RGB', (1000, 1400), 'white')
+    draw: ImageDraw.ImageDraw = ImageDraw.Draw(image)
+    if header:
+        for top in (100, 130):
+            draw.rectangle((100, top, 500, top + 12), fill='black')
+    for line in range(lines):
+        top: int = 400 + line * 40
+        draw.rectangle((100, top, 900, top + 12), fill='black')
+    return image
+
+
+class PageFilterTest(unittest.TestCase):
+    """
+    Tests the skip reasons of scanned pages.
+    """
+
+    def setUp(self) -> None:
+        self.layout_handler: LayoutHandler = LayoutHandler(crop_pages=True)
+        self.page_filter: PageFilter = PageFilter(enabled=True, min_lines=3)
+
+    def __get_skip_reason(self, image: Image.Image):
+        return self.page_filter.get_image_skip_reason(self.layout_handler.analyze(image))
+
+    def test_skip_reasons(self) -> None:
+        self.assertEqual(self.__get_skip_reason(_draw_page(lines=0)), 'blank')
+        self.assertEqual(self.__get_skip_reason(_draw_page(lines=2)), 'sparse')
+        self.assertIsNone(self.__get_skip_reason(_draw_page(lines=10)))
+        self.assertEqual(self.__get_skip_reason(Image.new('RGB', (1000, 1400), 'black')), 'picture')
+
+    def test_min_lines_is_read_at_construction(self) -> None:
+        self.page_filter = PageFilter(enabled=True, min_lines=1)
+        self.assertIsNone(self.__get_skip_reason(_draw_page(lines=2)))
+
+
+class LayoutHandlerTest(unittest.TestCase):
+    """
+    Tests the crops of the pages.
+    """
+
+    def test_cover_page_is_split_at_the_header(self) -> None:
+        layout_handler: LayoutHandler = LayoutHandler(crop_pages=True)
+        image: Image.Image = _draw_page(lines=5, header=True)
+        layout: Dict[str, any] = layout_handler.analyze(image)
+        header: Image.Image = layout_handler.crop_header(image, layout)
+        transactions: Image.Image = layout_handler.crop_transactions(image, layout, cover_page=True)
+        self.assertLess(header.height, 100)
+        self.assertLess(transactions.height, 250)
+        self.assertGreater(transactions.width, header.width)
+
+    def test_page_is_analysed_once(self) -> None:
+        layout_handler: LayoutHandler = LayoutHandler(crop_pages=True)
+        patches = [
+            mock.patch.object(pdf_processor, 'layout_handler', layout_handler),
+            mock.patch.object(pdf_processor, 'page_filter', PageFilter(enabled=True)),
+            mock.patch.object(pdf_processor, '_encode_page', return_value={}),
+            mock.patch.object(layout_handler, 'analyze', wraps=layout_handler.analyze)
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        pdf_processor._prepare_page(_draw_page(lines=5, header=True), page_number=0, workdir='')
+        layout_handler.analyze.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
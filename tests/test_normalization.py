@@ -0,0 +1,50 @@
+import unittest
+
+from persistence.normalization import normalize_amount, normalize_date
+
+
+class NormalizeAmountTest(unittest.TestCase):
+    """
+    Tests the normalization of the amounts returned by the llm.
+    """
+
+    def test_formats(self) -> None:
+        self.assertEqual(normalize_amount('1.234,56 EUR'), 123456)
+        self.assertEqual(normalize_amount('1,234.56'), 123456)
+        self.assertEqual(normalize_amount('+12,5'), 1250)
+        self.assertEqual(normalize_amount('12'), 1200)
+        self.assertEqual(normalize_amount(12.34), 1234)
+        self.assertIsNone(normalize_amount('n/a'))
+
+    def test_debit_markers(self) -> None:
+        self.assertEqual(normalize_amount('-1.234,56 EUR'), -123456)
+        self.assertEqual(normalize_amount('1.234,56 S'), -123456)
+        self.assertEqual(normalize_amount('1.234,56S'), -123456)
+        self.assertEqual(normalize_amount('1,234.56 DR'), -123456)
+        self.assertEqual(normalize_amount('1,234.56-'), -123456)
+        self.assertEqual(normalize_amount('1.234,56 H'), 123456)
+
+    def test_currency_codes_are_not_debit_markers(self) -> None:
+        self.assertEqual(normalize_amount('100 SEK'), 10000)
+        self.assertEqual(normalize_amount('100,00 SGD'), 10000)
+        self.assertEqual(normalize_amount('100.00 sek'), 10000)
+        self.assertEqual(normalize_amount('100,00 DKK'), 10000)
+        self.assertEqual(normalize_amount('-100 SEK'), -10000)
+
+
+class NormalizeDateTest(unittest.TestCase):
+    """
+    Tests the normalization of the dates returned by the llm.
+    """
+
+    def test_formats(self) -> None:
+        self.assertEqual(normalize_date('01.02.2023'), '2023-02-01')
+        self.assertEqual(normalize_date('01.02.23'), '2023-02-01')
+        self.assertEqual(normalize_date('01.02.', reference_year=2023), '2023-02-01')
+        self.assertEqual(normalize_date('2023-02-01'), '2023-02-01')
+        self.assertEqual(normalize_date('1. Feb 2023'), '2023-02-01')
+        self.assertIsNone(normalize_date('01.02.'))
+
+
+if __name__ == '__main__':
+    unittest.main()
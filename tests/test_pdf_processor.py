@@ -0,0 +1,115 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from typing import Dict, Iterator, List, Optional, Tuple
+from unittest import mock
+
+import pdf_processor
+
+
+class CreatePdfMetadataTest(unittest.TestCase):
+    """
+    Tests the extraction requests of a document.
+    """
+    PAGE_COUNT: int = 40
+    WORKERS: int = 2
+
+    def setUp(self) -> None:
+        self.lock: threading.Lock = threading.Lock()
+        self.finished_pages: int = 0
+        self.alive: List[int] = []
+        database: mock.Mock = mock.Mock()
+        database.find_pages.return_value = {}
+        patches = [
+            mock.patch.object(pdf_processor.db_handler, 'get_instance', return_value=database),
+            mock.patch.object(pdf_processor.setup, 'OCR_WORKERS', self.WORKERS),
+            mock.patch.object(pdf_processor.setup, 'PAGES_PER_REQUEST', 1),
+            mock.patch.object(pdf_processor, '_extract_page', side_effect=self.__extract_page)
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def __extract_page(self, pdf_hash: str, page_number: int, kind: str, *args, **kwargs) -> Dict[Tuple[int, str], any]:
+        time.sleep(0.002)
+        if kind == 'transactions':
+            with self.lock:
+                self.finished_pages += 1
+        return {(page_number, kind): {'transactions': []} if kind == 'transactions' else {'account_data': {}}}
+
+    def __render_pages(self) -> Iterator[Dict[str, any]]:
+        for page_number in range(self.PAGE_COUNT):
+            with self.lock:
+                # The pages rendered and not extracted yet, this one included.
+                self.alive.append(page_number + 1 - self.finished_pages)
+            yield {'page_number': page_number, 'page_path': None, 'image': b''}
+
+    def test_rendering_waits_for_the_requests(self) -> None:
+        metadata: Dict[str, any] = pdf_processor._create_pdf_metadata('a.pdf', self.__render_pages(), 'hash')
+        self.assertEqual(metadata['page_count'], self.PAGE_COUNT)
+        # Two pending requests per worker, the cover page has two requests, plus the page being rendered.
+        self.assertLessEqual(max(self.alive), 2 * self.WORKERS + 1)
+
+    def test_failed_request_stops_rendering(self) -> None:
+        pdf_processor._extract_page.side_effect = RuntimeError('rate limited')
+        with self.assertRaises(RuntimeError):
+            pdf_processor._create_pdf_metadata('a.pdf', self.__render_pages(), 'hash')
+        self.assertLess(len(self.alive), self.PAGE_COUNT)
+
+
+class WaitingJobTest(unittest.TestCase):
+    """
+    Tests the pdf files with the same content as a pdf in the pipeline.
+    """
+
+    def setUp(self) -> None:
+        workdir: tempfile.TemporaryDirectory = tempfile.TemporaryDirectory()
+        self.addCleanup(workdir.cleanup)
+        for directory in ('source', 'target', 'failed'):
+            os.makedirs(os.path.join(workdir.name, directory))
+        self.source: str = os.path.join(workdir.name, 'source')
+        self.target: str = os.path.join(workdir.name, 'target')
+        self.failed: str = os.path.join(workdir.name, 'failed')
+        self.database: mock.Mock = mock.Mock()
+        self.finished: Dict[str, Optional[Exception]] = {}
+        patches = [
+            mock.patch.object(pdf_processor.db_handler, 'get_instance', return_value=self.database),
+            mock.patch.object(pdf_processor.setup, 'TARGET_DIR', self.target),
+            mock.patch.object(pdf_processor.setup, 'FAILED_DIR', self.failed)
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def __job(self, name: str) -> Dict[str, any]:
+        filepath: str = os.path.join(self.source, name)
+        with open(filepath, 'wb') as f:
+            f.write(b'%PDF-1.4 statement')
+        return {'filepath': filepath, 'on_finished': self.finished.__setitem__}
+
+    def __run_copy_of_in_flight_pdf(self, imported: Optional[str]) -> None:
+        original: Dict[str, any] = {'pdf_hash': pdf_processor._hash_file(self.__job('a.pdf')['filepath'])}
+        pdf_processor._in_flight_hashes.add(original['pdf_hash'])
+        self.addCleanup(pdf_processor._in_flight_hashes.discard, original['pdf_hash'])
+        copy: Dict[str, any] = pdf_processor._extract(pdf_processor._rasterize(self.__job('b.pdf')))
+        pdf_processor._persist(copy, None)
+        self.assertEqual(self.finished, {})
+        self.assertTrue(os.path.exists(copy['filepath']))
+        self.database.find_document_by_hash.return_value = imported
+        pdf_processor._release_hash(original)
+
+    def test_copy_of_imported_pdf_is_skipped(self) -> None:
+        self.__run_copy_of_in_flight_pdf(imported='a.pdf')
+        self.assertEqual(self.finished, {os.path.join(self.source, 'b.pdf'): None})
+        self.assertEqual(os.listdir(self.target), ['b.pdf'])
+
+    def test_copy_of_failed_pdf_fails(self) -> None:
+        self.__run_copy_of_in_flight_pdf(imported=None)
+        self.assertIsNotNone(self.finished[os.path.join(self.source, 'b.pdf')])
+        self.assertEqual(os.listdir(self.failed), ['b.pdf'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import os
+import tempfile
+import unittest
+
+from ai.response_cache import ResponseCache
+
+
+class ResponseCacheTest(unittest.TestCase):
+    """
+    Tests the eviction of the response cache.
+    """
+    MAX_BYTES: int = 256 * 1024
+
+    def setUp(self) -> None:
+        self.workdir: tempfile.TemporaryDirectory = tempfile.TemporaryDirectory()
+        self.path: str = os.path.join(self.workdir.name, 'cache.db')
+
+    def tearDown(self) -> None:
+        self.workdir.cleanup()
+
+    def __open(self) -> ResponseCache:
+        cache: ResponseCache = ResponseCache(self.path, max_bytes=self.MAX_BYTES)
+        self.addCleanup(cache.conn.close)
+        return cache
+
+    def test_least_recently_used_responses_are_evicted(self) -> None:
+        cache: ResponseCache = self.__open()
+        for i in range(100):
+            cache.put(str(i), 'x' * 10000)
+            cache.get('0')
+        self.assertLessEqual(cache.stats()['size'], self.MAX_BYTES)
+        self.assertGreater(cache.stats()['evictions'], 0)
+        self.assertIsNotNone(cache.get('0'))
+        self.assertIsNone(cache.get('1'))
+        self.assertIsNotNone(cache.get('99'))
+
+    def test_size_is_shared_by_the_processes(self) -> None:
+        first: ResponseCache = self.__open()
+        second: ResponseCache = self.__open()
+        for i in range(50):
+            first.put(f'first {i}', 'x' * 10000)
+            second.put(f'second {i}', 'x' * 10000)
+        self.assertLessEqual(first.stats()['size'], self.MAX_BYTES)
+        self.assertEqual(first.conn.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+import fnmatch
+import glob
+import os
+import queue
+import threading
+import time
+from typing import Dict, Iterator, Optional, Set, Tuple
+
+import setup
+from log_handling import log_handler
+from log_handling.log_handler import Logger, Module
+
+logger: Logger = log_handler.get_instance()
+
+try:
+    from watchdog.events import FileSystemEvent, FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    # Without watchdog, the directory is polled.
+    FileSystemEventHandler = object
+    Observer = None
+
+
+class _EventHandler(FileSystemEventHandler):
+    """
+    Forwards the file system events of the watched directory to the watcher.
+    """
+
+    def __init__(self, events: queue.Queue):
+        """
+        Default constructor.
+        :param events: queue receiving the paths of created, modified and moved files.
+        """
+        super().__init__()
+        self.events: queue.Queue = events
+
+    def on_any_event(self, event: 'FileSystemEvent') -> None:
+        """
+        Handles a file system event.
+        :param event: the watchdog event.
+        :return:
+        """
+        if not event.is_directory:
+            self.events.put(getattr(event, 'dest_path', '') or event.src_path)
+
+
+class WatchHandler:
+    """
+    Watches a directory for new files, with inotify (watchdog) if available and polling otherwise.
+    A file is only reported once it is settled: its size and modification time did not change for a while,
+    so that files still being copied into the directory are not picked up.
+    """
+
+    def __init__(
+            self,
+            directory: str,
+            pattern: str = '*.pdf',
+            stop_event: Optional[threading.Event] = None,
+            poll_interval: float = setup.WATCH_POLL_INTERVAL,
+            settle_seconds: float = setup.WATCH_SETTLE_SECONDS
+    ):
+        """
+        Default constructor.
+        :param directory: the watched directory.
+        :param pattern: glob pattern of the reported files.
+        :param stop_event: ends the watch once set.
+        :param poll_interval: seconds between two scans of the directory.
+        :param settle_seconds: seconds a file must remain unchanged before it is reported.
+        """
+        self.directory: str = directory
+        self.pattern: str = pattern
+        self.stop_event: threading.Event = stop_event or threading.Event()
+        self.poll_interval: float = poll_interval
+        self.settle_seconds: float = settle_seconds
+        self.events: queue.Queue = queue.Queue()
+        # Files changing in size or modification time: (size, mtime, unchanged since).
+        self.pending: Dict[str, Tuple[int, float, float]] = {}
+        # Reported files, reported again only once they have left the directory.
+        self.reported: Set[str] = set()
+
+    def __start_observer(self) -> Optional[any]:
+        """
+        Starts the inotify observer, if watchdog is installed.
+        :return: the observer, or None if the directory is polled.
+        """
+        if Observer is None:
+            logger.info(f'Polling "{self.directory}" every {self.poll_interval}s.', module=Module.WATCH)
+            return None
+        try:
+            observer = Observer()
+            observer.schedule(_EventHandler(self.events), self.directory, recursive=False)
+            observer.start()
+            logger.info(f'Watching "{self.directory}" for new files.', module=Module.WATCH)
+            return observer
+        except Exception as e:
+            logger.error(f'Failed to watch "{self.directory}", polling instead. Trace:', e, module=Module.WATCH)
+            return None
+
+    def __scan(self) -> None:
+        """
+        Adds all matching files of the directory to the pending files and forgets reported files that left it.
+        :return:
+        """
+        files: Set[str] = set(glob.glob(os.path.join(self.directory, self.pattern)))
+        self.reported &= files
+        for filepath in files - self.reported:
+            self.pending.setdefault(filepath, (-1, -1, 0))
+
+    def __wait_for_events(self, timeout: float) -> None:
+        """
+        Collects the paths of the file system events into the pending files.
+        :param timeout: maximum time to wait for the first event.
+        :return:
+        """
+        try:
+            filepath: str = self.events.get(timeout=timeout)
+            while True:
+                # Files moved out of the directory are reported with their new path.
+                if os.path.dirname(os.path.abspath(filepath)) == os.path.abspath(self.directory) \
+                        and fnmatch.fnmatch(os.path.basename(filepath), self.pattern):
+                    filepath = os.path.join(self.directory, os.path.basename(filepath))
+                    self.reported.discard(filepath)
+                    self.pending.setdefault(filepath, (-1, -1, 0))
+                filepath = self.events.get_nowait()
+        except queue.Empty:
+            pass
+
+    def __pop_settled(self) -> Iterator[str]:
+        """
+        Checks the pending files and removes the settled files.
+        :return: an iterator over the settled files.
+        """
+        now: float = time.monotonic()
+        for filepath, (size, mtime, since) in list(self.pending.items()):
+            try:
+                stat: os.stat_result = os.stat(filepath)
+            except OSError:
+                # Removed or moved away before it settled.
+                del self.pending[filepath]
+                continue
+            if (stat.st_size, stat.st_mtime) != (size, mtime) or not stat.st_size:
+                self.pending[filepath] = (stat.st_size, stat.st_mtime, now)
+            elif now - since >= self.settle_seconds:
+                del self.pending[filepath]
+                self.reported.add(filepath)
+                yield filepath
+
+    def watch(self) -> Iterator[str]:
+        """
+        Yields the files of the directory as they arrive, beginning with the files already present.
+        The iterator ends once the stop event is set.
+        :return: an iterator over the settled files.
+        """
+        observer = self.__start_observer()
+        # The directory is scanned regularly even with inotify, in case events were missed.
+        rescan_interval: float = self.poll_interval if observer is None else max(30.0, self.poll_interval)
+        last_scan: float = float('-inf')
+        try:
+            while not self.stop_event.is_set():
+                if time.monotonic() - last_scan >= rescan_interval:
+                    self.__scan()
+                    last_scan = time.monotonic()
+                for filepath in self.__pop_settled():
+                    logger.info(f'New file "{filepath}".', module=Module.WATCH)
+                    yield filepath
+                    if self.stop_event.is_set():
+                        return
+                # Pending files are re-checked until they settle.
+                timeout: float = min(self.poll_interval, self.settle_seconds) if self.pending else self.poll_interval
+                if observer is None:
+                    self.stop_event.wait(timeout)
+                else:
+                    self.__wait_for_events(timeout)
+        finally:
+            if observer is not None:
+                observer.stop()
+                observer.join()
+            logger.info(f'Stopped watching "{self.directory}".', module=Module.WATCH)